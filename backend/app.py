@@ -4,7 +4,10 @@ from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
 import os
 from datetime import timedelta
+from werkzeug.serving import is_running_from_reloader
 from database import init_db
+from utils.fingerprint_engines import get_selected_engines
+from utils.fingerprint_pool import init_fingerprint_pool
 from routes.auth_routes import auth_bp
 from routes.user_routes import user_bp
 from routes.device_routes import device_bp
@@ -15,44 +18,76 @@ from routes.log_routes import log_bp
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
 
-# Configure JWT
-app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", "princeoflight")
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
-app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=30)
-jwt = JWTManager(app)
+def start_fingerprint_workers():
+    """
+    Select the fingerprint stage engines and start the worker pool, so no
+    request pays for the engine benchmark; the pool hands the selection
+    to its workers.
+    """
+    get_selected_engines()
+    init_fingerprint_pool()
 
-# Initialize database
-db = init_db()
 
-# Register blueprints
-app.register_blueprint(auth_bp, url_prefix="/api/auth")
-app.register_blueprint(user_bp, url_prefix="/api/users")
-app.register_blueprint(device_bp, url_prefix="/api/devices")
-app.register_blueprint(partition_bp, url_prefix="/api/partitions")
-app.register_blueprint(file_bp, url_prefix="/api/files")
-app.register_blueprint(log_bp, url_prefix="/api/logs")
+def create_app(start_workers=True):
+    """
+    Create the API application.
 
+    Nothing runs at import, so fingerprint pool workers started with
+    "spawn", which re-import the main module, do not connect to MongoDB
+    or start pools of their own.
 
-# Root route
-@app.route("/")
-def index():
-    return jsonify({"message": "Welcome to SecureNight API"})
+    Args:
+        start_workers (bool): Start the fingerprint workers now; off for
+            processes that never serve requests
 
+    Returns:
+        Flask: The application
+    """
+    # Initialize Flask app
+    app = Flask(__name__)
+    CORS(app)
 
-# Error handlers
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({"error": "Not found"}), 404
+    # Configure JWT
+    app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", "princeoflight")
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=30)
+    JWTManager(app)
 
+    # Initialize database
+    init_db()
 
-@app.errorhandler(500)
-def server_error(error):
-    return jsonify({"error": "Server error"}), 500
+    if start_workers:
+        start_fingerprint_workers()
+
+    # Register blueprints
+    app.register_blueprint(auth_bp, url_prefix="/api/auth")
+    app.register_blueprint(user_bp, url_prefix="/api/users")
+    app.register_blueprint(device_bp, url_prefix="/api/devices")
+    app.register_blueprint(partition_bp, url_prefix="/api/partitions")
+    app.register_blueprint(file_bp, url_prefix="/api/files")
+    app.register_blueprint(log_bp, url_prefix="/api/logs")
+
+    # Root route
+    @app.route("/")
+    def index():
+        return jsonify({"message": "Welcome to SecureNight API"})
+
+    # Error handlers
+    @app.errorhandler(404)
+    def not_found(error):
+        return jsonify({"error": "Not found"}), 404
+
+    @app.errorhandler(500)
+    def server_error(error):
+        return jsonify({"error": "Server error"}), 500
+
+    return app
 
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5000, host="0.0.0.0")
+    debug = True
+    # The debug reloader's watcher process only restarts the server; the
+    # child it runs serves the requests and starts the fingerprint workers
+    app = create_app(start_workers=not debug or is_running_from_reloader())
+    app.run(debug=debug, port=5000, host="0.0.0.0")
@@ -0,0 +1,267 @@
+"""
+Benchmark and golden-hash check for the fingerprint pipeline.
+
+Runs offline, no MongoDB or Flask needed. From the backend directory:
+
+    python benchmarks/fingerprint_benchmark.py
+    python benchmarks/fingerprint_benchmark.py --sizes 256 512 --iterations 5
+    python benchmarks/fingerprint_benchmark.py --golden-only
+    python benchmarks/fingerprint_benchmark.py --record-golden
+
+The benchmark generates synthetic ridge patterns and reports images/sec and
+per-stage latency percentiles. The golden check processes every image in
+benchmarks/golden/ and compares the result with golden_hashes.json, where
+captures the quality gate must reject are recorded as "rejected"; the
+script exits with status 1 if any result changed.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from utils.fingerprint_utils import process_fingerprint, FingerprintQualityError
+from utils.fingerprint_engines import get_selected_engines
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+GOLDEN_HASHES = os.path.join(GOLDEN_DIR, "golden_hashes.json")
+
+DEFAULT_SIZES = (256, 512, 768, 1024)
+STAGES = (
+    "decode",
+    "quality",
+    "region_detection",
+    "normalization",
+    "enhancement",
+    "thinning",
+    "minutiae_extraction",
+    "filtering",
+    "hashing",
+)
+
+
+def generate_ridge_image(size, seed=0):
+    """
+    Generate a synthetic fingerprint-like grayscale image.
+
+    Concentric, slightly twisted ridges inside an elliptical finger area,
+    on a light background with sensor noise. Ridge pitch scales with the
+    image so every size has a similar number of ridges.
+
+    Args:
+        size (int): Width and height in pixels
+        seed (int): Random seed for the ridge centre, twist and noise
+
+    Returns:
+        numpy.ndarray: 2D uint8 image
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+
+    cx = size / 2 + rng.uniform(-0.05, 0.05) * size
+    cy = size / 2 + rng.uniform(-0.05, 0.05) * size
+    radius = np.hypot(xx - cx, (yy - cy) * 1.3)
+    angle = np.arctan2(yy - cy, xx - cx)
+
+    pitch = size / 28.0
+    phase = 2 * np.pi * radius / pitch + 1.5 * np.sin(2 * angle + rng.uniform(0, 6))
+    ridges = 0.5 + 0.5 * np.cos(phase)
+
+    finger = np.clip(1.2 - radius / (size * 0.45), 0, 1)
+    image = 255 - ridges * finger * 200
+    image += rng.normal(0, 12, image.shape)
+
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def encode_image(gray, fmt="PNG", mode="L"):
+    """Encode a grayscale array the way a scanner client would upload it"""
+    buffer = io.BytesIO()
+    Image.fromarray(gray).convert(mode).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def percentile_ms(samples, fraction):
+    return float(np.percentile(np.asarray(samples) * 1000.0, fraction * 100))
+
+
+def run_benchmark(sizes, iterations, seed=0):
+    """
+    Time process_fingerprint on synthetic images of each size.
+
+    Returns:
+        list: One result dict per size with throughput and stage percentiles
+    """
+    results = []
+
+    for size in sizes:
+        images = [
+            encode_image(generate_ridge_image(size, seed + i))
+            for i in range(iterations)
+        ]
+        stage_samples = {stage: [] for stage in STAGES}
+
+        def stage_hook(stage, seconds, info):
+            stage_samples[stage].append(seconds)
+
+        # Warm up so one-time imports and table builds are not measured
+        process_fingerprint(images[0])
+
+        started = time.perf_counter()
+        for image in images:
+            process_fingerprint(image, stage_hook=stage_hook)
+        elapsed = time.perf_counter() - started
+
+        results.append(
+            {
+                "size": size,
+                "images": iterations,
+                "images_per_sec": iterations / elapsed,
+                "mean_ms": elapsed / iterations * 1000.0,
+                "stages": {
+                    stage: {
+                        "p50_ms": percentile_ms(samples, 0.50),
+                        "p95_ms": percentile_ms(samples, 0.95),
+                        "max_ms": max(samples) * 1000.0,
+                    }
+                    for stage, samples in stage_samples.items()
+                    if samples
+                },
+            }
+        )
+
+    return results
+
+
+def load_golden_hashes():
+    if not os.path.exists(GOLDEN_HASHES):
+        return {}
+    with open(GOLDEN_HASHES) as f:
+        return json.load(f)
+
+
+def golden_result(path):
+    """Hash of a golden image, or "rejected" if it fails the quality gate"""
+    with open(path, "rb") as f:
+        try:
+            return process_fingerprint(f.read())
+        except FingerprintQualityError:
+            return "rejected"
+
+
+def check_golden():
+    """
+    Process every golden image and compare with its recorded hash.
+
+    Returns:
+        list: (file name, expected hash, actual hash) for each mismatch
+    """
+    mismatches = []
+
+    for name, expected in sorted(load_golden_hashes().items()):
+        actual = golden_result(os.path.join(GOLDEN_DIR, name))
+        if actual != expected:
+            mismatches.append((name, expected, actual))
+
+    return mismatches
+
+
+def record_golden():
+    """Recompute and store the hash of every image in the golden directory"""
+    hashes = {}
+
+    for name in sorted(os.listdir(GOLDEN_DIR)):
+        if name == os.path.basename(GOLDEN_HASHES):
+            continue
+        hashes[name] = golden_result(os.path.join(GOLDEN_DIR, name))
+
+    with open(GOLDEN_HASHES, "w") as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    return hashes
+
+
+def print_benchmark(results):
+    for result in results:
+        print(
+            f"{result['size']}x{result['size']}: "
+            f"{result['images_per_sec']:.2f} images/sec, "
+            f"{result['mean_ms']:.1f} ms/image"
+        )
+        for stage, stats in result["stages"].items():
+            print(
+                f"  {stage:<20} p50 {stats['p50_ms']:8.2f} ms"
+                f"  p95 {stats['p95_ms']:8.2f} ms"
+                f"  max {stats['max_ms']:8.2f} ms"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--golden-only", action="store_true")
+    parser.add_argument("--skip-golden", action="store_true")
+    parser.add_argument(
+        "--record-golden",
+        action="store_true",
+        help="overwrite golden_hashes.json with the current pipeline output",
+    )
+    args = parser.parse_args(argv)
+
+    if args.record_golden:
+        hashes = record_golden()
+        print(f"Recorded {len(hashes)} golden hashes")
+        return 0
+
+    output = {"engines": get_selected_engines()}
+    if not args.json:
+        print(
+            "Engines: "
+            + ", ".join(f"{stage}={name}" for stage, name in output["engines"].items())
+        )
+
+    if not args.golden_only:
+        output["benchmark"] = run_benchmark(args.sizes, args.iterations, args.seed)
+        if not args.json:
+            print_benchmark(output["benchmark"])
+
+    status = 0
+    if not args.skip_golden:
+        mismatches = check_golden()
+        output["golden"] = {
+            "checked": len(load_golden_hashes()),
+            "mismatches": [
+                {"file": name, "expected": expected, "actual": actual}
+                for name, expected, actual in mismatches
+            ],
+        }
+        if not args.json:
+            print(
+                f"Golden hashes: {output['golden']['checked']} checked, "
+                f"{len(mismatches)} mismatched"
+            )
+            for name, expected, actual in mismatches:
+                print(f"  {name}: expected {expected}, got {actual}")
+        if mismatches:
+            status = 1
+
+    if args.json:
+        print(json.dumps(output, indent=2))
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,9 +26,15 @@ def init_db():
     # Create indexes
     db.users.create_index("email", unique=True)
     db.users.create_index("username", unique=True)
+    db.users.create_index("fingerprint_hashes")
     db.devices.create_index("device_id", unique=True)
     db.partitions.create_index("partition_id", unique=True)
     db.files.create_index("file_id", unique=True)
+    db.fingerprint_jobs.create_index("job_id", unique=True)
+    db.fingerprint_jobs.create_index(
+        "created_at",
+        expireAfterSeconds=int(os.environ.get("FINGERPRINT_JOB_TTL", 3600)),
+    )
 
     return db
 
@@ -53,6 +59,7 @@ def create_admin_user():
         "phone_number": "+1234567890",
         "fingerprint_hashes": [],
         "fingerprint_pictures": [],
+        "fingerprint_templates": [],
         "last_login": None,
         "last_logout": None,
         "account_status": "active",
@@ -77,6 +84,7 @@ def create_client_user():
         "phone_number": "+1234567890",
         "fingerprint_hashes": [],
         "fingerprint_pictures": [],
+        "fingerprint_templates": [],
         "last_login": None,
         "last_logout": None,
         "account_status": "active",
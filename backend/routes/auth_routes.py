@@ -9,7 +9,20 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import datetime
 import uuid
 from database import get_db, serialize_doc
-from utils.fingerprint_utils import process_fingerprint
+from utils.fingerprint_pool import FingerprintTimeoutError
+from utils.fingerprint_cache import (
+    get_fingerprint_features,
+    get_fingerprint_features_batch,
+)
+from utils.fingerprint_matching import identify_fingerprint, verify_fingerprint
+from utils.fingerprint_enroll import build_template, enroll_fingerprint_templates
+from utils.fingerprint_utils import FingerprintQualityError
+from utils.fingerprint_jobs import (
+    submit_enrollment_job,
+    get_job,
+    FingerprintQueueFullError,
+)
+from utils.fingerprint_upload import read_fingerprint_request, FingerprintUploadError
 from utils.validators import validate_email, validate_password
 from bson import ObjectId
 from utils.log_utils import save_log
@@ -19,6 +32,9 @@ import numpy as np
 import cv2
 from PIL import Image
 import io
+import os
+import math
+import time
 
 
 auth_bp = Blueprint("auth", __name__)
@@ -80,6 +96,7 @@ def register():
         "phone_number": data["phone_number"],
         "fingerprint_hashes": [],
         "fingerprint_pictures": [],
+        "fingerprint_templates": [],
         "last_login": None,
         "last_logout": None,
         "account_status": "active",
@@ -111,9 +128,21 @@ def register():
 
 @auth_bp.route("/login", methods=["POST"])
 def login():
-    data = request.get_json()
     db = get_db()
 
+    # JSON, or a multipart / raw binary fingerprint upload
+    try:
+        data, fingerprint_binary = read_fingerprint_request()
+    except FingerprintUploadError as e:
+        save_log(
+            log_type="auth",
+            message=f"Login failed - {str(e)}",
+            source="auth_routes.login",
+            ip_address=request.remote_addr,
+            status="warning",
+        )
+        return jsonify({"error": str(e)}), e.status
+
     # Check login method
     if "email" in data and "password" in data:
         # Email/password login
@@ -129,13 +158,22 @@ def login():
             )
             return jsonify({"error": "Invalid email or password"}), 401
 
-    elif "fingerprint" in data:
-        # Fingerprint login with base64 encoded image
-        fingerprint_b64 = data["fingerprint"]
-
+    elif fingerprint_binary is not None or "fingerprint" in data:
+        # Fingerprint login with an uploaded or base64 encoded image
         try:
-            # Process the base64 encoded fingerprint image
-            if isinstance(fingerprint_b64, str):
+            if fingerprint_binary is None:
+                fingerprint_b64 = data["fingerprint"]
+
+                if not isinstance(fingerprint_b64, str):
+                    save_log(
+                        log_type="auth",
+                        message="Login failed - Fingerprint data must be a base64 string",
+                        source="auth_routes.login",
+                        ip_address=request.remote_addr,
+                        status="error",
+                    )
+                    return jsonify({"error": "Invalid fingerprint format"}), 400
+
                 # Remove data URL prefix if present
                 if fingerprint_b64.startswith("data:image"):
                     fingerprint_b64 = fingerprint_b64.split(",")[1]
@@ -143,41 +181,90 @@ def login():
                 # Decode base64 to binary
                 fingerprint_binary = base64.b64decode(fingerprint_b64)
 
-                # Process the fingerprint image and get the hash
-                fingerprint_hash = process_fingerprint(fingerprint_binary)
+            # Process the fingerprint image and get the hash and minutiae
+            features = get_fingerprint_features(fingerprint_binary)
+            fingerprint_hash = features["hash"]
 
-            else:
-                save_log(
-                    log_type="auth",
-                    message="Login failed - Fingerprint data must be a base64 string",
-                    source="auth_routes.login",
-                    ip_address=request.remote_addr,
-                    status="error",
-                )
-                return jsonify({"error": "Invalid fingerprint format"}), 400
+        except FingerprintQualityError as e:
+            save_log(
+                log_type="auth",
+                message=f"Login failed - {str(e)}",
+                details={"quality": e.scores},
+                source="auth_routes.login",
+                ip_address=request.remote_addr,
+                status="warning",
+            )
+            return jsonify({"error": str(e), "quality": e.scores}), 422
 
-        except Exception as e:
+        except FingerprintTimeoutError as e:
             save_log(
                 log_type="auth",
-                message=f"Login failed - Error processing fingerprint data: {str(e)}",
+                message=f"Login failed - {str(e)}",
                 source="auth_routes.login",
                 ip_address=request.remote_addr,
                 status="error",
             )
-            return jsonify({"error": "Invalid fingerprint format"}), 400
-
-        # Find user by fingerprint hash (checking if hash exists in the fingerprint_hashes array)
-        user = db.users.find_one({"fingerprint_hashes": {"$in": [fingerprint_hash]}})
+            return jsonify({"error": "Fingerprint processing timed out"}), 503
 
-        if not user:
+        except Exception as e:
             save_log(
                 log_type="auth",
-                message="Login failed - Fingerprint not recognized",
+                message=f"Login failed - Error processing fingerprint data: {str(e)}",
                 source="auth_routes.login",
                 ip_address=request.remote_addr,
-                status="warning",
+                status="error",
+            )
+            return jsonify({"error": "Invalid fingerprint format"}), 400
+
+        if "email" in data:
+            # Claimed identity: only compare with the templates of that user
+            user = db.users.find_one({"email": data["email"]})
+
+            if not user:
+                save_log(
+                    log_type="auth",
+                    message=f"Login failed - Invalid credentials for email: {data['email']}",
+                    source="auth_routes.login",
+                    ip_address=request.remote_addr,
+                    status="warning",
+                )
+                return jsonify({"error": "Invalid email or fingerprint"}), 401
+
+            if fingerprint_hash not in user.get("fingerprint_hashes", []):
+                verification = verify_fingerprint(features["minutiae"], user)
+                if not verification["matched"]:
+                    save_log(
+                        log_type="auth",
+                        message=f"Login failed - Fingerprint does not match email: {data['email']}",
+                        user_id=user.get("user_id"),
+                        details={"score": verification["score"]},
+                        source="auth_routes.login",
+                        ip_address=request.remote_addr,
+                        status="warning",
+                    )
+                    return jsonify({"error": "Invalid email or fingerprint"}), 401
+
+        else:
+            # Find user by fingerprint hash (checking if hash exists in the fingerprint_hashes array)
+            user = db.users.find_one(
+                {"fingerprint_hashes": {"$in": [fingerprint_hash]}}
             )
-            return jsonify({"error": "Fingerprint not recognized"}), 401
+
+            if not user:
+                # No exact hash match, identify and verify the finger
+                match = identify_fingerprint(features["minutiae"])
+                if match:
+                    user = db.users.find_one({"_id": ObjectId(match[0])})
+
+            if not user:
+                save_log(
+                    log_type="auth",
+                    message="Login failed - Fingerprint not recognized",
+                    source="auth_routes.login",
+                    ip_address=request.remote_addr,
+                    status="warning",
+                )
+                return jsonify({"error": "Fingerprint not recognized"}), 401
     else:
         save_log(
             log_type="auth",
@@ -382,17 +469,40 @@ def reset_password():
 @jwt_required()
 def update_fingerprint():
     user_id = get_jwt_identity()
-    data = request.get_json()
     db = get_db()
 
-    if "fingerprint" not in data:
-        return jsonify({"error": "Fingerprint data is required"}), 400
+    # JSON, or a multipart / raw binary fingerprint upload
+    try:
+        data, fingerprint_binary = read_fingerprint_request()
+    except FingerprintUploadError as e:
+        save_log(
+            log_type="auth",
+            message=f"Fingerprint update failed - {str(e)}",
+            user_id=user_id,
+            source="auth_routes.update_fingerprint",
+            ip_address=request.remote_addr,
+            status="warning",
+        )
+        return jsonify({"error": str(e)}), e.status
 
-    fingerprint_b64 = data["fingerprint"]
+    if fingerprint_binary is None and "fingerprint" not in data:
+        return jsonify({"error": "Fingerprint data is required"}), 400
 
     try:
-        # Process the base64 encoded fingerprint image
-        if isinstance(fingerprint_b64, str):
+        if fingerprint_binary is None:
+            fingerprint_b64 = data["fingerprint"]
+
+            if not isinstance(fingerprint_b64, str):
+                save_log(
+                    log_type="auth",
+                    message="Fingerprint update failed - Fingerprint data must be a base64 string",
+                    user_id=user_id,
+                    source="auth_routes.update_fingerprint",
+                    ip_address=request.remote_addr,
+                    status="error",
+                )
+                return jsonify({"error": "Invalid fingerprint format"}), 400
+
             # Remove data URL prefix if present
             if fingerprint_b64.startswith("data:image"):
                 fingerprint_b64 = fingerprint_b64.split(",")[1]
@@ -400,19 +510,32 @@ def update_fingerprint():
             # Decode base64 to binary
             fingerprint_binary = base64.b64decode(fingerprint_b64)
 
-            # Process the fingerprint image and get the hash
-            fingerprint_hash = process_fingerprint(fingerprint_binary)
+        # Process the fingerprint image and get the hash and minutiae
+        features = get_fingerprint_features(fingerprint_binary)
+        fingerprint_hash = features["hash"]
 
-        else:
-            save_log(
-                log_type="auth",
-                message="Fingerprint update failed - Fingerprint data must be a base64 string",
-                user_id=user_id,
-                source="auth_routes.update_fingerprint",
-                ip_address=request.remote_addr,
-                status="error",
-            )
-            return jsonify({"error": "Invalid fingerprint format"}), 400
+    except FingerprintQualityError as e:
+        save_log(
+            log_type="auth",
+            message=f"Fingerprint update failed - {str(e)}",
+            user_id=user_id,
+            details={"quality": e.scores},
+            source="auth_routes.update_fingerprint",
+            ip_address=request.remote_addr,
+            status="warning",
+        )
+        return jsonify({"error": str(e), "quality": e.scores}), 422
+
+    except FingerprintTimeoutError as e:
+        save_log(
+            log_type="auth",
+            message=f"Fingerprint update failed - {str(e)}",
+            user_id=user_id,
+            source="auth_routes.update_fingerprint",
+            ip_address=request.remote_addr,
+            status="error",
+        )
+        return jsonify({"error": "Fingerprint processing timed out"}), 503
 
     except Exception as e:
         save_log(
@@ -426,14 +549,7 @@ def update_fingerprint():
         return jsonify({"error": "Invalid fingerprint format"}), 400
 
     # Update user's fingerprint
-    db.users.update_one(
-        {"_id": ObjectId(user_id)},
-        {
-            "$push": {
-                "fingerprint_hashes": fingerprint_hash,
-            }
-        },
-    )
+    enroll_fingerprint_templates(user_id, [build_template(features)])
 
     save_log(
         log_type="auth",
@@ -453,3 +569,198 @@ def update_fingerprint():
         ),
         200,
     )
+
+
+@auth_bp.route("/enroll-fingerprints", methods=["POST"])
+@jwt_required()
+def enroll_fingerprints():
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True)
+
+    captures = data.get("fingerprints") if isinstance(data, dict) else None
+    if not isinstance(captures, list) or not captures:
+        return jsonify({"error": "A list of fingerprints is required"}), 400
+
+    max_captures = int(os.environ.get("FINGERPRINT_ENROLL_MAX_CAPTURES", 10))
+    if len(captures) > max_captures:
+        return (
+            jsonify({"error": f"At most {max_captures} fingerprints per request"}),
+            400,
+        )
+
+    results = [{"index": i} for i in range(len(captures))]
+    binaries = []
+    decoded = []
+
+    for i, fingerprint_b64 in enumerate(captures):
+        try:
+            if not isinstance(fingerprint_b64, str):
+                raise ValueError("Fingerprint data must be a base64 string")
+
+            # Remove data URL prefix if present
+            if fingerprint_b64.startswith("data:image"):
+                fingerprint_b64 = fingerprint_b64.split(",")[1]
+
+            binaries.append(base64.b64decode(fingerprint_b64))
+            decoded.append(i)
+
+        except Exception:
+            results[i].update(
+                {"status": "error", "error": "Invalid fingerprint format"}
+            )
+
+    # Run every capture through the pipeline in parallel on the worker pool
+    started = datetime.datetime.utcnow()
+    batch_start = time.perf_counter()
+    processed = get_fingerprint_features_batch(binaries)
+    elapsed_ms = (time.perf_counter() - batch_start) * 1000.0
+    templates = []
+
+    for i, (features, timings, cached) in zip(decoded, processed):
+        result = results[i]
+        result["cached"] = cached
+        result["timings_ms"] = {
+            stage: seconds * 1000.0 for stage, seconds, _ in timings
+        }
+        result["total_ms"] = sum(result["timings_ms"].values())
+
+        if isinstance(features, FingerprintQualityError):
+            result.update(
+                {
+                    "status": "rejected",
+                    "error": str(features),
+                    "quality": features.scores,
+                }
+            )
+        elif isinstance(features, FingerprintTimeoutError):
+            result.update(
+                {"status": "error", "error": "Fingerprint processing timed out"}
+            )
+        elif isinstance(features, Exception):
+            result.update({"status": "error", "error": "Invalid fingerprint format"})
+        else:
+            result.update(
+                {
+                    "status": "enrolled",
+                    "fingerprint_hash": features["hash"],
+                    "quality": features["quality"],
+                }
+            )
+            templates.append(build_template(features, started))
+
+    if templates:
+        # One update for the whole batch
+        enroll_fingerprint_templates(user_id, templates)
+
+    save_log(
+        log_type="auth",
+        message=f"Fingerprint enrollment: {len(templates)} of {len(captures)} captures enrolled",
+        user_id=user_id,
+        details={
+            "captures": [
+                {key: result.get(key) for key in ("index", "status", "total_ms")}
+                for result in results
+            ]
+        },
+        source="auth_routes.enroll_fingerprints",
+        ip_address=request.remote_addr,
+        status="info" if templates else "warning",
+    )
+
+    return (
+        jsonify(
+            {
+                "message": f"{len(templates)} of {len(captures)} fingerprints enrolled",
+                "enrolled": len(templates),
+                "elapsed_ms": elapsed_ms,
+                "captures": results,
+            }
+        ),
+        200 if templates else 422,
+    )
+
+
+@auth_bp.route("/fingerprint-jobs", methods=["POST"])
+@jwt_required()
+def submit_fingerprint_job():
+    user_id = get_jwt_identity()
+
+    try:
+        data, fingerprint_binary = read_fingerprint_request()
+    except FingerprintUploadError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    if fingerprint_binary is None and "fingerprint" not in data:
+        return jsonify({"error": "Fingerprint data is required"}), 400
+
+    try:
+        if fingerprint_binary is None:
+            fingerprint_b64 = data["fingerprint"]
+            if not isinstance(fingerprint_b64, str):
+                raise ValueError("Fingerprint data must be a base64 string")
+
+            # Remove data URL prefix if present
+            if fingerprint_b64.startswith("data:image"):
+                fingerprint_b64 = fingerprint_b64.split(",")[1]
+
+            fingerprint_binary = base64.b64decode(fingerprint_b64)
+
+    except Exception as e:
+        save_log(
+            log_type="auth",
+            message=f"Fingerprint job rejected - Invalid fingerprint data: {str(e)}",
+            user_id=user_id,
+            source="auth_routes.submit_fingerprint_job",
+            ip_address=request.remote_addr,
+            status="error",
+        )
+        return jsonify({"error": "Invalid fingerprint format"}), 400
+
+    # The capture is processed in the background; poll the job for the result
+    try:
+        job = submit_enrollment_job(user_id, fingerprint_binary)
+    except FingerprintQueueFullError as e:
+        save_log(
+            log_type="auth",
+            message=f"Fingerprint job rejected - {str(e)}",
+            user_id=user_id,
+            source="auth_routes.submit_fingerprint_job",
+            ip_address=request.remote_addr,
+            status="warning",
+        )
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+
+    save_log(
+        log_type="auth",
+        message=f"Fingerprint enrollment job submitted: {job['job_id']}",
+        user_id=user_id,
+        source="auth_routes.submit_fingerprint_job",
+        ip_address=request.remote_addr,
+        status="info",
+    )
+
+    return jsonify({"job_id": job["job_id"], "status": job["status"]}), 202
+
+
+@auth_bp.route("/fingerprint-jobs/<job_id>", methods=["GET"])
+@jwt_required()
+def get_fingerprint_job(job_id):
+    user_id = get_jwt_identity()
+
+    # ?wait=N long-polls for up to N seconds until the job finishes
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        wait = math.nan
+    if not math.isfinite(wait):
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+
+    max_wait = float(os.environ.get("FINGERPRINT_JOB_MAX_WAIT", 30))
+    job = get_job(job_id, user_id, wait=min(max(wait, 0.0), max_wait))
+
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify({"job": job}), 200
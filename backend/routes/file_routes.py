@@ -1,15 +1,29 @@
 import base64
-from flask import Blueprint, request, jsonify, send_file
+from urllib.parse import quote
+from flask import Blueprint, request, jsonify, send_file, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson import ObjectId
 import datetime
 import uuid
 import os
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
 from database import serialize_doc, get_db
 from utils.file_utils import (
     simple_decrypt_bytes,
-    simple_encrypt_bytes,
+    UploadWriter,
+    DecryptingReader,
+    iter_plaintext,
 )
 from utils.log_utils import save_log
 
@@ -170,9 +184,7 @@ def get_file(file_id):
 
         # Check if file exists
         if os.path.exists(file_path):
-            # Read the file
-            with open(file_path, "rb") as f:
-                file_data = f.read()
+            fingerprint = None
 
             # Decrypt if necessary
             if file.get("encrypted", False):
@@ -190,12 +202,31 @@ def get_file(file_id):
                     return jsonify({"error": "No fingerprints registered"}), 400
 
                 fingerprint = fingerprint_hashes[0]
-                file_data = simple_decrypt_bytes(file_data, fingerprint)
+
+            # ?offset=&length= previews a window of the file, e.g. the
+            # first lines of a large log; only that window is decrypted
+            try:
+                offset = max(0, int(request.args.get("offset", 0)))
+                length = request.args.get("length")
+                length = None if length is None else max(0, int(length))
+            except ValueError:
+                return jsonify({"error": "offset and length must be integers"}), 400
+
+            with DecryptingReader.open(
+                file_path, fingerprint, file.get("cipher", "xor")
+            ) as reader:
+                reader.seek(offset)
+                file_data = reader.read(-1 if length is None else length)
+                plaintext_size = reader.size
 
             # Add base64 encoded data to file object
             file_copy = dict(file)  # Create a copy to avoid modifying the original
             file_copy["file_data"] = base64.b64encode(file_data).decode("utf-8")
             file_copy["mime_type"] = get_mime_type(file.get("file_name"))
+            if offset or length is not None:
+                file_copy["file_data_offset"] = offset
+                file_copy["file_data_length"] = len(file_data)
+                file_copy["file_data_total"] = plaintext_size
         else:
             save_log(
                 log_type="file",
@@ -250,79 +281,99 @@ def get_file(file_id):
 @jwt_required()
 def upload_file():
     db = get_db()
-    # Check if file is in request
-    if "file" not in request.files:
-        save_log(
-            log_type="file",
-            message="File upload failed - No file part",
-            source="file_routes.upload_file",
-            ip_address=request.remote_addr,
-            status="warning",
-        )
-        return jsonify({"error": "No file part"}), 400
 
-    file = request.files["file"]
+    # Get current user
+    current_user_id = get_jwt_identity()
+    current_user = db.users.find_one({"_id": ObjectId(current_user_id)})
 
-    # Check if file is selected
-    if file.filename == "":
-        save_log(
-            log_type="file",
-            message="File upload failed - No file selected",
-            source="file_routes.upload_file",
-            ip_address=request.remote_addr,
-            status="warning",
-        )
-        return jsonify({"error": "No file selected"}), 400
+    # Use the first fingerprint hash for encryption
+    fingerprint_hashes = current_user.get("fingerprint_hashes", [])
+    fingerprint = fingerprint_hashes[0] if fingerprint_hashes else None
 
-    # Get form data
-    partition_id = request.form.get("partition_id")
-    encrypt = request.form.get("encrypt", "true").lower() == "true"
+    # Create uploads directory if it doesn't exist
+    upload_dir = os.path.join(os.getcwd(), "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
 
-    # Validate partition
-    partition = db.partitions.find_one({"partition_id": partition_id})
-    if not partition:
-        save_log(
-            log_type="file",
-            message=f"File upload failed - Partition not found: {partition_id}",
-            source="file_routes.upload_file",
-            ip_address=request.remote_addr,
-            status="warning",
-        )
-        return jsonify({"error": "Partition not found"}), 404
+    # Stream the multipart body: file parts are hashed and encrypted into
+    # temporary files in uploads/ while they are received, instead of
+    # being buffered in memory. Whether to encrypt is decided from the
+    # "encrypt" field, so clients send it before the file.
+    writers = []
 
-    # Check if partition is active
-    if partition.get("status") != "active":
-        save_log(
-            log_type="file",
-            message=f"File upload failed - Partition not active: {partition_id}",
-            source="file_routes.upload_file",
-            ip_address=request.remote_addr,
-            status="warning",
-        )
-        return jsonify({"error": "Partition is not active"}), 400
+    def open_upload(fields, part):
+        encrypt = fields.get("encrypt", "true").lower() == "true"
+        writer = UploadWriter(upload_dir, fingerprint if encrypt else None)
+        writers.append(writer)
+        return writer
 
-    # Get current user
-    current_user_id = get_jwt_identity()
-    current_user = db.users.find_one({"_id": ObjectId(current_user_id)})
+    try:
+        if request.mimetype == "multipart/form-data":
+            try:
+                form, files = parse_upload(
+                    request.stream,
+                    request.mimetype_params.get("boundary", "").encode("ascii"),
+                    open_upload,
+                    max_form_memory_size=request.max_form_memory_size,
+                    max_form_parts=request.max_form_parts,
+                )
+            except ValueError:
+                form, files = MultiDict(), MultiDict()
+        else:
+            form, files = request.form, MultiDict()
 
-    # Secure filename
-    filename = secure_filename(file.filename)
+        # Check if file is in request
+        if "file" not in files:
+            save_log(
+                log_type="file",
+                message="File upload failed - No file part",
+                source="file_routes.upload_file",
+                ip_address=request.remote_addr,
+                status="warning",
+            )
+            return jsonify({"error": "No file part"}), 400
 
-    file_id = str(uuid.uuid4())
+        file = files["file"]
+        upload = file.stream
 
-    # Read file data directly into memory
-    file_data = file.read()
-    file_size = len(file_data)
+        # Check if file is selected
+        if file.filename == "":
+            save_log(
+                log_type="file",
+                message="File upload failed - No file selected",
+                source="file_routes.upload_file",
+                ip_address=request.remote_addr,
+                status="warning",
+            )
+            return jsonify({"error": "No file selected"}), 400
 
-    # Get file type
-    file_type = filename.split(".")[-1].upper() if "." in filename else "UNKNOWN"
+        # Get form data
+        partition_id = form.get("partition_id")
+        encrypt = form.get("encrypt", "true").lower() == "true"
 
-    # Encrypt file if requested
-    if encrypt:
-        # Get the first fingerprint hash from the user's profile
-        fingerprint_hashes = current_user.get("fingerprint_hashes", [])
+        # Validate partition
+        partition = db.partitions.find_one({"partition_id": partition_id})
+        if not partition:
+            save_log(
+                log_type="file",
+                message=f"File upload failed - Partition not found: {partition_id}",
+                source="file_routes.upload_file",
+                ip_address=request.remote_addr,
+                status="warning",
+            )
+            return jsonify({"error": "Partition not found"}), 404
 
-        if not fingerprint_hashes:
+        # Check if partition is active
+        if partition.get("status") != "active":
+            save_log(
+                log_type="file",
+                message=f"File upload failed - Partition not active: {partition_id}",
+                source="file_routes.upload_file",
+                ip_address=request.remote_addr,
+                status="warning",
+            )
+            return jsonify({"error": "Partition is not active"}), 400
+
+        if encrypt and fingerprint is None:
             save_log(
                 log_type="file",
                 message="File upload failed - No fingerprints registered for user",
@@ -340,21 +391,39 @@ def upload_file():
                 400,
             )
 
-        # Use the first fingerprint hash for encryption
-        fingerprint = fingerprint_hashes[0]
+        if encrypt != upload.encrypted:
+            # "encrypt" came after the file, which was already written
+            # the other way
+            save_log(
+                log_type="file",
+                message="File upload failed - encrypt field sent after the file",
+                user_id=current_user.get("_id"),
+                source="file_routes.upload_file",
+                ip_address=request.remote_addr,
+                status="warning",
+            )
+            return (
+                jsonify({"error": "The encrypt field must be sent before the file"}),
+                400,
+            )
 
-        # Encrypt the file data directly in memory
-        file_data = simple_encrypt_bytes(file_data, fingerprint)
+        # Secure filename
+        filename = secure_filename(file.filename)
 
-    # Create uploads directory if it doesn't exist
-    os.makedirs(os.path.join(os.getcwd(), "uploads"), exist_ok=True)
+        file_id = str(uuid.uuid4())
+        file_size = upload.size
+
+        # Get file type
+        file_type = filename.split(".")[-1].upper() if "." in filename else "UNKNOWN"
 
-    # Save the file to disk
-    file_extension = filename.split(".")[-1]
-    file_path = os.path.join(os.getcwd(), "uploads", f"{file_id}.{file_extension}")
+        # Move the file into place under its final name
+        file_extension = filename.split(".")[-1]
+        upload.commit(os.path.join(upload_dir, f"{file_id}.{file_extension}"))
 
-    with open(file_path, "wb") as f:
-        f.write(file_data)
+    finally:
+        # Drop other file parts and uploads that were rejected
+        for writer in writers:
+            writer.discard()
 
     # Create file record
     new_file = {
@@ -368,6 +437,8 @@ def upload_file():
         "upload_date": datetime.datetime.utcnow(),
         "last_modified_date": datetime.datetime.utcnow(),
         "file_path": f"{file_id}.{file_extension}",
+        "sha256": upload.sha256.hexdigest(),
+        "cipher": "xor" if encrypt else None,
     }
 
     # Insert file record
@@ -454,6 +525,10 @@ def download_file(file_id):
         )
         return jsonify({"error": "File not found on server"}), 404
 
+    # ?format=binary streams the file itself instead of base64 JSON
+    if request.args.get("format") == "binary":
+        return stream_download(file, file_path, current_user)
+
     # Read the file into memory
     with open(file_path, "rb") as f:
         file_data = f.read()
@@ -540,6 +615,214 @@ def download_file(file_id):
     )
 
 
+def stream_download(file, file_path, current_user):
+    """
+    Stream the plaintext of a stored file as a binary response.
+
+    Single byte ranges are honoured (206, or 416 when unsatisfiable) so
+    media can be played and downloads resumed; only the requested bytes
+    are read and decrypted. ?inline=true lets the browser display the
+    file instead of saving it.
+    """
+    encrypted = file.get("encrypted", True)
+    fingerprint = None
+
+    if encrypted:
+        # Get fingerprint from user profile
+        fingerprint_hashes = current_user.get("fingerprint_hashes", [])
+
+        if not fingerprint_hashes:
+            save_log(
+                log_type="file",
+                message=f"File download failed - No fingerprints registered for user",
+                user_id=current_user.get("user_id"),
+                source="file_routes.download_file",
+                ip_address=request.remote_addr,
+                status="warning",
+            )
+            return jsonify({"error": "No fingerprints registered"}), 400
+
+        # Use the first fingerprint hash for decryption
+        fingerprint = fingerprint_hashes[0]
+
+    try:
+        reader = DecryptingReader.open(
+            file_path, fingerprint, file.get("cipher", "xor")
+        )
+    except Exception as e:
+        save_log(
+            log_type="file",
+            message=f"File decryption failed: {str(e)}",
+            user_id=current_user.get("user_id"),
+            details={"error": str(e)},
+            source="file_routes.download_file",
+            ip_address=request.remote_addr,
+            status="error",
+        )
+        return jsonify({"error": f"Decryption failed: {str(e)}"}), 500
+
+    size = reader.size
+    stat = os.stat(file_path)
+    etag = f'"{file.get("file_id")}-{stat.st_mtime_ns}-{stat.st_size}"'
+    inline = request.args.get("inline", "false").lower() == "true"
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": content_disposition(
+            file.get("file_name"), "inline" if inline else "attachment"
+        ),
+    }
+    start, stop, status = 0, size, 200
+
+    # A Range only applies to the version named by If-Range, if any
+    byte_range = request.range
+    if_range = request.headers.get("If-Range")
+    if byte_range is not None and if_range in (None, etag):
+        bounds = range_bounds(byte_range, size)
+        if bounds is not None:
+            start, stop = bounds
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        elif byte_range.units == "bytes" and len(byte_range.ranges) == 1:
+            headers["Content-Range"] = f"bytes */{size}"
+            reader.close()
+            return Response(status=416, headers=headers)
+
+    save_log(
+        log_type="file",
+        message=f"User {current_user['username']} downloaded {'encrypted ' if encrypted else ''}file: {file.get('file_name')}",
+        user_id=current_user.get("user_id"),
+        details={
+            "file_id": file.get("file_id"),
+            "file_type": file.get("file_type"),
+            "file_size": size,
+            "partition_id": file.get("partition_id"),
+            "range": [start, stop] if status == 206 else None,
+        },
+        source="file_routes.download_file",
+        ip_address=request.remote_addr,
+    )
+
+    response = Response(
+        iter_plaintext(reader, start, stop),
+        status=status,
+        mimetype=get_mime_type(file.get("file_name")),
+        headers=headers,
+        direct_passthrough=True,
+    )
+    response.content_length = stop - start
+    return response
+
+
+def parse_upload(
+    stream,
+    boundary,
+    open_file,
+    max_form_memory_size=None,
+    max_form_parts=None,
+    chunk_size=64 * 1024,
+):
+    """
+    Parse a multipart/form-data body, streaming file parts to writers.
+
+    Unlike werkzeug's form parser, the callback opening a file part is
+    given the fields received before it, so the file can be written in
+    its final format from the first byte.
+
+    Args:
+        stream: The request body
+        boundary (bytes): Boundary from the Content-Type header
+        open_file (callable): open_file(fields, part) returns the writable
+            file object of a file part, from a MultiDict of the fields
+            received so far and werkzeug's File event
+        max_form_memory_size (int): Largest accepted field value
+        max_form_parts (int): Largest accepted number of parts
+        chunk_size (int): Bytes read from the body at a time
+
+    Returns:
+        tuple: (form, files) MultiDicts, files holding FileStorage objects
+
+    Raises:
+        ValueError: If the body is not valid multipart data
+        RequestEntityTooLarge: If a field or the number of parts is too large
+    """
+    if not boundary:
+        raise ValueError("Missing boundary")
+
+    decoder = MultipartDecoder(
+        boundary, max_form_memory_size=max_form_memory_size, max_parts=max_form_parts
+    )
+    form, files = MultiDict(), MultiDict()
+    part, container, size = None, None, 0
+
+    while True:
+        data = stream.read(chunk_size)
+        # An empty read ends the body, which the decoder is told with None
+        decoder.receive_data(data or None)
+
+        event = decoder.next_event()
+        while not isinstance(event, (Epilogue, NeedData)):
+            if isinstance(event, Field):
+                part, container, size = event, [], 0
+            elif isinstance(event, File):
+                part, container = event, open_file(form, event)
+            elif isinstance(event, Data) and isinstance(part, Field):
+                size += len(event.data)
+                if max_form_memory_size is not None and size > max_form_memory_size:
+                    raise RequestEntityTooLarge()
+                container.append(event.data)
+                if not event.more_data:
+                    value = b"".join(container).decode(part_charset(part), "replace")
+                    form.add(part.name, value)
+            elif isinstance(event, Data):
+                container.write(event.data)
+                if not event.more_data:
+                    container.seek(0)
+                    files.add(
+                        part.name,
+                        FileStorage(
+                            container, part.filename, part.name, headers=part.headers
+                        ),
+                    )
+            event = decoder.next_event()
+
+        if isinstance(event, Epilogue) or not data:
+            return form, files
+
+
+def part_charset(part):
+    """Charset of a form field, among the few werkzeug also accepts"""
+    charset = parse_options_header(part.headers.get("content-type", ""))[1]
+    charset = charset.get("charset", "").lower()
+    return charset if charset in ("ascii", "us-ascii", "iso-8859-1") else "utf-8"
+
+
+def range_bounds(byte_range, size):
+    """
+    (start, stop) of a single byte range, or None when it is unsatisfiable
+    or not a single byte range.
+
+    Unlike Range.range_for_length, a suffix longer than the file selects
+    the whole file rather than nothing, as RFC 9110 requires.
+    """
+    if byte_range.units == "bytes" and len(byte_range.ranges) == 1:
+        start, stop = byte_range.ranges[0]
+        if start < 0 and stop is None and size > 0:
+            return max(0, size + start), size
+    return byte_range.range_for_length(size)
+
+
+def content_disposition(filename, disposition="attachment"):
+    """Content-Disposition value, with a UTF-8 filename* for non-ASCII names"""
+    fallback = filename.encode("ascii", "ignore").decode("ascii")
+    fallback = fallback.replace("\\", "").replace('"', "") or "download"
+    value = f'{disposition}; filename="{fallback}"'
+    if fallback != filename:
+        value += f"; filename*=UTF-8''{quote(filename)}"
+    return value
+
+
 def get_mime_type(filename):
     """Helper function to determine MIME type based on file extension"""
     extension = filename.split(".")[-1].lower() if "." in filename else ""
@@ -605,7 +888,7 @@ def delete_file(file_id):
 
     # Construct the file path in the uploads directory
     file_name = file.get("file_name")
-    file_path = os.path.join("uploads", f"{file.get("file_path")}.enc")
+    file_path = os.path.join("uploads", f"{file.get('file_path')}.enc")
 
     # Delete the physical file if it exists
     physical_file_deleted = False
@@ -4,6 +4,9 @@ import datetime
 from database import get_db, serialize_doc
 from utils.auth_utils import admin_required
 from utils.log_utils import get_logs, clear_old_logs
+from utils.fingerprint_metrics import get_stage_stats, reset_stage_stats
+from utils.fingerprint_cache import fingerprint_cache
+from utils.fingerprint_engines import get_engine_report
 
 log_bp = Blueprint("logs", __name__)
 
@@ -135,3 +138,20 @@ def get_log_stats():
         ),
         200,
     )
+
+
+@log_bp.route("/fingerprint-stats", methods=["GET"])
+@jwt_required()
+@admin_required
+def get_fingerprint_stats():
+    # Per-stage timings of the fingerprint pipeline for this API process
+    stats = {
+        "stages": get_stage_stats(),
+        "cache": fingerprint_cache.stats(),
+        "engines": get_engine_report(),
+    }
+
+    if request.args.get("reset", "false").lower() == "true":
+        reset_stage_stats()
+
+    return jsonify(stats), 200
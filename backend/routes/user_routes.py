@@ -7,6 +7,7 @@ import uuid
 from database import get_db, serialize_doc
 from utils.validators import validate_email, validate_password
 from utils.auth_utils import admin_required
+from utils.fingerprint_enroll import remove_fingerprint_templates
 from utils.log_utils import save_log
 
 user_bp = Blueprint("users", __name__)
@@ -37,9 +38,10 @@ def get_users():
         .limit(per_page)
     )
 
-    # Remove passwords
+    # Remove passwords and matching templates
     for user in users:
         user.pop("password", None)
+        user.pop("fingerprint_templates", None)
 
     # Log the action
     current_user_id = get_jwt_identity()
@@ -97,8 +99,9 @@ def get_user(user_id):
         )
         return jsonify({"error": "User not found"}), 404
 
-    # Remove password
+    # Remove password and matching templates
     user.pop("password", None)
+    user.pop("fingerprint_templates", None)
 
     save_log(
         log_type="user",
@@ -191,6 +194,7 @@ def create_user():
         "phone_number": data["phone_number"],
         "fingerprint_hashes": [],
         "fingerprint_pictures": [],
+        "fingerprint_templates": [],
         "last_login": None,
         "last_logout": None,
         "account_status": data.get("account_status", "active"),
@@ -353,6 +357,7 @@ def update_user(user_id):
     # Get updated user
     updated_user = db.users.find_one({"_id": user["_id"]})
     updated_user.pop("password", None)
+    updated_user.pop("fingerprint_templates", None)
 
     # Log the action
     log_details = {
@@ -413,6 +418,7 @@ def delete_user(user_id):
 
     # Delete user
     db.users.delete_one({"_id": user["_id"]})
+    remove_fingerprint_templates(user["_id"])
 
     # Log the action
     current_user_id = get_jwt_identity()
@@ -449,6 +455,7 @@ def get_dashboard_stats():
     for user in recent_users:
         user.pop("password", None)
         user.pop("fingerprint_hashes", None)
+        user.pop("fingerprint_templates", None)
 
     # Log the action
     current_user_id = get_jwt_identity()
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("flask_jwt_extended")
+pytest.importorskip("bson")
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from routes import auth_routes
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def no_processing(binaries):
+        raise AssertionError("invalid bodies must be refused before processing")
+
+    monkeypatch.setattr(auth_routes, "get_fingerprint_features_batch", no_processing)
+
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "test-secret-key-of-at-least-32-bytes"
+    JWTManager(app)
+    app.register_blueprint(auth_routes.auth_bp, url_prefix="/api/auth")
+
+    with app.app_context():
+        token = create_access_token(identity="a" * 24)
+    client = app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    return client
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        ["AAAA"],
+        "AAAA",
+        42,
+        None,
+        {},
+        {"fingerprints": []},
+        {"fingerprints": "AAAA"},
+        {"fingerprints": {"0": "AAAA"}},
+    ],
+)
+def test_enroll_fingerprints_requires_a_list_of_captures(client, body):
+    response = client.post("/api/auth/enroll-fingerprints", json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "A list of fingerprints is required"}
+
+
+def test_enroll_fingerprints_refuses_a_body_that_is_not_json(client):
+    response = client.post(
+        "/api/auth/enroll-fingerprints", data=b"AAAA", content_type="text/plain"
+    )
+    assert response.status_code == 400
@@ -0,0 +1,268 @@
+import os
+import pytest
+
+pytest.importorskip("flask_jwt_extended")
+bson = pytest.importorskip("bson")
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from routes import file_routes
+from utils import file_utils
+from utils.file_utils import StreamEncryptor, simple_decrypt_bytes
+
+USER_ID = bson.ObjectId()
+FINGERPRINT = "enrolled-fingerprint-hash"
+PAYLOAD = bytes(range(256)) * 40 + b"tail"
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find_one(self, query):
+        for document in self.documents:
+            if all(document.get(key) == value for key, value in query.items()):
+                return document
+        return None
+
+    def insert_one(self, document):
+        self.documents.append(document)
+
+    def update_one(self, query, update):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self, files):
+        self.files = FakeCollection(files)
+        self.partitions = FakeCollection(
+            [{"partition_id": "partition-1", "status": "active"}]
+        )
+        self.users = FakeCollection(
+            [
+                {
+                    "_id": USER_ID,
+                    "user_id": "user-1",
+                    "username": "alice",
+                    "fingerprint_hashes": [FINGERPRINT],
+                }
+            ]
+        )
+
+
+@pytest.fixture(params=[True, False], ids=["encrypted", "plain"])
+def client(request, tmp_path, monkeypatch):
+    encrypted = request.param
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    with open(uploads / "stored.bin", "wb") as f:
+        if encrypted:
+            encryptor = StreamEncryptor(FINGERPRINT)
+            f.write(encryptor.header() + encryptor.update(PAYLOAD))
+        else:
+            f.write(PAYLOAD)
+
+    document = {
+        "_id": bson.ObjectId(),
+        "file_id": "file-1",
+        "file_name": "clip.mp4",
+        "file_path": "stored.bin",
+        "user_id": str(USER_ID),
+        "encrypted": encrypted,
+        "cipher": "xor",
+    }
+    monkeypatch.chdir(tmp_path)
+    return make_client(monkeypatch, FakeDatabase([document]))
+
+
+def make_client(monkeypatch, database):
+    monkeypatch.setattr(file_routes, "get_db", lambda: database)
+    monkeypatch.setattr(file_routes, "save_log", lambda **kwargs: None)
+
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "test-secret-key-of-at-least-32-bytes"
+    JWTManager(app)
+    app.register_blueprint(file_routes.file_bp, url_prefix="/api/files")
+
+    with app.app_context():
+        token = create_access_token(identity=str(USER_ID))
+    client = app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    return client
+
+
+def download(client, **headers):
+    return client.get("/api/files/file-1/download?format=binary", headers=headers)
+
+
+def test_full_download(client):
+    response = download(client)
+    assert response.status_code == 200
+    assert response.data == PAYLOAD
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["Content-Length"] == str(len(PAYLOAD))
+    assert response.mimetype == "video/mp4"
+    assert "Content-Range" not in response.headers
+
+
+@pytest.mark.parametrize(
+    "header, start, stop",
+    [
+        ("bytes=0-0", 0, 1),
+        ("bytes=5-40", 5, 41),
+        ("bytes=33-", 33, len(PAYLOAD)),
+        ("bytes=-100", len(PAYLOAD) - 100, len(PAYLOAD)),
+        ("bytes=10000-99999999", 10000, len(PAYLOAD)),
+        ("bytes=-99999999", 0, len(PAYLOAD)),
+    ],
+)
+def test_single_range(client, header, start, stop):
+    response = download(client, Range=header)
+    assert response.status_code == 206
+    assert response.data == PAYLOAD[start:stop]
+    assert (
+        response.headers["Content-Range"] == f"bytes {start}-{stop - 1}/{len(PAYLOAD)}"
+    )
+    assert response.headers["Content-Length"] == str(stop - start)
+
+
+@pytest.mark.parametrize("header", [f"bytes={len(PAYLOAD)}-", "bytes=99999-100000"])
+def test_unsatisfiable_range(client, header):
+    response = download(client, Range=header)
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(PAYLOAD)}"
+    assert response.data == b""
+
+
+def test_if_range_with_the_current_etag(client):
+    etag = download(client).headers["ETag"]
+    response = download(client, Range="bytes=5-9", **{"If-Range": etag})
+    assert response.status_code == 206
+    assert response.data == PAYLOAD[5:10]
+
+
+def test_if_range_with_a_stale_etag_sends_the_whole_file(client):
+    response = download(client, Range="bytes=5-9", **{"If-Range": '"file-1-0-0"'})
+    assert response.status_code == 200
+    assert response.data == PAYLOAD
+    assert "Content-Range" not in response.headers
+
+
+def test_etag_changes_with_the_stored_file(client):
+    etag = download(client).headers["ETag"]
+    os.utime("uploads/stored.bin", ns=(0, 0))
+    assert download(client).headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("header", ["bytes=0-4,10-14", "bytes=0-4,-5", "items=0-4"])
+def test_multiple_ranges_fall_back_to_the_whole_file(client, header):
+    response = download(client, Range=header)
+    assert response.status_code == 200
+    assert response.data == PAYLOAD
+    assert "Content-Range" not in response.headers
+
+
+def test_inline_disposition(client):
+    response = client.get("/api/files/file-1/download?format=binary&inline=true")
+    assert response.headers["Content-Disposition"] == 'inline; filename="clip.mp4"'
+    attachment = download(client).headers["Content-Disposition"]
+    assert attachment == 'attachment; filename="clip.mp4"'
+
+
+BOUNDARY = "test-boundary"
+
+
+def multipart(*parts):
+    """Multipart body with the parts in the given order, unlike the test client"""
+    body = b""
+    for name, value in parts:
+        if isinstance(value, bytes):
+            disposition = f'form-data; name="{name}"; filename="report.pdf"'
+            headers = f"Content-Disposition: {disposition}\r\n"
+            headers += "Content-Type: application/octet-stream\r\n"
+        else:
+            headers = f'Content-Disposition: form-data; name="{name}"\r\n'
+            value = value.encode()
+        body += f"--{BOUNDARY}\r\n{headers}\r\n".encode() + value + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = FakeDatabase([])
+    client = make_client(monkeypatch, database)
+
+    def upload(*parts, body=None):
+        return client.post(
+            "/api/files/upload",
+            data=multipart(*parts) if body is None else body,
+            content_type=f"multipart/form-data; boundary={BOUNDARY}",
+        )
+
+    upload.database = database
+    upload.directory = tmp_path / "uploads"
+    return upload
+
+
+def stored(uploads, response):
+    record = response.get_json()["file"]
+    assert record == {**record, "file_size": len(PAYLOAD), "file_name": "report.pdf"}
+    assert sorted(os.listdir(uploads.directory)) == [record["file_path"]]
+    with open(uploads.directory / record["file_path"], "rb") as f:
+        return record, f.read()
+
+
+def test_upload_without_encryption_is_never_encrypted(uploads, monkeypatch):
+    def no_encryption(*args, **kwargs):
+        raise AssertionError("a plaintext upload must not be encrypted")
+
+    monkeypatch.setattr(file_utils, "StreamEncryptor", no_encryption)
+    response = uploads(
+        ("partition_id", "partition-1"), ("encrypt", "false"), ("file", PAYLOAD)
+    )
+    assert response.status_code == 201
+
+    record, data = stored(uploads, response)
+    assert data == PAYLOAD
+    assert record["encrypted"] is False and record["cipher"] is None
+
+
+@pytest.mark.parametrize(
+    "parts",
+    [
+        [("partition_id", "partition-1"), ("file", PAYLOAD)],
+        [("encrypt", "true"), ("file", PAYLOAD), ("partition_id", "partition-1")],
+        # Older clients sent the fields after the file
+        [("file", PAYLOAD), ("partition_id", "partition-1"), ("encrypt", "true")],
+    ],
+)
+def test_upload_is_encrypted_by_default(uploads, parts):
+    response = uploads(*parts)
+    assert response.status_code == 201
+
+    record, data = stored(uploads, response)
+    assert simple_decrypt_bytes(data, FINGERPRINT) == PAYLOAD
+    assert record["encrypted"] is True and record["cipher"] == "xor"
+
+
+def test_encrypt_field_after_the_file_is_refused(uploads):
+    response = uploads(
+        ("partition_id", "partition-1"), ("file", PAYLOAD), ("encrypt", "false")
+    )
+    assert response.status_code == 400
+    assert "before the file" in response.get_json()["error"]
+    assert os.listdir(uploads.directory) == []
+    assert uploads.database.files.documents == []
+
+
+def test_upload_without_a_file_part(uploads):
+    response = uploads(("partition_id", "partition-1"), ("encrypt", "false"))
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "No file part"}
+
+
+def test_truncated_body_is_treated_as_no_file(uploads):
+    response = uploads(body=multipart(("file", PAYLOAD))[:-40])
+    assert response.status_code == 400
+    assert os.listdir(uploads.directory) == []
@@ -0,0 +1,208 @@
+import hashlib
+import io
+import itertools
+import os
+import pytest
+
+from utils import file_utils
+from utils.file_utils import (
+    KEYSTREAM_BLOCK,
+    SALT_SIZE,
+    AesCtrCipher,
+    DecryptingReader,
+    StreamDecryptor,
+    StreamEncryptor,
+    decrypt_stream,
+    encrypt_stream,
+    iter_plaintext,
+    simple_decrypt_bytes,
+    simple_encrypt_bytes,
+    xor_keystream,
+)
+
+FINGERPRINT = "enrolled-fingerprint"
+SALT = bytes(range(SALT_SIZE))
+
+# Sizes that straddle the 32-byte key and the keystream blocks
+SIZES = [0, 1, 31, 32, 33, 1000, KEYSTREAM_BLOCK - 1, 2 * KEYSTREAM_BLOCK + 45]
+CHUNKS = [1, 7, 31, 33, 1000, KEYSTREAM_BLOCK + 5]
+
+
+def baseline_encrypt(data, fingerprint, salt):
+    """The original format: salt, then data XORed with the cycled PBKDF2 key"""
+    key = hashlib.pbkdf2_hmac("sha256", fingerprint.encode(), salt, 10000, 32)
+    return salt + bytes(byte ^ k for byte, k in zip(data, itertools.cycle(key)))
+
+
+def chunked(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def sample(payload, baseline, chunk):
+    """Payload and its encryption, cut short for the tiny chunk sizes"""
+    size = len(payload) if chunk > 32 else 3000
+    return payload[:size], baseline[: SALT_SIZE + size]
+
+
+@pytest.fixture(scope="module")
+def payload():
+    return os.urandom(SIZES[-1])
+
+
+@pytest.fixture(scope="module")
+def baseline(payload):
+    return baseline_encrypt(payload, FINGERPRINT, SALT)
+
+
+@pytest.fixture
+def fixed_salt(monkeypatch):
+    monkeypatch.setattr(file_utils.os, "urandom", lambda size: SALT[:size])
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_simple_bytes_match_the_baseline_format(payload, baseline, fixed_salt, size):
+    data = payload[:size]
+    encrypted = simple_encrypt_bytes(data, FINGERPRINT)
+
+    assert encrypted == baseline[: SALT_SIZE + size]
+    assert simple_decrypt_bytes(encrypted, FINGERPRINT) == data
+
+
+@pytest.mark.parametrize("position", [0, 1, 31, 32, 45, KEYSTREAM_BLOCK + 3])
+def test_xor_keystream_at_an_offset(payload, baseline, position):
+    key = file_utils.derive_key(FINGERPRINT, SALT)
+    data = payload[position : position + 5000]
+    expected = baseline[SALT_SIZE + position : SALT_SIZE + position + 5000]
+
+    assert xor_keystream(data, key, position) == expected
+
+    # In place, as the streaming callers use it
+    buffer = bytearray(data)
+    xor_keystream(buffer, key, position, out=buffer)
+    assert buffer == expected
+    assert xor_keystream(expected, key, position) == data
+
+
+@pytest.mark.parametrize("chunk", CHUNKS)
+def test_stream_encryptor_matches_the_baseline(payload, baseline, chunk):
+    payload, baseline = sample(payload, baseline, chunk)
+    encryptor = StreamEncryptor(FINGERPRINT, salt=SALT)
+    parts = [encryptor.header()] + [
+        encryptor.update(c) for c in chunked(payload, chunk)
+    ]
+    assert b"".join(parts) == baseline
+
+    encryptor = StreamEncryptor(FINGERPRINT, salt=SALT)
+    streamed = b"".join(encryptor.stream(io.BytesIO(payload), chunk_size=chunk))
+    assert streamed == baseline
+
+
+@pytest.mark.parametrize("chunk", CHUNKS + [SALT_SIZE - 3, SALT_SIZE + 1])
+def test_stream_decryptor_reads_the_baseline(payload, baseline, chunk):
+    payload, baseline = sample(payload, baseline, chunk)
+    decryptor = StreamDecryptor(FINGERPRINT)
+    parts = [decryptor.update(c) for c in chunked(baseline, chunk)]
+    decryptor.finalize()
+    assert b"".join(parts) == payload
+
+    # Into a reused buffer, as decrypt_stream does
+    decryptor = StreamDecryptor(FINGERPRINT)
+    buffer = bytearray(chunk)
+    parts = [bytes(decryptor.update(c, buffer)) for c in chunked(baseline, chunk)]
+    assert b"".join(parts) == payload
+
+
+@pytest.mark.parametrize("chunk", [5, 32, 1000, KEYSTREAM_BLOCK + 5])
+def test_file_streams_round_trip(payload, baseline, chunk):
+    payload, _ = sample(payload, baseline, chunk)
+    encrypted = io.BytesIO()
+    assert encrypt_stream(io.BytesIO(payload), encrypted, FINGERPRINT, chunk) == len(
+        payload
+    )
+    assert simple_decrypt_bytes(encrypted.getvalue(), FINGERPRINT) == payload
+
+    decrypted = io.BytesIO()
+    encrypted.seek(0)
+    assert decrypt_stream(encrypted, decrypted, FINGERPRINT, chunk) == len(payload)
+    assert decrypted.getvalue() == payload
+
+
+def test_stream_decryptor_refuses_a_truncated_salt():
+    decryptor = StreamDecryptor(FINGERPRINT)
+    assert decryptor.update(SALT[:5]) == b""
+    with pytest.raises(ValueError):
+        decryptor.finalize()
+    with pytest.raises(ValueError):
+        decrypt_stream(io.BytesIO(SALT[:5]), io.BytesIO(), FINGERPRINT)
+
+
+def test_key_material_is_not_printed(capsys, payload):
+    key = file_utils.derive_key(FINGERPRINT, SALT)
+    encrypted = StreamEncryptor(FINGERPRINT, salt=SALT)
+    encrypted = encrypted.header() + encrypted.update(payload[:100])
+
+    simple_decrypt_bytes(encrypted, FINGERPRINT)
+    simple_encrypt_bytes(payload[:100], FINGERPRINT)
+
+    output = capsys.readouterr().out
+    assert key.hex()[:8] not in output
+    assert "key" not in output.lower()
+
+
+@pytest.fixture(scope="module")
+def aes_file(payload):
+    """An AES-CTR file, with a counter that wraps around within the payload"""
+    modes = pytest.importorskip("cryptography.hazmat.primitives.ciphers.modes")
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+
+    header = SALT + (2**128 - 3).to_bytes(16, "big")
+    cipher = AesCtrCipher(FINGERPRINT, header)
+    encrypted = header + bytes(cipher.apply(payload, 0))
+
+    # Reference: one decryption of the whole payload by the library
+    key = file_utils.derive_key(FINGERPRINT, SALT)
+    decryptor = Cipher(algorithms.AES(key), modes.CTR(header[SALT_SIZE:])).decryptor()
+    assert decryptor.update(encrypted[len(header) :]) == payload
+    return encrypted
+
+
+@pytest.mark.parametrize(
+    "offset, length",
+    [(0, 100), (1, 15), (15, 2), (17, 40), (33, 1), (4095, 5000), (12345, 100000)],
+)
+def test_aes_ctr_reader_seeks_to_any_offset(payload, aes_file, offset, length):
+    reader = DecryptingReader(io.BytesIO(aes_file), FINGERPRINT, "aes-ctr")
+    assert reader.size == len(payload)
+
+    reader.seek(offset)
+    assert reader.read(length) == payload[offset : offset + length]
+    assert reader.tell() == min(offset + length, len(payload))
+
+    # Reads that start mid-block after an earlier read
+    reader.seek(offset // 2)
+    assert reader.read(7) == payload[offset // 2 : offset // 2 + 7]
+    assert reader.read(9) == payload[offset // 2 + 7 : offset // 2 + 16]
+
+    stop = offset + length
+    plaintext = b"".join(iter_plaintext(reader, offset, stop, chunk_size=1000))
+    assert plaintext == payload[offset:stop]
+
+
+def test_aes_ctr_written_in_chunks_matches_one_piece(payload, aes_file):
+    header = aes_file[: AesCtrCipher.header_size]
+    cipher = AesCtrCipher(FINGERPRINT, header)
+    position, parts = 0, [header]
+    for chunk in chunked(payload, 1000 + 3):
+        parts.append(bytes(cipher.apply(chunk, position)))
+        position += len(chunk)
+    assert b"".join(parts) == aes_file
+
+
+def test_aes_ctr_new_files_round_trip(payload):
+    header = AesCtrCipher.new_header()
+    assert len(header) == AesCtrCipher.header_size
+    encrypted = header + bytes(AesCtrCipher(FINGERPRINT, header).apply(payload, 0))
+
+    reader = DecryptingReader(io.BytesIO(encrypted), FINGERPRINT, "aes-ctr")
+    assert reader.read() == payload
+    assert DecryptingReader(io.BytesIO(encrypted), "other", "aes-ctr").read() != payload
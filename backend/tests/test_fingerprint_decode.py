@@ -0,0 +1,120 @@
+import base64
+import io
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmarks.fingerprint_benchmark import generate_ridge_image
+from utils.fingerprint_template import MAX_IMAGE_SIDE
+from utils.fingerprint_utils import (
+    FingerprintQualityError,
+    decode_grayscale,
+    extract_fingerprint,
+    process_fingerprint,
+)
+
+
+def encode(image, fmt="PNG"):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def baseline_gray(fingerprint_binary):
+    """Gray image of the original decode: PIL array, BGR2GRAY on colour"""
+    img_array = np.array(Image.open(io.BytesIO(fingerprint_binary)))
+    if len(img_array.shape) > 2 and img_array.shape[2] > 1:
+        return cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
+    return img_array
+
+
+@pytest.fixture(scope="module")
+def gray():
+    return generate_ridge_image(256, seed=3)
+
+
+def colour(gray):
+    """Ridges with different values in every channel"""
+    return np.dstack([gray, gray // 4 * 3 + 40, gray // 2 + 100]).astype(np.uint8)
+
+
+@pytest.mark.parametrize(
+    "mode, fmt",
+    [("L", "PNG"), ("RGB", "PNG"), ("RGBA", "PNG"), ("P", "PNG"), ("CMYK", "TIFF")],
+)
+def test_modes_match_the_baseline_decode(gray, mode, fmt):
+    source = Image.fromarray(gray if mode in ("L", "P") else colour(gray))
+    fingerprint_binary = encode(source.convert(mode), fmt)
+
+    expected = baseline_gray(fingerprint_binary)
+    assert np.array_equal(decode_grayscale(fingerprint_binary), expected)
+    assert process_fingerprint(fingerprint_binary) == process_fingerprint(
+        encode(Image.fromarray(expected))
+    )
+
+
+def bilevel(gray):
+    image = Image.fromarray(gray).convert("1")
+    return image, np.array(image, dtype=np.uint8) * 255
+
+
+def gray_with_alpha(gray):
+    image = Image.merge("LA", [Image.fromarray(gray), Image.fromarray(255 - gray)])
+    return image, gray
+
+
+def sixteen_bit(gray):
+    wide = gray.astype(np.uint16) * 256 + 128
+    return Image.fromarray(wide), gray
+
+
+@pytest.mark.parametrize("convert", [bilevel, gray_with_alpha, sixteen_bit])
+def test_modes_the_baseline_rejected_are_converted(gray, convert):
+    image, expected = convert(gray)
+    fingerprint_binary = encode(image)
+
+    decoded = decode_grayscale(fingerprint_binary)
+    assert decoded.dtype == np.uint8 and np.array_equal(decoded, expected)
+    assert process_fingerprint(fingerprint_binary) == process_fingerprint(
+        encode(Image.fromarray(expected))
+    )
+
+
+@pytest.mark.parametrize("size", [(MAX_IMAGE_SIDE + 1, 4), (4, MAX_IMAGE_SIDE + 1)])
+def test_oversized_images_are_rejected_at_decode(size):
+    binary = encode(Image.new("L", size))
+
+    with pytest.raises(FingerprintQualityError) as error:
+        decode_grayscale(binary)
+    assert error.value.scores == {"width": size[0], "height": size[1]}
+
+    # Not wrapped into the generic ValueError of a failed pipeline
+    with pytest.raises(FingerprintQualityError):
+        extract_fingerprint(binary)
+
+
+def test_largest_side_is_accepted():
+    gray = decode_grayscale(encode(Image.new("L", (MAX_IMAGE_SIDE, 2))))
+    assert gray.shape == (2, MAX_IMAGE_SIDE)
+
+
+def test_login_with_an_oversized_image_is_a_client_error(monkeypatch):
+    flask = pytest.importorskip("flask")
+    pytest.importorskip("flask_jwt_extended")
+    pytest.importorskip("bson")
+    from routes import auth_routes
+
+    monkeypatch.setattr(auth_routes, "get_db", lambda: None)
+    monkeypatch.setattr(auth_routes, "get_fingerprint_features", extract_fingerprint)
+    monkeypatch.setattr(auth_routes, "save_log", lambda **kwargs: None)
+    app = flask.Flask(__name__)
+    app.register_blueprint(auth_routes.auth_bp, url_prefix="/api/auth")
+
+    binary = encode(Image.new("L", (MAX_IMAGE_SIDE + 1, 4)))
+    response = app.test_client().post(
+        "/api/auth/login",
+        json={"fingerprint": base64.b64encode(binary).decode("ascii")},
+    )
+    assert response.status_code == 422
+    assert "too large" in response.get_json()["error"]
@@ -0,0 +1,148 @@
+import cv2
+import numpy as np
+import pytest
+
+# Importing the pipeline registers its engines next to the references
+import utils.fingerprint_utils  # noqa: F401
+from utils.fingerprint_engines import (
+    stage_engines,
+    reference_filter,
+    reference_minutiae,
+    reference_thinning,
+    synthetic_ridges,
+)
+
+
+def candidates(stage):
+    """Every registered engine of a stage except the reference"""
+    return [
+        pytest.param(
+            stage_engines[stage][name],
+            id=name,
+            marks=(
+                # Parallel sub-iterations: select_engines only picks it when
+                # it happens to match the sequential reference
+                [pytest.mark.xfail(reason="not the sequential variant")]
+                if name == "ximgproc"
+                else []
+            ),
+        )
+        for name in stage_engines[stage]
+        if name != "reference"
+    ]
+
+
+def random_binary(rng, rows, cols, density):
+    """Noise: ridge pixels everywhere, including the image border"""
+    return np.where(rng.random((rows, cols)) < density, 255, 0).astype(np.uint8)
+
+
+def random_strokes(rng, rows, cols):
+    """Thick blobs crossed by one-pixel-wide lines reaching the border"""
+    image = np.zeros((rows, cols), dtype=np.uint8)
+    for _ in range(3):
+        centre = tuple(int(v) for v in rng.integers(0, (cols, rows)))
+        radius = int(rng.integers(2, 7))
+        cv2.circle(image, centre, radius, 255, -1)
+    for _ in range(4):
+        start = tuple(int(v) for v in rng.integers(-2, (cols + 2, rows + 2)))
+        end = tuple(int(v) for v in rng.integers(-2, (cols + 2, rows + 2)))
+        cv2.line(image, start, end, 255, 1)
+    return image
+
+
+def thinning_inputs():
+    rng = np.random.default_rng(1234)
+    images = [random_binary(rng, 23, 31, density) for density in (0.3, 0.5, 0.8)]
+    images += [random_strokes(rng, 40, 37) for _ in range(4)]
+
+    line = np.zeros((12, 15), dtype=np.uint8)
+    line[5, :] = 255
+    line[:, 7] = 255
+    line[0, :] = 255
+    line[:, -1] = 255
+    images.append(line)
+
+    images.append(np.full((9, 9), 255, dtype=np.uint8))
+    images += [random_binary(rng, 2, 20, 0.6), random_binary(rng, 20, 1, 0.6)]
+    return images
+
+
+@pytest.mark.parametrize("engine", candidates("thinning"))
+def test_thinning_matches_the_reference(engine):
+    for image in thinning_inputs():
+        original = image.copy()
+        expected = reference_thinning(image)
+        actual = engine(image)
+
+        assert actual.dtype == expected.dtype
+        assert np.array_equal(actual, expected)
+        assert np.array_equal(image, original)
+
+
+def skeletons():
+    rng = np.random.default_rng(99)
+    images = [reference_thinning(random_strokes(rng, 40, 37)) for _ in range(4)]
+    images += [reference_thinning(random_binary(rng, 23, 31, 0.5))]
+
+    # Unthinned noise and ridges on every border pixel: the extractors
+    # must agree on any input, not only on clean skeletons
+    images += [random_binary(rng, 17, 19, density) for density in (0.2, 0.5)]
+    edges = np.zeros((10, 14), dtype=np.uint8)
+    edges[0, 2:9] = edges[-1, 4:] = edges[3:, 0] = edges[:6, -1] = 255
+    edges[1, 5] = edges[-2, 10] = edges[5, 1] = edges[2, -2] = 255
+    images.append(edges)
+
+    images.append(reference_thinning(synthetic_ridges(96)))
+    images += [random_binary(rng, 2, 20, 0.6), random_binary(rng, 3, 3, 0.6)]
+    return images
+
+
+@pytest.mark.parametrize("engine", candidates("minutiae_extraction"))
+def test_minutiae_extraction_matches_the_reference(engine):
+    for skeleton in skeletons():
+        for offset in ((0, 0), (13, 7)):
+            expected = reference_minutiae(skeleton, *offset)
+            actual = engine(skeleton, *offset)
+
+            assert list(map(tuple, actual)) == expected
+            assert all(type(value) is int for point in actual for value in point)
+
+
+def minutiae_sets():
+    rng = np.random.default_rng(7)
+    sets = []
+    for count, size in ((200, 120), (400, 60), (50, 300)):
+        xy = rng.integers(0, size, (count, 2))
+        sets.append([(int(x), int(y), int(rng.choice([1, 3]))) for x, y in xy])
+
+    # Exactly min_distance apart (kept), along the axes and on 6-8-10
+    # triangles, and one pixel short of it (dropped), across cell edges
+    sets.append(
+        [(0, 0, 1), (10, 0, 1), (20, 0, 3), (6, 8, 1), (19, 9, 3), (26, 8, 1)]
+        + [(9, 10, 1), (10, 19, 3), (30, 29, 1), (29, 39, 3), (39, 30, 1)]
+    )
+    # Neighbours one cell away in every direction of a kept point
+    centre = (25, 25, 1)
+    sets.append(
+        [centre]
+        + [(25 + dx, 25 + dy, 3) for dx in (-9, 0, 9) for dy in (-9, 0, 9)]
+        + [(25 + dx, 25 + dy, 1) for dx in (-10, 10) for dy in (-10, 10)]
+    )
+    sets.append([])
+    return sets
+
+
+@pytest.mark.parametrize("engine", candidates("filtering"))
+@pytest.mark.parametrize("min_distance", [10, 7, 1])
+def test_filtering_matches_the_reference(engine, min_distance):
+    for points in minutiae_sets():
+        expected = reference_filter(points, min_distance)
+        assert engine(points, min_distance) == expected
+
+
+@pytest.mark.parametrize("engine", candidates("filtering"))
+def test_filtering_keeps_points_exactly_min_distance_apart(engine):
+    # (16, 8) and (0, 10) are exactly 10 from a kept point, (9, 9) is 9.06
+    points = [(0, 0, 1), (10, 0, 1), (16, 8, 3), (9, 9, 1), (0, 10, 3)]
+    assert engine(points, 10) == [(0, 0, 1), (10, 0, 1), (16, 8, 3), (0, 10, 3)]
@@ -0,0 +1,70 @@
+import math
+import threading
+import pytest
+
+pytest.importorskip("bson")
+
+from utils import fingerprint_jobs
+
+
+class FakeJobs:
+    def __init__(self):
+        self.jobs = {}
+        self.finds = 0
+
+    def insert_one(self, job):
+        self.jobs[job["job_id"]] = dict(job)
+
+    def find_one(self, query, projection=None):
+        self.finds += 1
+        job = self.jobs.get(query["job_id"])
+        return dict(job) if job and job["user_id"] == query["user_id"] else None
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.fingerprint_jobs = FakeJobs()
+
+
+@pytest.fixture
+def database(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(fingerprint_jobs, "get_db", lambda: db)
+    return db
+
+
+def test_nan_wait_returns_at_once(database):
+    job = {"job_id": "job", "user_id": "user", "status": fingerprint_jobs.JOB_PENDING}
+    database.fingerprint_jobs.insert_one(job)
+
+    for wait in (math.nan, math.inf):
+        assert fingerprint_jobs.get_job("job", "user", wait=wait)["job_id"] == "job"
+    assert database.fingerprint_jobs.finds == 2
+
+
+def test_submissions_are_refused_when_the_queue_is_full(database, monkeypatch):
+    monkeypatch.setenv("FINGERPRINT_JOB_THREADS", "1")
+    monkeypatch.setenv("FINGERPRINT_JOB_MAX_PENDING", "2")
+    monkeypatch.setattr(fingerprint_jobs, "job_runner", None)
+
+    release = threading.Event()
+    finished = threading.Semaphore(0)
+
+    def run(job_id, user_id, fingerprint_binary):
+        release.wait(5)
+        fingerprint_jobs.job_slots.release()
+        finished.release()
+
+    monkeypatch.setattr(fingerprint_jobs, "_run_enrollment_job", run)
+
+    fingerprint_jobs.submit_enrollment_job("user", b"image")
+    fingerprint_jobs.submit_enrollment_job("user", b"image")
+    with pytest.raises(fingerprint_jobs.FingerprintQueueFullError):
+        fingerprint_jobs.submit_enrollment_job("user", b"image")
+    assert len(database.fingerprint_jobs.jobs) == 2
+
+    # Finished jobs free their slots
+    release.set()
+    assert finished.acquire(timeout=5) and finished.acquire(timeout=5)
+    fingerprint_jobs.submit_enrollment_job("user", b"image")
+    fingerprint_jobs.get_job_runner().shutdown(wait=True)
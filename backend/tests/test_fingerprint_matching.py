@@ -0,0 +1,245 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("bson")
+
+from utils import (
+    fingerprint_enroll,
+    fingerprint_index,
+    fingerprint_matching,
+    fingerprint_store,
+)
+from utils.fingerprint_template import minutiae_records, pack_template
+
+
+def synthetic_finger(rng, count=50, size=300):
+    """Minutiae of a finger: spaced points on a smooth orientation field"""
+    points = []
+    while len(points) < count:
+        x, y = rng.uniform(0, size, 2)
+        if all(np.hypot(x - px, y - py) >= 10 for px, py, _, _ in points):
+            orientation = (
+                np.degrees(np.arctan2(y - size / 2, x - size / 2))
+                + 90
+                + rng.normal(0, 5)
+            ) % 180
+            points.append((x, y, int(rng.choice([1, 3])), orientation))
+    return minutiae_records([tuple(map(int, point)) for point in points])
+
+
+def another_capture(rng, finger, size=300):
+    """The same finger captured again: moved, rotated, with lost and spurious minutiae"""
+    theta = rng.uniform(-0.4, 0.4)
+    rotation = np.array(
+        [[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]]
+    )
+    xy = np.stack([finger["x"], finger["y"]], axis=1).astype(np.float64)
+    xy = xy @ rotation.T + rng.uniform(-40, 40, 2) + rng.normal(0, 2, xy.shape)
+    orientation = (
+        finger["orientation"] + np.degrees(theta) + rng.normal(0, 8, len(finger))
+    ) % 180
+    keep = rng.random(len(finger)) > 0.2
+
+    points = [
+        (int(x), int(y), int(kind), int(angle))
+        for (x, y), kind, angle in zip(
+            xy[keep], finger["type"][keep], orientation[keep]
+        )
+        if x >= 0 and y >= 0
+    ]
+    for _ in range(len(finger) // 5):
+        points.append(
+            (
+                int(rng.uniform(0, size)),
+                int(rng.uniform(0, size)),
+                1,
+                int(rng.uniform(0, 180)),
+            )
+        )
+    return minutiae_records(points)
+
+
+class FakeUsers:
+    """The db.users queries made by the matching module and the login route"""
+
+    def __init__(self, users=()):
+        self.users = list(users)
+
+    def find(self, query, projection=None):
+        # Only stored_templates lists users: those with enrolled templates
+        return [user for user in self.users if user.get("fingerprint_templates")]
+
+    def find_one(self, query):
+        for user in self.users:
+            if all(user.get(field) == value for field, value in query.items()):
+                return user
+        return None
+
+    def update_one(self, query, update):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self, users=()):
+        self.users = FakeUsers(users)
+
+
+@pytest.fixture
+def enrolled(tmp_path, monkeypatch):
+    """Twenty users with one enrolled finger each, in a fresh template store"""
+    monkeypatch.setenv("FINGERPRINT_TEMPLATE_STORE", str(tmp_path / "templates.bin"))
+    monkeypatch.setattr(fingerprint_store, "template_store", None)
+    monkeypatch.setattr(fingerprint_index, "minutiae_index", None)
+    monkeypatch.setattr(fingerprint_store, "get_db", lambda: FakeDatabase())
+
+    rng = np.random.default_rng(7)
+    fingers = {}
+    for i in range(20):
+        owner = f"{i:024x}"
+        fingers[owner] = synthetic_finger(rng, int(rng.integers(30, 70)))
+        fingerprint_enroll.add_fingerprint_templates(
+            owner, [{"hash": f"hash{i}", "template": pack_template(fingers[owner])}]
+        )
+    return rng, fingers
+
+
+def test_enrolled_finger_is_identified(enrolled):
+    rng, fingers = enrolled
+    for owner, finger in fingers.items():
+        match = fingerprint_matching.identify_fingerprint(another_capture(rng, finger))
+        assert match is not None and match[0] == owner
+        assert match[1] >= fingerprint_matching.verify_threshold()
+
+
+def test_unenrolled_finger_is_not_identified(enrolled):
+    rng, _ = enrolled
+    for _ in range(100):
+        probe = synthetic_finger(rng, int(rng.integers(30, 70)))
+        assert fingerprint_matching.identify_fingerprint(probe) is None
+
+
+def test_index_is_shared_through_the_snapshot(enrolled, monkeypatch):
+    rng, fingers = enrolled
+    monkeypatch.setenv("FINGERPRINT_INDEX_DELTA_MAX", "0")
+    index = fingerprint_index.get_minutiae_index()
+    assert len(index.snapshot) == len(fingers) and not index.templates
+
+    # Another worker maps the same snapshot instead of indexing the templates
+    path = fingerprint_index.index_snapshot_path(fingerprint_store.get_template_store())
+    built = os.stat(path).st_ino
+    monkeypatch.setattr(fingerprint_store, "template_store", None)
+    monkeypatch.setattr(fingerprint_index, "minutiae_index", None)
+    index = fingerprint_index.get_minutiae_index()
+    assert os.stat(path).st_ino == built
+    assert len(index.snapshot) == len(fingers) and not index.templates
+
+    removed, kept = list(fingers)[:2]
+    fingerprint_enroll.remove_fingerprint_templates(removed)
+    capture = another_capture(rng, fingers[removed])
+    assert fingerprint_matching.identify_fingerprint(capture) is None
+    capture = another_capture(rng, fingers[kept])
+    assert fingerprint_matching.identify_fingerprint(capture)[0] == kept
+
+
+@pytest.mark.parametrize("deleted", [False, True])
+def test_enrolment_into_a_missing_store_keeps_mongodb_templates(
+    tmp_path, monkeypatch, deleted
+):
+    rng = np.random.default_rng(11)
+    existing, enrolled, later = (synthetic_finger(rng, 60) for _ in range(3))
+    database = FakeDatabase(
+        [
+            {
+                "_id": "a" * 24,
+                "fingerprint_templates": [
+                    {"hash": "hash-a", "template": pack_template(existing)}
+                ],
+            }
+        ]
+    )
+    monkeypatch.setenv("FINGERPRINT_TEMPLATE_STORE", str(tmp_path / "templates.bin"))
+    monkeypatch.setattr(fingerprint_store, "template_store", None)
+    monkeypatch.setattr(fingerprint_index, "minutiae_index", None)
+    monkeypatch.setattr(fingerprint_store, "get_db", lambda: database)
+
+    if deleted:
+        # The store existed once, then its volume was wiped
+        fingerprint_index.get_minutiae_index()
+        os.remove(tmp_path / "templates.bin")
+
+    # The first write to the missing file is an enrolment
+    fingerprint_enroll.add_fingerprint_templates(
+        "b" * 24, [{"hash": "hash-b", "template": pack_template(enrolled)}]
+    )
+    fingerprint_enroll.add_fingerprint_templates(
+        "c" * 24, [{"hash": "hash-c", "template": pack_template(later)}]
+    )
+
+    store = fingerprint_store.get_template_store()
+    assert sorted(store.owners) == ["a" * 24, "b" * 24, "c" * 24]
+    for owner, finger in (("a" * 24, existing), ("b" * 24, enrolled)):
+        match = fingerprint_matching.identify_fingerprint(another_capture(rng, finger))
+        assert match is not None and match[0] == owner
+
+
+def test_index_candidates_are_verified(enrolled, monkeypatch):
+    rng, fingers = enrolled
+    owner = next(iter(fingers))
+    probe = synthetic_finger(rng)
+
+    # Even when the index ranks an impostor's finger first, it is not a match
+    class Shortlist:
+        def candidates(self, points, limit=None):
+            return [(owner, f"{owner}:hash0", 1.0)]
+
+    monkeypatch.setattr(fingerprint_matching, "get_minutiae_index", Shortlist)
+    assert fingerprint_matching.identify_fingerprint(probe) is None
+
+
+def test_unenrolled_finger_cannot_log_in(enrolled, monkeypatch):
+    pytest.importorskip("flask_jwt_extended")
+    from flask import Flask
+    from flask_jwt_extended import JWTManager
+    from bson import ObjectId
+    from routes import auth_routes
+
+    rng, fingers = enrolled
+    users = [
+        {
+            "_id": ObjectId(owner),
+            "username": f"user{i}",
+            "email": f"user{i}@example.com",
+            "role": "client",
+            "account_status": "active",
+            "fingerprint_hashes": [f"hash{i}"],
+        }
+        for i, owner in enumerate(fingers)
+    ]
+    monkeypatch.setattr(auth_routes, "get_db", lambda: FakeDatabase(users))
+    monkeypatch.setattr(auth_routes, "save_log", lambda **kwargs: None)
+
+    probes = []
+    monkeypatch.setattr(
+        auth_routes,
+        "get_fingerprint_features",
+        lambda binary: {"hash": "unenrolled", "minutiae": probes.pop()},
+    )
+
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "test"
+    JWTManager(app)
+    app.register_blueprint(auth_routes.auth_bp, url_prefix="/api/auth")
+    client = app.test_client()
+
+    for _ in range(20):
+        probes.append(synthetic_finger(rng, int(rng.integers(30, 70))))
+        response = client.post("/api/auth/login", json={"fingerprint": "AAAA"})
+        assert response.status_code == 401
+        assert "access_token" not in response.get_json()
+
+    owner, finger = next(iter(fingers.items()))
+    probes.append(another_capture(rng, finger))
+    response = client.post("/api/auth/login", json={"fingerprint": "AAAA"})
+    assert response.status_code == 200
+    assert response.get_json()["user"]["user_id"] == owner
@@ -0,0 +1,33 @@
+import time
+import pytest
+
+from utils import fingerprint_pool
+from utils.fingerprint_pool import FingerprintTimeoutError, run_fingerprint_job
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setenv("FINGERPRINT_POOL_WORKERS", "1")
+    monkeypatch.setenv("FINGERPRINT_JOB_TIMEOUT", "1")
+    fingerprint_pool.shutdown_fingerprint_pool()
+    yield fingerprint_pool.init_fingerprint_pool()
+    fingerprint_pool.shutdown_fingerprint_pool()
+
+
+def test_hung_job_does_not_block_the_next_one(pool):
+    with pytest.raises(FingerprintTimeoutError):
+        run_fingerprint_job(time.sleep, 60, timeout=0.5)
+
+    # The only worker is still sleeping; the next job gets a fresh pool
+    started = time.monotonic()
+    assert run_fingerprint_job(pow, 2, 8, timeout=10) == 256
+    assert fingerprint_pool.executor is not pool
+
+    # The stuck worker is terminated once the grace period is over
+    stuck = list(pool._processes.values())
+    deadline = time.monotonic() + 10
+    while any(process.is_alive() for process in stuck):
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    assert time.monotonic() - started < 10
+
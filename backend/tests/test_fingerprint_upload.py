@@ -0,0 +1,79 @@
+import io
+import pytest
+
+flask = pytest.importorskip("flask")
+
+from utils.fingerprint_upload import read_fingerprint_request, FingerprintUploadError
+
+app = flask.Flask(__name__)
+
+
+def test_raw_body_takes_only_identifying_fields_from_query_string():
+    with app.test_request_context(
+        "/login?email=john@example.com&role=admin",
+        method="POST",
+        data=b"image",
+        content_type="application/octet-stream",
+    ):
+        assert read_fingerprint_request() == ({"email": "john@example.com"}, b"image")
+
+
+def test_raw_body_refuses_password_in_query_string():
+    with app.test_request_context(
+        "/login?email=john@example.com&password=SecureP@ss123",
+        method="POST",
+        data=b"image",
+        content_type="image/png",
+    ):
+        with pytest.raises(FingerprintUploadError) as error:
+            read_fingerprint_request()
+        assert error.value.status == 400
+
+
+def test_multipart_fields_come_from_the_form():
+    with app.test_request_context(
+        "/login?password=SecureP@ss123",
+        method="POST",
+        data={
+            "email": "john@example.com",
+            "fingerprint": (io.BytesIO(b"image"), "f.png"),
+        },
+        content_type="multipart/form-data",
+    ):
+        assert read_fingerprint_request() == ({"email": "john@example.com"}, b"image")
+
+
+def test_oversized_raw_body_is_rejected(monkeypatch):
+    monkeypatch.setenv("FINGERPRINT_UPLOAD_MAX_BYTES", "4")
+    with app.test_request_context(
+        "/login", method="POST", data=b"image", content_type="image/png"
+    ):
+        with pytest.raises(FingerprintUploadError) as error:
+            read_fingerprint_request()
+        assert error.value.status == 413
+
+
+def test_password_in_query_string_cannot_log_in(monkeypatch):
+    pytest.importorskip("flask_jwt_extended")
+    from flask_jwt_extended import JWTManager
+    from routes import auth_routes
+
+    def no_database():
+        raise AssertionError("the request must be refused before any lookup")
+
+    monkeypatch.setattr(auth_routes, "get_db", lambda: None)
+    monkeypatch.setattr(auth_routes, "get_fingerprint_features", no_database)
+    monkeypatch.setattr(auth_routes, "save_log", lambda **kwargs: None)
+
+    login_app = flask.Flask(__name__)
+    login_app.config["JWT_SECRET_KEY"] = "test"
+    JWTManager(login_app)
+    login_app.register_blueprint(auth_routes.auth_bp, url_prefix="/api/auth")
+
+    response = login_app.test_client().post(
+        "/api/auth/login?email=admin@example.com&password=admin123",
+        data=b"anything",
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == 400
+    assert "access_token" not in response.get_json()
@@ -1,6 +1,76 @@
+import io
 import os
 import hashlib
-import itertools
+import tempfile
+import numpy as np
+
+# Encrypted files: 16-byte salt, then the data XORed with a 32-byte
+# PBKDF2-HMAC-SHA256 key derived from the fingerprint and the salt
+SALT_SIZE = 16
+KEY_SIZE = 32
+KEY_ITERATIONS = 10000  # fewer iterations for speed
+
+# Bytes of keystream XORed per row; a block of whole keys keeps NumPy in
+# long contiguous runs instead of one 32-byte row at a time
+KEYSTREAM_BLOCK = 64 * 1024
+
+# Bytes read and encrypted at a time by the streaming API
+CHUNK_SIZE = 1024 * 1024
+
+
+def derive_key(fingerprint, salt):
+    """
+    Derive the encryption key of a file from a fingerprint and its salt.
+
+    Args:
+        fingerprint (str or bytes): The fingerprint to derive the key from
+        salt (bytes): The SALT_SIZE bytes stored at the start of the file
+
+    Returns:
+        bytes: KEY_SIZE bytes
+    """
+    if isinstance(fingerprint, str):
+        fingerprint = fingerprint.encode()
+    return hashlib.pbkdf2_hmac("sha256", fingerprint, salt, KEY_ITERATIONS, KEY_SIZE)
+
+
+def xor_keystream(data, key, position=0, out=None):
+    """
+    XOR data with the key repeated over it, a whole buffer at a time.
+
+    Args:
+        data (bytes-like): The data to encrypt or decrypt
+        key (bytes): The key, repeated as the keystream
+        position (int): Keystream offset of the first byte of data, i.e.
+            its offset in the encrypted payload after the salt
+        out (writable bytes-like): Buffer of len(data) bytes receiving the
+            result, may be data itself; a new bytearray by default
+
+    Returns:
+        The buffer holding the result
+    """
+    size = len(data)
+    if out is None:
+        out = bytearray(size)
+    if size == 0:
+        return out
+
+    source = np.frombuffer(data, dtype=np.uint8)
+    target = np.frombuffer(out, dtype=np.uint8)
+
+    # Keystream block starting at `position`, repeated along the data
+    period = len(key)
+    first = np.roll(np.frombuffer(key, dtype=np.uint8), -(position % period))
+    keystream = np.tile(first, -(-min(size, KEYSTREAM_BLOCK) // period))
+
+    full = size - size % keystream.size
+    np.bitwise_xor(
+        source[:full].reshape(-1, keystream.size),
+        keystream,
+        out=target[:full].reshape(-1, keystream.size),
+    )
+    np.bitwise_xor(source[full:], keystream[: size - full], out=target[full:])
+    return out
 
 
 def simple_encrypt_bytes(data, fingerprint):
@@ -17,36 +87,17 @@ def simple_encrypt_bytes(data, fingerprint):
     try:
         print(f"Original data size: {len(data)} bytes")
 
-        # Generate a key from the fingerprint
-        if isinstance(fingerprint, str):
-            fingerprint_bytes = fingerprint.encode()
-        else:
-            fingerprint_bytes = fingerprint
-
         # Create a salt for key derivation
-        salt = os.urandom(16)
-
-        # Generate a key using PBKDF2
-        key = hashlib.pbkdf2_hmac(
-            "sha256",
-            fingerprint_bytes,
-            salt,
-            10000,  # fewer iterations for speed
-            32,  # key length
-        )
-
-        print(f"Generated key (first 10 bytes): {key.hex()[:20]}...")
-
-        # Create a repeating key stream
-        key_stream = itertools.cycle(key)
+        salt = os.urandom(SALT_SIZE)
 
-        # XOR the data with the key stream
-        encrypted_data = bytearray(len(data))
-        for i, byte in enumerate(data):
-            encrypted_data[i] = byte ^ next(key_stream)
+        # Generate a key from the fingerprint using PBKDF2
+        key = derive_key(fingerprint, salt)
 
-        # Prepend the salt to the encrypted data
-        result = salt + bytes(encrypted_data)
+        # XOR the data with the repeating key, written after the salt
+        result = bytearray(len(salt) + len(data))
+        result[: len(salt)] = salt
+        xor_keystream(data, key, out=memoryview(result)[len(salt) :])
+        result = bytes(result)
 
         print(f"Encrypted data size: {len(result)} bytes")
         return result
@@ -71,41 +122,18 @@ def simple_decrypt_bytes(encrypted_data, fingerprint):
         print(f"Encrypted data size: {len(encrypted_data)} bytes")
 
         # Check if data is large enough to contain salt
-        if len(encrypted_data) < 16:
+        if len(encrypted_data) < SALT_SIZE:
             raise ValueError("Encrypted data is too small to contain salt")
 
         # Extract salt and encrypted data
-        salt = encrypted_data[:16]
-        data_to_decrypt = encrypted_data[16:]
+        salt = bytes(encrypted_data[:SALT_SIZE])
+        data_to_decrypt = memoryview(encrypted_data)[SALT_SIZE:]
 
-        print(
-            f"Salt: {salt.hex()[:10]}..., Data to decrypt size: {len(data_to_decrypt)} bytes"
-        )
-
-        # Generate the key from the fingerprint and salt
-        if isinstance(fingerprint, str):
-            fingerprint_bytes = fingerprint.encode()
-        else:
-            fingerprint_bytes = fingerprint
-
-        # Generate a key using PBKDF2
-        key = hashlib.pbkdf2_hmac(
-            "sha256",
-            fingerprint_bytes,
-            salt,
-            10000,  # same iterations as encryption
-            32,  # key length
-        )
-
-        print(f"Generated key (first 10 bytes): {key.hex()[:20]}...")
+        # Generate the key from the fingerprint and salt using PBKDF2
+        key = derive_key(fingerprint, salt)
 
-        # Create a repeating key stream
-        key_stream = itertools.cycle(key)
-
-        # XOR the encrypted data with the key stream to decrypt
-        decrypted_data = bytearray(len(data_to_decrypt))
-        for i, byte in enumerate(data_to_decrypt):
-            decrypted_data[i] = byte ^ next(key_stream)
+        # XOR the encrypted data with the repeating key to decrypt
+        decrypted_data = xor_keystream(data_to_decrypt, key)
 
         print(f"Decrypted data size: {len(decrypted_data)} bytes")
         return bytes(decrypted_data)
@@ -113,3 +141,414 @@ def simple_decrypt_bytes(encrypted_data, fingerprint):
     except Exception as e:
         print(f"Error in simple_decrypt_bytes: {str(e)}")
         raise
+
+
+class StreamEncryptor:
+    """
+    Encrypt data chunk by chunk in the simple_encrypt_bytes format.
+
+    The salt header is written first, then every chunk passed to update is
+    encrypted at its position in the payload, so the output is the same as
+    simple_encrypt_bytes with that salt while only one chunk is in memory.
+    """
+
+    def __init__(self, fingerprint, salt=None):
+        self.salt = salt or os.urandom(SALT_SIZE)
+        self.key = derive_key(fingerprint, self.salt)
+        self.position = 0
+
+    def header(self):
+        """Bytes to write before the first encrypted chunk"""
+        return self.salt
+
+    def update(self, chunk, out=None):
+        """
+        Encrypt the next chunk of data.
+
+        Args:
+            chunk (bytes-like): Next plaintext bytes
+            out (writable bytes-like): Buffer of len(chunk) bytes receiving
+                the result, may be chunk itself
+
+        Returns:
+            bytes, or out when given
+        """
+        result = xor_keystream(chunk, self.key, self.position, out)
+        self.position += len(chunk)
+        return result if out is not None else bytes(result)
+
+    def stream(self, source, chunk_size=CHUNK_SIZE):
+        """
+        Encrypt a file object.
+
+        Yields:
+            bytes: The salt header, then each encrypted chunk
+        """
+        yield self.header()
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            yield self.update(chunk)
+
+
+class StreamDecryptor:
+    """
+    Decrypt data in the simple_encrypt_bytes format chunk by chunk.
+
+    Chunks may be split anywhere: the salt is collected from the first
+    bytes, then every following byte is decrypted at its position.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.salt = b""
+        self.key = None
+        self.position = 0
+
+    def update(self, chunk, out=None):
+        """
+        Decrypt the next chunk of encrypted data.
+
+        Args:
+            chunk (bytes-like): Next encrypted bytes, salt included
+            out (writable bytes-like): Buffer of at least len(chunk) bytes
+                receiving the plaintext
+
+        Returns:
+            The plaintext, shorter than chunk while the salt is consumed;
+            a view of out when given, bytes otherwise
+        """
+        chunk = memoryview(chunk)
+        if self.key is None:
+            missing = SALT_SIZE - len(self.salt)
+            self.salt += bytes(chunk[:missing])
+            chunk = chunk[missing:]
+            if len(self.salt) < SALT_SIZE:
+                return memoryview(out)[:0] if out is not None else b""
+            self.key = derive_key(self.fingerprint, self.salt)
+
+        target = memoryview(out)[: len(chunk)] if out is not None else None
+        result = xor_keystream(chunk, self.key, self.position, target)
+        self.position += len(chunk)
+        return result if out is not None else bytes(result)
+
+    def finalize(self):
+        """
+        Check that the whole salt was received.
+
+        Raises:
+            ValueError: If the data ended before the end of the salt
+        """
+        if self.key is None:
+            raise ValueError("Encrypted data is too small to contain salt")
+
+    def stream(self, source, chunk_size=CHUNK_SIZE):
+        """
+        Decrypt a file object.
+
+        Yields:
+            bytes: Each decrypted chunk
+        """
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            plaintext = self.update(chunk)
+            if plaintext:
+                yield plaintext
+        self.finalize()
+
+
+def encrypt_stream(source, destination, fingerprint, chunk_size=CHUNK_SIZE):
+    """
+    Encrypt a file object into another, one chunk in memory at a time.
+
+    Args:
+        source: Readable file object with the plaintext
+        destination: Writable file object receiving the encrypted data
+        fingerprint (str or bytes): The fingerprint to derive the key from
+        chunk_size (int): Bytes read and encrypted at a time
+
+    Returns:
+        int: Number of plaintext bytes encrypted
+    """
+    encryptor = StreamEncryptor(fingerprint)
+    destination.write(encryptor.header())
+    buffer = bytearray(chunk_size)
+
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        destination.write(encryptor.update(chunk, memoryview(buffer)[: len(chunk)]))
+    return encryptor.position
+
+
+def decrypt_stream(source, destination, fingerprint, chunk_size=CHUNK_SIZE):
+    """
+    Decrypt a file object into another, one chunk in memory at a time.
+
+    Returns:
+        int: Number of plaintext bytes written
+
+    Raises:
+        ValueError: If the source is too short to contain the salt
+    """
+    decryptor = StreamDecryptor(fingerprint)
+    buffer = bytearray(chunk_size)
+
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        destination.write(decryptor.update(chunk, buffer))
+    decryptor.finalize()
+    return decryptor.position
+
+
+class XorCipher:
+    """
+    Keystream of the current file format: the key repeated, so byte i of
+    the payload is XORed with key[i % KEY_SIZE].
+    """
+
+    name = "xor"
+    header_size = SALT_SIZE
+
+    def __init__(self, fingerprint, header):
+        self.key = derive_key(fingerprint, header[:SALT_SIZE])
+
+    @classmethod
+    def new_header(cls):
+        """Header of a new file: a random salt"""
+        return os.urandom(cls.header_size)
+
+    def apply(self, data, position, out=None):
+        """Encrypt or decrypt data found at `position` in the payload"""
+        return xor_keystream(data, self.key, position, out)
+
+
+class AesCtrCipher:
+    """
+    Keystream of an AES-256-CTR file format: the salt, then a 16-byte
+    initial counter block. Block n of the payload is XORed with
+    AES(key, counter + n), so any offset is reached by computing its
+    counter block, as with the XOR format.
+
+    Uploads are still written in the XOR format; a file in this format is
+    written as new_header() followed by apply(plaintext, 0), in one piece
+    or chunk by chunk at increasing positions.
+    """
+
+    name = "aes-ctr"
+    block_size = 16
+    header_size = SALT_SIZE + block_size
+
+    def __init__(self, fingerprint, header):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        self.cipher_class, self.algorithm, self.mode = Cipher, algorithms.AES, modes.CTR
+        self.key = derive_key(fingerprint, header[:SALT_SIZE])
+        self.counter = int.from_bytes(header[SALT_SIZE : self.header_size], "big")
+
+    @classmethod
+    def new_header(cls):
+        """Header of a new file: a random salt and initial counter block"""
+        return os.urandom(cls.header_size)
+
+    def apply(self, data, position, out=None):
+        """Encrypt or decrypt data found at `position` in the payload"""
+        block, skip = divmod(position, self.block_size)
+        counter = (self.counter + block) % (1 << (8 * self.block_size))
+        keystream = self.cipher_class(
+            self.algorithm(self.key),
+            self.mode(counter.to_bytes(self.block_size, "big")),
+        ).encryptor()
+        keystream.update(bytes(skip))
+
+        result = keystream.update(bytes(data))
+        if out is None:
+            return bytearray(result)
+        out[:] = result
+        return out
+
+
+# Ciphers by the name recorded in the "cipher" field of file records
+CIPHERS = {cipher.name: cipher for cipher in (XorCipher, AesCtrCipher)}
+
+
+class DecryptingReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over the plaintext of a stored file.
+
+    Every keystream byte is addressable by its position, so a seek only
+    moves the offset in the stored file and a read decrypts exactly the
+    bytes returned, e.g. one range of a download or the first lines of a
+    large encrypted log.
+    """
+
+    def __init__(self, raw, fingerprint=None, cipher="xor"):
+        """
+        Args:
+            raw: Seekable binary file object of the stored file
+            fingerprint (str or bytes): The fingerprint the file was
+                encrypted with, None for an unencrypted file
+            cipher (str): Name of the file format in CIPHERS
+
+        Raises:
+            ValueError: If the file is too short to hold its header
+        """
+        super().__init__()
+        self.raw = raw
+        self.cipher = None
+        self.header_size = 0
+
+        if fingerprint is not None:
+            cipher_class = CIPHERS[cipher]
+            header = raw.read(cipher_class.header_size)
+            if len(header) < cipher_class.header_size:
+                raise ValueError("Encrypted data is too small to contain salt")
+            self.cipher = cipher_class(fingerprint, header)
+            self.header_size = cipher_class.header_size
+
+        self.size = max(0, raw.seek(0, os.SEEK_END) - self.header_size)
+        self.position = 0
+
+    @classmethod
+    def open(cls, path, fingerprint=None, cipher="xor"):
+        """Open a stored file; the reader closes it when closed"""
+        raw = open(path, "rb")
+        try:
+            return cls(raw, fingerprint, cipher)
+        except Exception:
+            raw.close()
+            raise
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        """Read and decrypt plaintext at the current position into buffer"""
+        view = memoryview(buffer).cast("B")
+        length = max(0, min(len(view), self.size - self.position))
+        if length == 0:
+            return 0
+
+        self.raw.seek(self.header_size + self.position)
+        count = self.raw.readinto(view[:length]) or 0
+        if self.cipher is not None and count:
+            self.cipher.apply(view[:count], self.position, out=view[:count])
+        self.position += count
+        return count
+
+    def readall(self):
+        # One read to the end instead of RawIOBase's small steps
+        buffer = bytearray(max(0, self.size - self.position))
+        del buffer[self.readinto(buffer) :]
+        return bytes(buffer)
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
+
+def iter_plaintext(reader, start=0, stop=None, chunk_size=CHUNK_SIZE):
+    """
+    Read the plaintext of a DecryptingReader between two offsets.
+
+    Only the requested bytes are read and decrypted; the reader is closed
+    once the range is read or the consumer stops.
+
+    Args:
+        reader (DecryptingReader): The opened stored file
+        start (int): First plaintext byte
+        stop (int): End of the range, exclusive; the end of the file by
+            default
+        chunk_size (int): Bytes read at a time
+
+    Yields:
+        bytes: Chunks of plaintext
+    """
+    stop = reader.size if stop is None else min(stop, reader.size)
+    reader.seek(start)
+
+    with reader:
+        buffer = bytearray(chunk_size)
+        while reader.tell() < stop:
+            view = memoryview(buffer)[: min(chunk_size, stop - reader.tell())]
+            count = reader.readinto(view)
+            if not count:
+                break
+            yield bytes(view[:count])
+
+
+class UploadWriter:
+    """
+    Sink for an uploaded file, written to as the request body is parsed.
+
+    Data is counted, hashed and, when a fingerprint is given, encrypted as
+    it arrives, then written to a temporary file in the upload directory;
+    commit renames it into place. Only one chunk of the upload is in
+    memory at a time, whatever its size.
+    """
+
+    def __init__(self, directory, fingerprint=None, chunk_size=CHUNK_SIZE):
+        fd, self.temporary_path = tempfile.mkstemp(
+            dir=directory, prefix=".upload-", suffix=".part"
+        )
+        self.file = os.fdopen(fd, "wb")
+        self.encryptor = StreamEncryptor(fingerprint) if fingerprint else None
+        self.buffer = bytearray(chunk_size)
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+        if self.encryptor is not None:
+            self.file.write(self.encryptor.header())
+
+    @property
+    def encrypted(self):
+        return self.encryptor is not None
+
+    def write(self, data):
+        """Count, hash, encrypt and store the next bytes of the upload"""
+        data = memoryview(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+        if self.encryptor is None:
+            self.file.write(data)
+            return len(data)
+
+        for offset in range(0, len(data), len(self.buffer)):
+            piece = data[offset : offset + len(self.buffer)]
+            self.file.write(
+                self.encryptor.update(piece, memoryview(self.buffer)[: len(piece)])
+            )
+        return len(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        # The form parser rewinds each file once it is received; the data
+        # is already on disk, so there is nothing to read back
+        self.file.flush()
+        return 0
+
+    def commit(self, path):
+        """Flush the upload to disk and atomically move it to path"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.temporary_path, path)
+        self.temporary_path = None
+
+    def discard(self):
+        """Delete the temporary file unless the upload was committed"""
+        self.file.close()
+        if self.temporary_path is not None and os.path.exists(self.temporary_path):
+            os.remove(self.temporary_path)
+        self.temporary_path = None
@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from utils.fingerprint_pool import (
+    extract_fingerprint_pooled,
+    extract_fingerprints_pooled,
+)
+
+
+class FingerprintCache:
+    """
+    LRU cache with a time-to-live and a memory budget.
+
+    Keys are SHA-256 digests of the decoded image bytes, so a client that
+    retries the same capture gets the stored result back. Values are the
+    features returned by the pipeline.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key_for(fingerprint_binary):
+        return hashlib.sha256(fingerprint_binary).hexdigest()
+
+    @staticmethod
+    def entry_size(key, value):
+        return sys.getsizeof(key) + _deep_size(value)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.entry_size(key, value)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (value, time.monotonic() + self.ttl, size)
+            self.size += size
+
+            # Evict least recently used entries until we are within budget
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "size_bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.size -= size
+
+
+def _deep_size(value):
+    """Approximate memory used by a cached value and its containers"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(k) + _deep_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_size(item) for item in value)
+    return size
+
+
+fingerprint_cache = FingerprintCache(
+    max_bytes=int(os.environ.get("FINGERPRINT_CACHE_MAX_BYTES", 4 * 1024 * 1024)),
+    ttl=float(os.environ.get("FINGERPRINT_CACHE_TTL", 300)),
+)
+
+
+def cache_enabled():
+    return os.environ.get("FINGERPRINT_CACHE_ENABLED", "true").lower() == "true"
+
+
+def get_fingerprint_features(fingerprint_binary, use_cache=True):
+    """
+    Get the hash and minutiae of a fingerprint image, reusing cached results.
+
+    Args:
+        fingerprint_binary (bytes): Binary data of the fingerprint image
+        use_cache (bool): Set to False to always run the pipeline
+
+    Returns:
+        dict: "hash" and "minutiae", as returned by extract_fingerprint
+    """
+    if not (use_cache and cache_enabled()):
+        return extract_fingerprint_pooled(fingerprint_binary)
+
+    key = FingerprintCache.key_for(fingerprint_binary)
+    features = fingerprint_cache.get(key)
+
+    if features is None:
+        features = extract_fingerprint_pooled(fingerprint_binary)
+        fingerprint_cache.put(key, features)
+
+    return features
+
+
+def get_fingerprint_features_batch(fingerprint_binaries, use_cache=True):
+    """
+    Get the features of several captures, processing cache misses in parallel.
+
+    Args:
+        fingerprint_binaries (list): Binary data of each fingerprint image
+        use_cache (bool): Set to False to always run the pipeline
+
+    Returns:
+        list: One (features, timings, cached) tuple per capture, in input
+        order; see extract_fingerprints_pooled for features and timings
+    """
+    use_cache = use_cache and cache_enabled()
+    results = [None] * len(fingerprint_binaries)
+    misses = []
+
+    for i, fingerprint_binary in enumerate(fingerprint_binaries):
+        features = None
+        if use_cache:
+            features = fingerprint_cache.get(
+                FingerprintCache.key_for(fingerprint_binary)
+            )
+        if features is None:
+            misses.append(i)
+        else:
+            results[i] = (features, [], True)
+
+    processed = extract_fingerprints_pooled([fingerprint_binaries[i] for i in misses])
+    for i, (features, timings) in zip(misses, processed):
+        if use_cache and not isinstance(features, Exception):
+            fingerprint_cache.put(
+                FingerprintCache.key_for(fingerprint_binaries[i]), features
+            )
+        results[i] = (features, timings, False)
+
+    return results
+
+
+def get_fingerprint_hash(fingerprint_binary, use_cache=True):
+    """
+    Get the minutiae hash of a fingerprint image, reusing cached results.
+
+    Args:
+        fingerprint_binary (bytes): Binary data of the fingerprint image
+        use_cache (bool): Set to False to always run the pipeline
+
+    Returns:
+        str: Hash of the fingerprint minutiae
+    """
+    return get_fingerprint_features(fingerprint_binary, use_cache)["hash"]
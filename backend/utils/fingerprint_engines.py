@@ -0,0 +1,297 @@
+"""
+Interchangeable implementations of the fingerprint pipeline stages.
+
+Each stage has a reference engine, the plain per-pixel Python code the
+pipeline started with, and any number of faster candidates registered
+with register_engine. select_engines runs every candidate on a built-in
+synthetic capture, keeps those whose output is identical to the
+reference, and picks the fastest, so every node uses the quickest code
+path its installed libraries allow without changing any hash.
+
+Set FINGERPRINT_ENGINES (e.g. "thinning=numpy,filtering=reference") to
+skip the benchmark for the listed stages.
+"""
+
+import os
+import time
+import threading
+import numpy as np
+import cv2
+
+STAGES = ("thinning", "minutiae_extraction", "filtering")
+
+# Registered engines per stage, in registration order
+stage_engines = {stage: {} for stage in STAGES}
+
+# Engine chosen for each stage in this process, and how it was chosen
+selected_engines = {}
+selection_report = {}
+selection_lock = threading.Lock()
+
+# Held while engines are benchmarked, so concurrent first uses wait for
+# one selection instead of each running their own
+benchmark_lock = threading.Lock()
+
+
+def register_engine(stage, name):
+    """Decorator registering a function as an engine of a pipeline stage"""
+
+    def decorator(fn):
+        stage_engines[stage][name] = fn
+        return fn
+
+    return decorator
+
+
+def _transitions(pixels):
+    # Count transitions from 0 to 1 in the ordered sequence
+    n = 0
+    for i in range(len(pixels) - 1):
+        if pixels[i] == 0 and pixels[i + 1] == 1:
+            n += 1
+    return n
+
+
+@register_engine("thinning", "reference")
+def reference_thinning(image):
+    """Sequential Zhang-Suen thinning, one pixel at a time"""
+    skeleton = image.copy()
+    changing = True
+    while changing:
+        changing = False
+        rows, cols = skeleton.shape
+        for step in (1, 2):
+            for i in range(1, rows - 1):
+                for j in range(1, cols - 1):
+                    if skeleton[i, j] != 255:
+                        continue
+
+                    p2 = 1 if skeleton[i - 1, j] == 255 else 0
+                    p3 = 1 if skeleton[i - 1, j + 1] == 255 else 0
+                    p4 = 1 if skeleton[i, j + 1] == 255 else 0
+                    p5 = 1 if skeleton[i + 1, j + 1] == 255 else 0
+                    p6 = 1 if skeleton[i + 1, j] == 255 else 0
+                    p7 = 1 if skeleton[i + 1, j - 1] == 255 else 0
+                    p8 = 1 if skeleton[i, j - 1] == 255 else 0
+                    p9 = 1 if skeleton[i - 1, j - 1] == 255 else 0
+
+                    if step == 1:
+                        erasable = p2 * p4 * p6 == 0 and p4 * p6 * p8 == 0
+                    else:
+                        erasable = p2 * p4 * p8 == 0 and p2 * p6 * p8 == 0
+
+                    if (
+                        erasable
+                        and 2 <= p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9 <= 6
+                        and _transitions([p2, p3, p4, p5, p6, p7, p8, p9, p2]) == 1
+                    ):
+                        skeleton[i, j] = 0
+                        changing = True
+
+    return skeleton
+
+
+if hasattr(cv2, "ximgproc"):
+
+    @register_engine("thinning", "ximgproc")
+    def ximgproc_thinning(image):
+        """OpenCV contrib Zhang-Suen thinning (parallel sub-iterations)"""
+        return cv2.ximgproc.thinning(
+            image, thinningType=cv2.ximgproc.THINNING_ZHANGSUEN
+        )
+
+
+@register_engine("minutiae_extraction", "reference")
+def reference_minutiae(skeleton, offset_x=0, offset_y=0):
+    """Crossing number of every ridge pixel, one pixel at a time"""
+    minutiae_points = []
+    rows, cols = skeleton.shape
+
+    for i in range(1, rows - 1):
+        for j in range(1, cols - 1):
+            if skeleton[i, j] != 255:
+                continue
+
+            p = [
+                1 if skeleton[i - 1, j] == 255 else 0,
+                1 if skeleton[i - 1, j + 1] == 255 else 0,
+                1 if skeleton[i, j + 1] == 255 else 0,
+                1 if skeleton[i + 1, j + 1] == 255 else 0,
+                1 if skeleton[i + 1, j] == 255 else 0,
+                1 if skeleton[i + 1, j - 1] == 255 else 0,
+                1 if skeleton[i, j - 1] == 255 else 0,
+                1 if skeleton[i - 1, j - 1] == 255 else 0,
+            ]
+            cn = sum(abs(p[k] - p[(k + 1) % 8]) for k in range(8)) // 2
+
+            # cn=1 : Ridge ending, cn=3 : Ridge bifurcation
+            if cn == 1 or cn == 3:
+                minutiae_points.append((j + offset_x, i + offset_y, cn))
+
+    return minutiae_points
+
+
+@register_engine("filtering", "reference")
+def reference_filter(points, min_distance=10):
+    """Keep points farther than min_distance from every kept point"""
+    filtered = []
+    for p1 in points:
+        if all(
+            np.sqrt((p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2) >= min_distance
+            for p2 in filtered
+        ):
+            filtered.append(p1)
+    return filtered
+
+
+def synthetic_ridges(size=160):
+    """
+    Binary ridge image used to check and time the engines.
+
+    Twisted concentric ridges give endings and bifurcations; the same
+    image is produced on every node.
+    """
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float64)
+    radius = np.hypot(xx - size * 0.45, (yy - size * 0.55) * 1.3)
+    angle = np.arctan2(yy - size * 0.55, xx - size * 0.45)
+    phase = 2 * np.pi * radius / 9.0 + 1.5 * np.sin(2 * angle) + 0.02 * xx * yy / size
+    ridges = np.cos(phase) > 0.2
+    ridges[:2], ridges[-2:], ridges[:, :2], ridges[:, -2:] = False, False, False, False
+    return np.where(ridges, 255, 0).astype(np.uint8)
+
+
+def _same_output(expected, actual):
+    if isinstance(expected, np.ndarray):
+        return (
+            isinstance(actual, np.ndarray)
+            and expected.shape == actual.shape
+            and np.array_equal(expected, actual)
+        )
+    return list(map(tuple, expected)) == list(map(tuple, actual))
+
+
+def _time_engine(fn, args, repeats):
+    """Best of `repeats` runs, in seconds, and the output of the last run"""
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        output = fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+def _forced_engines():
+    """Engines pinned by FINGERPRINT_ENGINES, as {stage: name}"""
+    forced = {}
+    for item in os.environ.get("FINGERPRINT_ENGINES", "").split(","):
+        if "=" in item:
+            stage, name = (part.strip() for part in item.split("=", 1))
+            if name in stage_engines.get(stage, {}):
+                forced[stage] = name
+    return forced
+
+
+def select_engines(repeats=3):
+    """
+    Pick the fastest engine of every stage that matches the reference.
+
+    Stages pinned by FINGERPRINT_ENGINES are not benchmarked.
+
+    Returns:
+        dict: {stage: engine name}
+    """
+    forced = _forced_engines()
+
+    # Each stage is checked on the reference output of the previous one
+    args = (synthetic_ridges(),)
+    selection = {}
+    report = {}
+
+    for position, stage in enumerate(STAGES):
+        reference = stage_engines[stage]["reference"]
+
+        if stage in forced:
+            selection[stage] = forced[stage]
+            report[stage] = {"selected": forced[stage], "forced": True}
+            if any(later not in forced for later in STAGES[position + 1 :]):
+                args = (reference(*args),)
+            continue
+
+        seconds, expected = _time_engine(reference, args, 1)
+        candidates = {"reference": {"ms": seconds * 1000.0, "identical": True}}
+
+        for name, fn in stage_engines[stage].items():
+            if name == "reference":
+                continue
+            try:
+                seconds, output = _time_engine(fn, args, repeats)
+            except Exception as e:
+                candidates[name] = {"error": str(e)}
+                continue
+            candidates[name] = {
+                "ms": seconds * 1000.0,
+                "identical": _same_output(expected, output),
+            }
+
+        safe = [name for name, result in candidates.items() if result.get("identical")]
+        selection[stage] = min(safe, key=lambda name: candidates[name]["ms"])
+        report[stage] = {"selected": selection[stage], "candidates": candidates}
+        args = (expected,)
+
+    with selection_lock:
+        selected_engines.clear()
+        selected_engines.update(selection)
+        selection_report.clear()
+        selection_report.update(report)
+
+    return selection
+
+
+def use_engines(selection):
+    """
+    Adopt engines chosen by another process, e.g. in pool workers.
+
+    Args:
+        selection (dict): {stage: engine name} from select_engines
+    """
+    with selection_lock:
+        selected_engines.update(
+            {
+                stage: name
+                for stage, name in selection.items()
+                if name in stage_engines.get(stage, {})
+            }
+        )
+
+
+def get_selected_engines():
+    """
+    {stage: engine name} of this process, selecting engines if needed.
+
+    Called at startup by the API (see app.py) and the bulk enrolment CLI,
+    which hand the result to their worker processes with use_engines.
+    """
+    if len(selected_engines) < len(STAGES):
+        with benchmark_lock:
+            if len(selected_engines) < len(STAGES):
+                select_engines()
+    with selection_lock:
+        return dict(selected_engines)
+
+
+def get_engine(stage):
+    """Engine function of a stage, selecting engines if startup did not"""
+    name = selected_engines.get(stage)
+    if name is None:
+        name = get_selected_engines()[stage]
+    return stage_engines[stage][name]
+
+
+def get_engine_report():
+    """Selected engines with the timings and parity results behind them"""
+    with selection_lock:
+        return {
+            stage: selection_report.get(stage, {"selected": name})
+            for stage, name in selected_engines.items()
+        }
@@ -0,0 +1,390 @@
+"""
+Enrollment of fingerprint templates.
+
+The API saves newly enrolled templates with enroll_fingerprint_templates,
+which updates the user document, the shared template store and the
+identification index.
+
+The rest of the module is the offline bulk enrollment of fingerprint
+images, e.g. a site export. It walks an image directory, maps files to
+users through a CSV manifest, processes the captures on every core and
+pushes the templates to db.users in batches. From the backend directory:
+
+    python -m utils.fingerprint_enroll manifest.csv --images export/
+    python -m utils.fingerprint_enroll manifest.csv --images export/ --dry-run
+
+The manifest has a header row with a "file" column, the image path
+relative to --images, and one user column: "email", "username",
+"user_id" or "_id". A user may have several rows. Captures already
+enrolled for their user are skipped, so an interrupted run can be
+started again with the same manifest.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import datetime
+import multiprocessing
+from bson import ObjectId, Binary
+from pymongo import UpdateOne
+from database import get_db
+from utils.fingerprint_utils import extract_fingerprint, FingerprintQualityError
+from utils.fingerprint_engines import get_selected_engines, use_engines
+from utils.fingerprint_template import pack_template
+from utils.fingerprint_store import ensure_template_store
+from utils.fingerprint_index import get_minutiae_index
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".gif")
+USER_COLUMNS = ("email", "username", "user_id", "_id")
+
+
+def add_fingerprint_template(user_id, template):
+    """Store and index a newly enrolled template of a user"""
+    add_fingerprint_templates(user_id, [template])
+
+
+def add_fingerprint_templates(user_id, templates):
+    """Store and index several newly enrolled templates of a user"""
+    owner = str(user_id)
+    ensure_template_store().append_many(
+        [(owner, template["hash"], template["template"]) for template in templates]
+    )
+    get_minutiae_index()
+
+
+def remove_fingerprint_templates(user_id):
+    """Drop every template of a user from the store and the index"""
+    ensure_template_store().remove_owner(str(user_id))
+    get_minutiae_index()
+
+
+def build_template(features, created_at=None):
+    """Stored template document for the features of an enrolled capture"""
+    return {
+        "hash": features["hash"],
+        "template": Binary(pack_template(features["minutiae"])),
+        "created_at": created_at or datetime.datetime.utcnow(),
+    }
+
+
+def enroll_fingerprint_templates(user_id, templates):
+    """
+    Save newly enrolled templates of a user.
+
+    The hashes and templates are pushed to the user document in a single
+    update, then appended to the template store and the index.
+    """
+    get_db().users.update_one(
+        {"_id": ObjectId(user_id)},
+        {
+            "$push": {
+                "fingerprint_hashes": {
+                    "$each": [template["hash"] for template in templates]
+                },
+                "fingerprint_templates": {"$each": templates},
+            }
+        },
+    )
+    add_fingerprint_templates(user_id, templates)
+
+
+def read_manifest(path):
+    """
+    Read the file to user mapping of a manifest.
+
+    Returns:
+        tuple: (user column, list of (relative file path, user key))
+
+    Raises:
+        ValueError: If the header has no "file" column or no user column
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        columns = reader.fieldnames or []
+        if "file" not in columns:
+            raise ValueError('Manifest must have a "file" column')
+        user_column = next((c for c in USER_COLUMNS if c in columns), None)
+        if user_column is None:
+            raise ValueError(
+                f"Manifest must have one of the columns: {', '.join(USER_COLUMNS)}"
+            )
+        rows = [
+            (os.path.normpath(row["file"].strip()), row[user_column].strip())
+            for row in reader
+            if row.get("file") and row.get(user_column)
+        ]
+    return user_column, rows
+
+
+def walk_images(directory):
+    """Relative paths of the images below a directory"""
+    images = set()
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                images.add(
+                    os.path.normpath(
+                        os.path.relpath(os.path.join(root, name), directory)
+                    )
+                )
+    return images
+
+
+def resolve_users(user_column, keys):
+    """
+    Map manifest user keys to user document IDs.
+
+    Returns:
+        dict: {key: user ObjectId string} for the users that exist
+    """
+    keys = sorted(set(keys))
+    if user_column == "_id":
+        values = [ObjectId(key) for key in keys if ObjectId.is_valid(key)]
+    else:
+        values = keys
+
+    users = get_db().users.find({user_column: {"$in": values}}, {user_column: 1})
+    return {str(user[user_column]): str(user["_id"]) for user in users}
+
+
+def _process_capture(task):
+    """
+    Run the pipeline on one image in a worker process.
+
+    Returns:
+        tuple: (file, owner, features or None, quality scores, error or None)
+    """
+    file, owner, path = task
+    try:
+        with open(path, "rb") as f:
+            features = extract_fingerprint(f.read())
+        return file, owner, features, features["quality"], None
+    except FingerprintQualityError as e:
+        return file, owner, None, e.scores, f"rejected: {e}"
+    except Exception as e:
+        return file, owner, None, None, f"failed: {e}"
+
+
+def write_batch(batch, store):
+    """
+    Push a batch of enrolled templates to db.users and the template store.
+
+    Each capture is pushed only if its hash is not enrolled yet for the
+    user, which makes re-running a manifest safe.
+
+    Args:
+        batch (list): (owner, template document) tuples
+        store: Template store shared with the API workers
+
+    Returns:
+        int: Number of templates added to db.users
+    """
+    if not batch:
+        return 0
+
+    result = get_db().users.bulk_write(
+        [
+            UpdateOne(
+                {
+                    "_id": ObjectId(owner),
+                    "fingerprint_hashes": {"$ne": template["hash"]},
+                },
+                {
+                    "$push": {
+                        "fingerprint_hashes": template["hash"],
+                        "fingerprint_templates": template,
+                    }
+                },
+            )
+            for owner, template in batch
+        ],
+        ordered=False,
+    )
+
+    # Store entries replace earlier ones with the same ID, so templates
+    # already enrolled are appended again harmlessly
+    store.append_many(
+        [(owner, template["hash"], template["template"]) for owner, template in batch]
+    )
+    return result.modified_count
+
+
+def summarize_quality(scores):
+    """Mean, minimum and maximum of each quality measure"""
+    summary = {}
+    for name in sorted({name for score in scores for name in score}):
+        values = [score[name] for score in scores if name in score]
+        summary[name] = {
+            "mean": sum(values) / len(values),
+            "min": min(values),
+            "max": max(values),
+        }
+    return summary
+
+
+def bulk_enroll(
+    manifest, images, workers=None, chunksize=None, batch_size=500, dry_run=False
+):
+    """
+    Enroll every image of a directory listed in a manifest.
+
+    Args:
+        manifest (str): Path of the CSV manifest
+        images (str): Directory the manifest paths are relative to
+        workers (int): Worker processes, defaults to the number of cores
+        chunksize (int): Captures handed to a worker at a time, chosen
+            from the number of captures and workers by default
+        batch_size (int): Templates written per bulk_write
+        dry_run (bool): Process the captures without writing anything
+
+    Returns:
+        dict: Counts, throughput, quality summary and failed captures
+    """
+    user_column, rows = read_manifest(manifest)
+    available = walk_images(images)
+    owners = resolve_users(user_column, [key for _, key in rows])
+
+    listed = {file for file, _ in rows}
+    tasks = []
+    failures = []
+    for file, key in rows:
+        if file not in available:
+            failures.append({"file": file, "error": "missing: file not found"})
+        elif key not in owners:
+            failures.append({"file": file, "error": f"missing: unknown user {key}"})
+        else:
+            tasks.append((file, owners[key], os.path.join(images, file)))
+
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        # A few chunks per worker balances slow captures without paying
+        # inter-process overhead for every image
+        chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+
+    store = None if dry_run else ensure_template_store()
+    started = time.perf_counter()
+    enrolled = 0
+    added = 0
+    rejected = 0
+    accepted_quality = []
+    batch = []
+
+    context = multiprocessing.get_context(
+        os.environ.get("FINGERPRINT_POOL_START_METHOD", "spawn")
+    )
+    with context.Pool(
+        workers, initializer=use_engines, initargs=(get_selected_engines(),)
+    ) as pool:
+        for file, owner, features, quality, error in pool.imap_unordered(
+            _process_capture, tasks, chunksize
+        ):
+            if error is not None:
+                rejected += error.startswith("rejected")
+                failures.append({"file": file, "error": error, "quality": quality})
+                continue
+
+            enrolled += 1
+            accepted_quality.append(quality or {})
+            if not dry_run:
+                batch.append((owner, build_template(features)))
+                if len(batch) >= batch_size:
+                    added += write_batch(batch, store)
+                    batch = []
+
+    if not dry_run:
+        added += write_batch(batch, store)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "manifest_rows": len(rows),
+        "unlisted_images": len(available - listed),
+        "processed": len(tasks),
+        "enrolled": enrolled,
+        "added": added,
+        "already_enrolled": 0 if dry_run else enrolled - added,
+        "rejected": rejected,
+        "failed": len(failures) - rejected,
+        "elapsed_seconds": elapsed,
+        "images_per_second": len(tasks) / elapsed if elapsed > 0 else 0.0,
+        "workers": workers,
+        "chunksize": chunksize,
+        "dry_run": dry_run,
+        "quality": summarize_quality(accepted_quality),
+        "failures": failures,
+    }
+
+
+def print_report(report):
+    print(
+        f"Processed {report['processed']} of {report['manifest_rows']} manifest rows "
+        f"in {report['elapsed_seconds']:.1f} s "
+        f"({report['images_per_second']:.1f} images/s, {report['workers']} workers)"
+    )
+    print(
+        f"Enrolled {report['enrolled']} (added {report['added']}, already enrolled "
+        f"{report['already_enrolled']}), rejected {report['rejected']}, "
+        f"failed {report['failed']}, images not in manifest "
+        f"{report['unlisted_images']}"
+    )
+    for name, summary in report["quality"].items():
+        print(
+            f"  {name:>18}: mean {summary['mean']:.3f}  "
+            f"min {summary['min']:.3f}  max {summary['max']:.3f}"
+        )
+    for failure in report["failures"][:20]:
+        print(f"  {failure['file']}: {failure['error']}")
+    if len(report["failures"]) > 20:
+        print(f"  ... {len(report['failures']) - 20} more")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Enroll a directory of fingerprint images listed in a manifest"
+    )
+    parser.add_argument("manifest", help="CSV with a file column and a user column")
+    parser.add_argument(
+        "--images", required=True, help="directory the manifest paths are relative to"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="process without writing anything"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument(
+        "--failures", help="write failed captures to this CSV (file, error)"
+    )
+    args = parser.parse_args(argv)
+
+    report = bulk_enroll(
+        args.manifest,
+        args.images,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+
+    if args.failures:
+        with open(args.failures, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["file", "error"])
+            writer.writerows(
+                (failure["file"], failure["error"]) for failure in report["failures"]
+            )
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    return 0 if report["enrolled"] or not report["processed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
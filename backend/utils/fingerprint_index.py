@@ -0,0 +1,668 @@
+"""
+Identification index of enrolled fingerprints.
+
+Templates are indexed by the shapes of triangles formed by neighbouring
+minutiae, so identification only verifies the few users whose templates
+share the most triangles with a probe. Every process maps one snapshot of
+the index built from the shared template store (see fingerprint_store),
+and indexes in memory the templates appended after it.
+"""
+
+import os
+import mmap
+import struct
+import itertools
+import threading
+import numpy as np
+from utils.fingerprint_template import minutiae_points
+from utils.fingerprint_store import (
+    ENTRY_TEMPLATE,
+    ENTRY_REMOVE_OWNER,
+    ensure_template_store,
+)
+
+INDEX_MAGIC = b"FPIX"
+INDEX_VERSION = 1
+# magic, version, store inode, store position, templates, postings,
+# length of the names, side bin, angle bin
+INDEX_HEADER = struct.Struct(">4sB3xQQIQQdd")
+INDEX_HEADER_SIZE = 64  # header padded so the postings are 8-byte aligned
+
+
+def minutiae_triangles(points, neighbours=5, min_side=8.0):
+    """
+    Build rotation and translation invariant triangles from a minutiae set.
+
+    Each minutia is joined with every pair of its nearest neighbours, which
+    keeps the number of triangles linear in the number of minutiae. The
+    vertices of a triangle are ordered by the length of the opposite side,
+    so the same triangle gets the same description in every capture.
+
+    Args:
+        points: Minutiae records or (x, y, type, orientation) tuples
+        neighbours (int): Nearest neighbours used around each minutia
+        min_side (float): Triangles with a shorter side are discarded
+
+    Returns:
+        dict: Per triangle arrays "sides" (n, 3) sorted lengths, "angles"
+        (n, 3) vertex orientations relative to the longest side in degrees
+        0..179, "types" (n, 3) vertex types, "centres" (n, 2) centroids and
+        "directions" (n,) direction of the longest side in degrees 0..359
+    """
+    if len(points) < 3:
+        return None
+
+    minutiae = minutiae_points(points)
+    xy = minutiae[:, :2]
+    distances = np.sqrt(((xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=-1))
+
+    k = min(neighbours, len(xy) - 1)
+    nearest = np.argsort(distances, axis=1)[:, 1 : k + 1]
+
+    pairs = np.array(list(itertools.combinations(range(k), 2)))
+    vertices = np.stack(
+        [
+            np.repeat(np.arange(len(xy)), len(pairs)),
+            nearest[:, pairs[:, 0]].ravel(),
+            nearest[:, pairs[:, 1]].ravel(),
+        ],
+        axis=1,
+    )
+    vertices = np.unique(np.sort(vertices, axis=1), axis=0)
+
+    a, b, c = vertices.T
+    opposite = np.stack([distances[b, c], distances[a, c], distances[a, b]], axis=1)
+    order = np.argsort(opposite, axis=1)
+    vertices = np.take_along_axis(vertices, order, axis=1)
+    sides = np.take_along_axis(opposite, order, axis=1)
+
+    keep = sides[:, 0] >= min_side
+    vertices, sides = vertices[keep], sides[keep]
+
+    # The longest side joins the vertices opposite the two shorter sides
+    start, end = xy[vertices[:, 0]], xy[vertices[:, 1]]
+    directions = np.degrees(
+        np.arctan2(end[:, 1] - start[:, 1], end[:, 0] - start[:, 0])
+    )
+
+    return {
+        "sides": sides,
+        "angles": (minutiae[vertices, 3] - directions[:, None]) % 180.0,
+        "types": minutiae[vertices, 2].astype(np.int64),
+        "centres": xy[vertices].mean(axis=1),
+        "directions": directions % 360.0,
+    }
+
+
+class IndexSnapshot:
+    """
+    Read-only MinutiaeIndex postings shared by every process through mmap.
+
+    The postings of all templates are sorted by key into flat arrays, so
+    a lookup is a binary search and the tables live once in the page
+    cache however many API workers map them. The snapshot is tied to one
+    template store file (its inode) and the store position it was built
+    at; templates appended later are indexed in memory by each process.
+    """
+
+    def __init__(self, mapped, header):
+        (
+            _,
+            _,
+            self.inode,
+            self.position,
+            count,
+            postings,
+            names_length,
+            self.side_bin,
+            self.angle_bin,
+        ) = header
+        offset = INDEX_HEADER_SIZE
+
+        def column(dtype, length):
+            nonlocal offset
+            array = np.frombuffer(mapped, dtype, length, offset)
+            offset += array.nbytes
+            return array
+
+        self.keys = column("<i8", postings)
+        self.serials = column("<i4", postings)
+        self.cx = column("<f4", postings)
+        self.cy = column("<f4", postings)
+        self.directions = column("<f4", postings)
+        self.sizes = column("<i4", count)
+
+        names = mapped[offset : offset + names_length].decode("utf-8")
+        self.owners = []
+        self.template_ids = []
+        self.serial_of = {}
+        self.owner_serials = {}
+        for serial, name in enumerate(names.split("\n") if count else ()):
+            owner, template_id = name.split("\t")
+            self.owners.append(owner)
+            self.template_ids.append(template_id)
+            self.serial_of[template_id] = serial
+            self.owner_serials.setdefault(owner, []).append(serial)
+
+    def __len__(self):
+        return len(self.template_ids)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map a snapshot file.
+
+        Returns:
+            IndexSnapshot or None: None if the file is missing or is not a
+            version INDEX_VERSION snapshot
+        """
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if len(mapped) < INDEX_HEADER_SIZE:
+            return None
+        header = INDEX_HEADER.unpack_from(mapped)
+        if header[0] != INDEX_MAGIC or header[1] != INDEX_VERSION:
+            return None
+        return cls(mapped, header)
+
+    @staticmethod
+    def write(path, index, templates, inode, position):
+        """
+        Index templates and write them as a snapshot, replacing the file
+        atomically.
+
+        Args:
+            path (str): Snapshot file
+            index (MinutiaeIndex): Index whose key parameters are used
+            templates (iterable): (owner, template_id, records) tuples
+            inode (int): Inode of the template store file
+            position (int): Store offset the templates were read up to
+        """
+        names = []
+        sizes = []
+        columns = [[], [], [], [], []]
+
+        for owner, template_id, records in templates:
+            postings = index._postings(records)
+            if postings is None:
+                continue
+            keys, cx, cy, directions = postings
+            columns[0].append(keys)
+            columns[1].append(np.full(len(keys), len(names), np.int32))
+            columns[2].append(cx)
+            columns[3].append(cy)
+            columns[4].append(directions)
+            names.append(f"{owner}\t{template_id}")
+            sizes.append(len(keys))
+
+        dtypes = ("<i8", "<i4", "<f4", "<f4", "<f4")
+        columns = [
+            np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype)
+            for parts, dtype in zip(columns, dtypes)
+        ]
+        order = np.argsort(columns[0], kind="stable")
+        encoded = "\n".join(names).encode("utf-8")
+
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            header = INDEX_HEADER.pack(
+                INDEX_MAGIC,
+                INDEX_VERSION,
+                inode,
+                position,
+                len(names),
+                len(order),
+                len(encoded),
+                index.side_bin,
+                index.angle_bin,
+            )
+            f.write(header.ljust(INDEX_HEADER_SIZE, b"\0"))
+            for column in columns:
+                f.write(column[order].tobytes())
+            f.write(np.asarray(sizes, "<i4").tobytes())
+            f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def lookup(self, candidate_keys):
+        """
+        Postings of the keys of each probe triangle.
+
+        Args:
+            candidate_keys (numpy.ndarray): (n, m) keys of n probe triangles
+
+        Returns:
+            tuple: Arrays of the probe triangle, template serial, centre x,
+            centre y and direction of every posting found
+        """
+        keys = np.sort(candidate_keys, axis=1)
+        distinct = np.ones(keys.shape, bool)
+        distinct[:, 1:] = keys[:, 1:] != keys[:, :-1]
+        rows = np.nonzero(distinct)[0]
+        keys = keys[distinct]
+
+        first = np.searchsorted(self.keys, keys, "left")
+        counts = np.searchsorted(self.keys, keys, "right") - first
+        total = int(counts.sum())
+        starts = np.cumsum(counts) - counts
+        positions = np.repeat(first - starts, counts) + np.arange(total)
+
+        return (
+            np.repeat(rows, counts),
+            self.serials[positions],
+            self.cx[positions],
+            self.cy[positions],
+            self.directions[positions],
+        )
+
+
+class MinutiaeIndex:
+    """
+    Geometric hashing index over minutia triplets for 1:N identification.
+
+    Every enrolled template contributes its triangles under a key made of
+    the quantised side lengths, vertex types and vertex orientations. A
+    probe looks up its own triangles and each hit votes for the rotation
+    and translation that would align the template with the probe; the
+    genuine template collects its votes in a single pose, while chance
+    hits from other fingers scatter. A lookup therefore only touches the
+    postings of the probe's keys rather than every enrolled template.
+
+    Templates may come from a shared IndexSnapshot; those inserted later
+    are held in memory, and snapshot templates that are replaced or
+    removed are masked out.
+    """
+
+    def __init__(
+        self,
+        side_bin=6.0,
+        angle_bin=30.0,
+        rotation_bin=15.0,
+        translation_bin=24.0,
+        min_votes=3,
+        min_score=0.02,
+        snapshot=None,
+    ):
+        self.side_bin = side_bin
+        self.angle_bin = angle_bin
+        self.rotation_bin = rotation_bin
+        self.translation_bin = translation_bin
+        self.min_votes = min_votes
+        self.min_score = min_score
+        self.table = {}
+        self.templates = {}
+        self.owners = {}
+        self.serials = {}
+        self.lock = threading.RLock()
+
+        if snapshot is not None and (snapshot.side_bin, snapshot.angle_bin) != (
+            side_bin,
+            angle_bin,
+        ):
+            raise ValueError("Index snapshot was built with other key parameters")
+        self.snapshot = snapshot
+        self.hidden = np.zeros(len(snapshot) if snapshot else 0, bool)
+        self.next_serial = len(self.hidden)
+
+    @staticmethod
+    def _bins(values, size, tolerant):
+        """Nearest bin of each value, plus the neighbouring one if tolerant"""
+        scaled = values / size
+        if not tolerant:
+            return [np.floor(scaled).astype(np.int64)]
+        below = np.floor(scaled - 0.5).astype(np.int64)
+        return [below, below + 1]
+
+    def _keys(self, triangles, tolerant=False):
+        """
+        Hash keys of each triangle.
+
+        Returns:
+            numpy.ndarray: (n, m) keys, m is 1, or 64 when tolerant so that
+            values close to a bin edge also find the neighbouring bin
+        """
+        angle_bins = int(round(180.0 / self.angle_bin))
+        types = triangles["types"]
+        base = ((types[:, 0] * 4 + types[:, 1]) * 4 + types[:, 2]).astype(np.int64)
+
+        side_choices = self._bins(triangles["sides"], self.side_bin, tolerant)
+        angle_choices = [
+            b % angle_bins
+            for b in self._bins(triangles["angles"], self.angle_bin, tolerant)
+        ]
+
+        keys = []
+        for sides in itertools.product(range(len(side_choices)), repeat=3):
+            side_key = base
+            for i, choice in enumerate(sides):
+                side_key = (side_key << 12) | side_choices[choice][:, i]
+            for angles in itertools.product(range(len(angle_choices)), repeat=3):
+                key = side_key
+                for i, choice in enumerate(angles):
+                    key = (key << 3) | angle_choices[choice][:, i]
+                keys.append(key)
+        return np.stack(keys, axis=1)
+
+    def _postings(self, points):
+        """
+        Keys and poses of the triangles of a template.
+
+        Returns:
+            tuple or None: (keys, centre x, centre y, direction) arrays, None
+            if the template has no usable triangle
+        """
+        triangles = minutiae_triangles(points)
+        if triangles is None or not len(triangles["sides"]):
+            return None
+        return (
+            self._keys(triangles)[:, 0],
+            triangles["centres"][:, 0],
+            triangles["centres"][:, 1],
+            triangles["directions"],
+        )
+
+    def insert(self, owner, template_id, points):
+        """
+        Add one template to the index, replacing any previous version.
+
+        Args:
+            owner (str): ID of the user the template belongs to
+            template_id (str): Unique ID of the template
+            points: Minutiae records or (x, y, type, orientation) tuples of the template
+        """
+        postings = self._postings(points)
+        if postings is None:
+            return
+
+        keys = postings[0].tolist()
+        poses = zip(*(column.tolist() for column in postings[1:]))
+
+        with self.lock:
+            self.remove_template(template_id)
+
+            serial = self.next_serial
+            self.next_serial += 1
+
+            for key, (cx, cy, direction) in zip(keys, poses):
+                self.table.setdefault(key, []).append((serial, cx, cy, direction))
+
+            self.templates[template_id] = (owner, serial, set(keys), len(keys))
+            self.serials[serial] = template_id
+            self.owners.setdefault(owner, set()).add(template_id)
+
+    def remove_template(self, template_id):
+        with self.lock:
+            if self.snapshot is not None:
+                serial = self.snapshot.serial_of.get(template_id)
+                if serial is not None:
+                    self.hidden[serial] = True
+
+            entry = self.templates.pop(template_id, None)
+            if entry is None:
+                return
+
+            owner, serial, keys, _ = entry
+            for key in keys:
+                postings = [p for p in self.table.get(key, ()) if p[0] != serial]
+                if postings:
+                    self.table[key] = postings
+                else:
+                    self.table.pop(key, None)
+
+            del self.serials[serial]
+            owned = self.owners.get(owner)
+            if owned is not None:
+                owned.discard(template_id)
+                if not owned:
+                    del self.owners[owner]
+
+    def remove_owner(self, owner):
+        """Remove every template of a user, e.g. when the user is deleted"""
+        with self.lock:
+            if self.snapshot is not None:
+                self.hidden[self.snapshot.owner_serials.get(owner, [])] = True
+            for template_id in list(self.owners.get(owner, ())):
+                self.remove_template(template_id)
+
+    def _template(self, serial):
+        """(owner, template_id, triangle count) of a template serial"""
+        if serial < len(self.hidden):
+            return (
+                self.snapshot.owners[serial],
+                self.snapshot.template_ids[serial],
+                int(self.snapshot.sizes[serial]),
+            )
+        template_id = self.serials[serial]
+        owner, _, _, size = self.templates[template_id]
+        return owner, template_id, size
+
+    def candidates(self, points, limit=None):
+        """
+        Rank the enrolled users whose templates may match a probe.
+
+        The vote share is only a coarse filter: impostor fingers can reach
+        the scores of genuine ones, so candidates must still be verified
+        before they are trusted.
+
+        Args:
+            points: Minutiae records or (x, y, type, orientation) tuples of the probe
+            limit (int): Largest number of candidates returned, all by default
+
+        Returns:
+            list: (owner, template_id, score) of the best template of each
+            user reaching min_votes and min_score, best score first. The
+            score is the share of triangles agreeing on one alignment.
+        """
+        triangles = minutiae_triangles(points)
+        if triangles is None or not len(triangles["sides"]):
+            return []
+
+        candidate_keys = self._keys(triangles, tolerant=True)
+        hits = []
+        probe_ids = []
+
+        with self.lock:
+            for i, keys in enumerate(candidate_keys.tolist()):
+                matched = set()
+                for key in set(keys):
+                    matched.update(self.table.get(key, ()))
+                hits.extend(matched)
+                probe_ids.extend([i] * len(matched))
+
+            hits = np.fromiter(
+                itertools.chain.from_iterable(hits), np.float64, len(hits) * 4
+            ).reshape(-1, 4)
+            columns = [np.array(probe_ids, np.int64)] + list(hits.T)
+
+            if self.snapshot is not None:
+                shared = self.snapshot.lookup(candidate_keys)
+                live = ~self.hidden[shared[1]]
+                columns = [
+                    np.concatenate([column, found[live]])
+                    for column, found in zip(columns, shared)
+                ]
+
+            probe_ids, serials, cx, cy, directions = columns
+            if not len(serials):
+                return []
+
+            # Rotation and translation mapping each template triangle onto
+            # the probe triangle it matched
+            rotation = (
+                triangles["directions"][probe_ids] - directions + 180.0
+            ) % 360.0 - 180.0
+            radians = np.radians(rotation)
+            cos, sin = np.cos(radians), np.sin(radians)
+            centres = triangles["centres"][probe_ids]
+            tx = centres[:, 0] - (cos * cx - sin * cy)
+            ty = centres[:, 1] - (sin * cx + cos * cy)
+
+            # One pose cell per (template, rotation, x shift, y shift), packed
+            # into an integer with the template serial in the high bits
+            pose = (
+                (np.floor(rotation / self.rotation_bin).astype(np.int64) + 32) << 32
+                | (np.floor(tx / self.translation_bin).astype(np.int64) + 32768) << 16
+                | (np.floor(ty / self.translation_bin).astype(np.int64) + 32768)
+            )
+            cells = serials.astype(np.int64) << 40 | pose
+            cells, counts = np.unique(cells, return_counts=True)
+
+            # Best aligned vote count of every template
+            owners = cells >> 40
+            order = np.lexsort((-counts, owners))
+            serials, first = np.unique(owners[order], return_index=True)
+            votes = counts[order][first]
+
+            best = {}
+            for serial, count in zip(serials.tolist(), votes.tolist()):
+                owner, template_id, size = self._template(serial)
+                score = min(1.0, count / min(len(candidate_keys), size))
+                if count >= self.min_votes and score >= self.min_score:
+                    if owner not in best or score > best[owner][2]:
+                        best[owner] = (owner, template_id, score)
+
+        ranked = sorted(best.values(), key=lambda candidate: -candidate[2])
+        return ranked if limit is None else ranked[:limit]
+
+    def identify(self, points):
+        """
+        Find the enrolled user whose template best matches a probe.
+
+        Returns:
+            tuple or None: (owner, template_id, score) of the best candidate
+        """
+        ranked = self.candidates(points, limit=1)
+        return ranked[0] if ranked else None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "templates": len(self.templates) + int((~self.hidden).sum()),
+                "keys": len(self.table),
+                "postings": sum(len(postings) for postings in self.table.values()),
+                "shared_postings": (
+                    0 if self.snapshot is None else len(self.snapshot.keys)
+                ),
+            }
+
+
+# Process-wide index, built from the shared template store on first use
+minutiae_index = None
+index_lock = threading.Lock()
+index_generation = None
+index_position = 0
+
+
+def template_id_for(owner, template_hash):
+    return f"{owner}:{template_hash}"
+
+
+def index_snapshot_path(store):
+    return store.path + ".index"
+
+
+def index_delta_limit():
+    """Templates indexed in memory before the shared snapshot is rebuilt"""
+    return int(os.environ.get("FINGERPRINT_INDEX_DELTA_MAX", 1000))
+
+
+def open_index_snapshot(store, position=0):
+    """
+    Map the shared index snapshot of the template store.
+
+    The snapshot is rebuilt from the store, by whichever process gets the
+    store lock first, if it is missing, belongs to an earlier (compacted)
+    store file or was built before position.
+
+    Returns:
+        tuple: (IndexSnapshot, store generation it matches)
+    """
+    path = index_snapshot_path(store)
+    params = (MinutiaeIndex().side_bin, MinutiaeIndex().angle_bin)
+
+    with store.file_lock():
+        store.refresh()
+        snapshot = IndexSnapshot.load(path)
+        if (
+            snapshot is None
+            or snapshot.inode != store.inode
+            or snapshot.position < position
+            or (snapshot.side_bin, snapshot.angle_bin) != params
+        ):
+            templates = (
+                (owner, template_id_for(owner, template_hash), records)
+                for owner, template_hash, records in store.items()
+            )
+            IndexSnapshot.write(
+                path, MinutiaeIndex(), templates, store.inode, store.size
+            )
+            snapshot = IndexSnapshot.load(path)
+        return snapshot, store.generation
+
+
+def get_minutiae_index():
+    """
+    Get the identification index of this process.
+
+    The index is built from the template store, which is created from
+    db.users the first time any process needs it. Templates up to the
+    shared snapshot are looked up in the mapped snapshot file; entries
+    appended after it are indexed in memory on every call, until there
+    are FINGERPRINT_INDEX_DELTA_MAX of them and the snapshot is rebuilt.
+    A compacted store gets a new snapshot.
+    """
+    global minutiae_index, index_generation, index_position
+
+    with index_lock:
+        store = ensure_template_store()
+
+        while True:
+            store.refresh()
+            if minutiae_index is None or index_generation != store.generation:
+                position = 0
+            elif len(minutiae_index.templates) > index_delta_limit():
+                position = index_position
+            else:
+                position = None
+
+            if position is not None:
+                # Takes the store file lock, so it must not run under store.lock
+                try:
+                    snapshot, generation = open_index_snapshot(store, position)
+                    minutiae_index = MinutiaeIndex(snapshot=snapshot)
+                    index_position = snapshot.position
+                except OSError:
+                    # E.g. a read-only data directory: index in memory only
+                    minutiae_index = MinutiaeIndex()
+                    generation = store.generation
+                    index_position = 0
+                index_generation = generation
+
+            with store.lock:
+                if index_generation != store.generation:
+                    # Compacted while the snapshot was opened
+                    continue
+
+                for kind, owner, template_hash, offset, length, _ in store.entries(
+                    index_position
+                ):
+                    if kind == ENTRY_TEMPLATE:
+                        minutiae_index.insert(
+                            owner,
+                            template_id_for(owner, template_hash),
+                            store.read(offset, length),
+                        )
+                    elif kind == ENTRY_REMOVE_OWNER:
+                        minutiae_index.remove_owner(owner)
+                index_position = store.size
+
+                if (
+                    minutiae_index.snapshot is None
+                    or len(minutiae_index.templates) <= index_delta_limit()
+                ):
+                    return minutiae_index
@@ -0,0 +1,202 @@
+import os
+import math
+import time
+import uuid
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import get_db
+from utils.fingerprint_pool import FingerprintTimeoutError
+from utils.fingerprint_cache import get_fingerprint_features_batch
+from utils.fingerprint_utils import FingerprintQualityError
+from utils.fingerprint_enroll import build_template, enroll_fingerprint_templates
+from utils.log_utils import save_log
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_FINISHED = (JOB_DONE, JOB_FAILED)
+
+# Threads that wait on the fingerprint pool and store job results, so the
+# request that submitted a job can return at once
+job_runner = None
+job_runner_lock = threading.Lock()
+
+# One slot per job queued or running in this process; the runner's own
+# queue is unbounded, so submissions are refused once the slots run out
+job_slots = None
+
+# Jobs run by this process, set when they finish to wake long-polls
+job_events = {}
+job_events_lock = threading.Lock()
+
+
+class FingerprintQueueFullError(RuntimeError):
+    """Raised when a job is submitted while FINGERPRINT_JOB_MAX_PENDING are queued"""
+
+
+def get_job_runner():
+    global job_runner, job_slots
+
+    with job_runner_lock:
+        if job_runner is None:
+            job_runner = ThreadPoolExecutor(
+                max_workers=int(os.environ.get("FINGERPRINT_JOB_THREADS", 4)),
+                thread_name_prefix="fingerprint-job",
+            )
+            job_slots = threading.BoundedSemaphore(
+                int(os.environ.get("FINGERPRINT_JOB_MAX_PENDING", 64))
+            )
+        return job_runner
+
+
+def submit_enrollment_job(user_id, fingerprint_binary):
+    """
+    Queue the enrolment of a capture and return without waiting for it.
+
+    Args:
+        user_id (str): ID of the user enrolling the capture
+        fingerprint_binary (bytes): Binary data of the fingerprint image
+
+    Returns:
+        dict: The new job document
+
+    Raises:
+        FingerprintQueueFullError: If too many jobs are already pending
+    """
+    runner = get_job_runner()
+    if not job_slots.acquire(blocking=False):
+        raise FingerprintQueueFullError("Too many fingerprint jobs are pending")
+
+    now = datetime.datetime.utcnow()
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "type": "enroll",
+        "status": JOB_PENDING,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    try:
+        get_db().fingerprint_jobs.insert_one(job)
+
+        with job_events_lock:
+            job_events[job["job_id"]] = threading.Event()
+
+        runner.submit(_run_enrollment_job, job["job_id"], user_id, fingerprint_binary)
+    except BaseException:
+        with job_events_lock:
+            job_events.pop(job["job_id"], None)
+        job_slots.release()
+        raise
+    return job
+
+
+def _update_job(job_id, **fields):
+    fields["updated_at"] = datetime.datetime.utcnow()
+    get_db().fingerprint_jobs.update_one({"job_id": job_id}, {"$set": fields})
+
+
+def _run_enrollment_job(job_id, user_id, fingerprint_binary):
+    """Process a capture on the fingerprint pool and store the job result"""
+    try:
+        _update_job(job_id, status=JOB_RUNNING)
+
+        [(features, timings, cached)] = get_fingerprint_features_batch(
+            [fingerprint_binary]
+        )
+        result = {
+            "cached": cached,
+            "timings_ms": {stage: seconds * 1000.0 for stage, seconds, _ in timings},
+        }
+
+        if isinstance(features, FingerprintQualityError):
+            _update_job(
+                job_id,
+                status=JOB_FAILED,
+                error=str(features),
+                result=dict(result, quality=features.scores),
+            )
+        elif isinstance(features, FingerprintTimeoutError):
+            _update_job(
+                job_id, status=JOB_FAILED, error="Fingerprint processing timed out"
+            )
+        elif isinstance(features, Exception):
+            _update_job(job_id, status=JOB_FAILED, error="Invalid fingerprint format")
+        else:
+            enroll_fingerprint_templates(user_id, [build_template(features)])
+            _update_job(
+                job_id,
+                status=JOB_DONE,
+                result=dict(
+                    result,
+                    fingerprint_hash=features["hash"],
+                    quality=features["quality"],
+                ),
+            )
+
+        save_log(
+            log_type="auth",
+            message=f"Fingerprint enrollment job {job_id} finished",
+            user_id=user_id,
+            source="fingerprint_jobs.run_enrollment_job",
+            status="info",
+        )
+
+    except Exception as e:
+        _update_job(job_id, status=JOB_FAILED, error="Fingerprint job failed")
+        save_log(
+            log_type="error",
+            message=f"Fingerprint enrollment job {job_id} failed: {str(e)}",
+            user_id=user_id,
+            source="fingerprint_jobs.run_enrollment_job",
+            status="error",
+        )
+
+    finally:
+        job_slots.release()
+        with job_events_lock:
+            event = job_events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+
+def get_job(job_id, user_id, wait=0.0, interval=0.25):
+    """
+    Get a job of a user, optionally waiting for it to finish.
+
+    Jobs run by this process wake the caller as soon as they finish; jobs
+    submitted through another API process are polled in MongoDB.
+
+    Args:
+        job_id (str): ID returned when the job was submitted
+        user_id (str): Only jobs of this user are returned
+        wait (float): Seconds to wait for an unfinished job, 0 (or a
+            value that is not finite) to return its current state at once
+        interval (float): Seconds between MongoDB polls
+
+    Returns:
+        dict or None: The job document, None if there is no such job
+    """
+    db = get_db()
+    query = {"job_id": job_id, "user_id": user_id}
+    if not math.isfinite(wait):
+        wait = 0.0
+    deadline = time.monotonic() + wait
+
+    while True:
+        job = db.fingerprint_jobs.find_one(query, {"_id": 0})
+        remaining = deadline - time.monotonic()
+        if job is None or job["status"] in JOB_FINISHED or remaining <= 0:
+            return job
+
+        with job_events_lock:
+            event = job_events.get(job_id)
+
+        if event is not None:
+            event.wait(remaining)
+        else:
+            time.sleep(min(interval, remaining))
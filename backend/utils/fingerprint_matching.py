@@ -0,0 +1,242 @@
+import os
+import numpy as np
+from utils.fingerprint_template import template_minutiae, minutiae_points
+from utils.fingerprint_store import get_template_store
+from utils.fingerprint_index import get_minutiae_index
+
+
+def _pad_templates(templates):
+    """
+    Stack templates of different sizes into one array.
+
+    Returns:
+        tuple: (t, m, 4) float array of minutiae and (t, m) mask of the
+        real entries
+    """
+    size = max(len(template) for template in templates)
+    stacked = np.zeros((len(templates), size, 4))
+    mask = np.zeros((len(templates), size), dtype=bool)
+
+    for i, template in enumerate(templates):
+        if len(template):
+            stacked[i, : len(template)] = minutiae_points(template)
+            mask[i, : len(template)] = True
+
+    return stacked, mask
+
+
+def _angle_difference(a, b):
+    """Difference of two ridge orientations in degrees, wrapped to -90..90"""
+    return (a - b + 90.0) % 180.0 - 90.0
+
+
+def _pair_score(probe, template, rotation, tx, ty, distance, angle):
+    """
+    Score one alignment of a template onto a probe.
+
+    Minutiae are paired when they are each other's nearest compatible
+    neighbour after alignment, which keeps the pairing one-to-one.
+
+    Returns:
+        float: matched pairs squared over the product of both set sizes
+    """
+    radians = np.radians(rotation)
+    cos, sin = np.cos(radians), np.sin(radians)
+    x = cos * template[:, 0] - sin * template[:, 1] + tx
+    y = sin * template[:, 0] + cos * template[:, 1] + ty
+
+    squared = (probe[:, 0, None] - x[None, :]) ** 2 + (
+        probe[:, 1, None] - y[None, :]
+    ) ** 2
+    turned = _angle_difference(probe[:, 3, None], template[None, :, 3] + rotation)
+    compatible = (
+        (squared <= distance**2)
+        & (np.abs(turned) <= angle)
+        & (probe[:, 2, None] == template[None, :, 2])
+    )
+    if not compatible.any():
+        return 0.0
+
+    squared = np.where(compatible, squared, np.inf)
+    nearest_template = squared.argmin(axis=1)
+    nearest_probe = squared.argmin(axis=0)
+
+    mutual = nearest_probe[nearest_template] == np.arange(len(probe))
+    pairs = int((mutual & compatible.any(axis=1)).sum())
+
+    return pairs * pairs / (len(probe) * len(template))
+
+
+def verify_minutiae(
+    probe,
+    templates,
+    threshold=0.12,
+    distance=12.0,
+    angle=20.0,
+    max_rotation=60.0,
+    rotation_bin=10.0,
+    translation_bin=16.0,
+    candidates=3,
+):
+    """
+    Verify a probe against every enrolled template of one user.
+
+    Every probe minutia is paired with every template minutia of the same
+    type, for all templates at once, and each pair votes for the rotation
+    (from the orientation difference) and translation that would align
+    them. The most voted poses are then scored from the strongest down,
+    stopping as soon as one reaches the threshold.
+
+    Args:
+        probe: Minutiae records or tuples of the capture
+        templates (list): Minutiae of the user's enrolled templates
+        threshold (float): Score accepted as a match
+        distance (float): Pairing distance after alignment, in pixels
+        angle (float): Pairing orientation tolerance, in degrees
+        max_rotation (float): Largest rotation between captures, in degrees
+        rotation_bin (float): Rotation resolution of the pose vote, in degrees
+        translation_bin (float): Translation resolution of the pose vote
+        candidates (int): Poses scored per template
+
+    Returns:
+        dict: "matched", the best "score" and the "template" index it was
+        reached on (None if no template could be aligned)
+    """
+    result = {"matched": False, "score": 0.0, "template": None}
+
+    templates = list(templates)
+    if len(probe) < 3 or not any(len(template) >= 3 for template in templates):
+        return result
+
+    points = minutiae_points(probe)
+    stacked, mask = _pad_templates(templates)
+
+    # (t, n, m) pose of every probe/template minutia pair
+    rotation = _angle_difference(points[None, :, 3, None], stacked[:, None, :, 3])
+    radians = np.radians(rotation)
+    cos, sin = np.cos(radians), np.sin(radians)
+    tx = points[None, :, 0, None] - (
+        cos * stacked[:, None, :, 0] - sin * stacked[:, None, :, 1]
+    )
+    ty = points[None, :, 1, None] - (
+        sin * stacked[:, None, :, 0] + cos * stacked[:, None, :, 1]
+    )
+
+    valid = (
+        mask[:, None, :]
+        & (points[None, :, 2, None] == stacked[:, None, :, 2])
+        & (np.abs(rotation) <= max_rotation)
+    )
+    owner = np.broadcast_to(np.arange(len(templates))[:, None, None], valid.shape)
+
+    owner, rotation, tx, ty = (
+        owner[valid],
+        rotation[valid],
+        tx[valid],
+        ty[valid],
+    )
+    if not len(owner):
+        return result
+
+    # Pack (template, rotation, x shift, y shift) cells into one integer
+    cells = (
+        owner.astype(np.int64) << 40
+        | (np.floor(rotation / rotation_bin).astype(np.int64) + 32) << 32
+        | (np.floor(tx / translation_bin).astype(np.int64) + 32768) << 16
+        | (np.floor(ty / translation_bin).astype(np.int64) + 32768)
+    )
+    cells, inverse, counts = np.unique(cells, return_inverse=True, return_counts=True)
+
+    # Strongest poses first, at most `candidates` per template
+    order = np.argsort(-counts, kind="stable")
+    tried = {}
+
+    for cell in order.tolist():
+        index = int(cells[cell] >> 40)
+        if tried.get(index, 0) >= candidates:
+            continue
+        tried[index] = tried.get(index, 0) + 1
+
+        # Refine the pose with the mean of the pairs that voted for it
+        voters = inverse == cell
+        template = stacked[index][mask[index]]
+        score = _pair_score(
+            points,
+            template,
+            rotation[voters].mean(),
+            tx[voters].mean(),
+            ty[voters].mean(),
+            distance,
+            angle,
+        )
+
+        if score > result["score"]:
+            result["score"] = score
+            result["template"] = index
+            if score >= threshold:
+                result["matched"] = True
+                break
+
+        if len(tried) == len(templates) and all(
+            count >= candidates for count in tried.values()
+        ):
+            break
+
+    return result
+
+
+def verify_threshold():
+    return float(os.environ.get("FINGERPRINT_VERIFY_THRESHOLD", 0.12))
+
+
+def verify_fingerprint(minutiae, user):
+    """
+    Verify probe minutiae against the enrolled templates of a user.
+
+    Templates are read from the shared template store, falling back to
+    the user document for templates the store does not hold yet.
+
+    Returns:
+        dict: As returned by verify_minutiae
+    """
+    store = get_template_store()
+    store.refresh()
+
+    templates = [records for _, records in store.templates(str(user["_id"]))]
+    if not templates:
+        templates = [
+            template_minutiae(template)
+            for template in user.get("fingerprint_templates", [])
+        ]
+    return verify_minutiae(minutiae, templates, threshold=verify_threshold())
+
+
+def identify_candidates():
+    return int(os.environ.get("FINGERPRINT_IDENTIFY_CANDIDATES", 5))
+
+
+def identify_fingerprint(minutiae):
+    """
+    Identify a user from probe minutiae.
+
+    The index only shortlists users: vote shares of unenrolled fingers
+    overlap those of genuine ones, so each of the best candidates is
+    verified against all of its templates, and the first to pass
+    verify_minutiae is the match.
+
+    Returns:
+        tuple or None: (user ObjectId string, verification score) of the
+        matched user
+    """
+    candidates = get_minutiae_index().candidates(minutiae, identify_candidates())
+    if not candidates:
+        return None
+
+    store = get_template_store()
+    threshold = verify_threshold()
+    for owner, _, _ in candidates:
+        templates = [records for _, records in store.templates(owner)]
+        verification = verify_minutiae(minutiae, templates, threshold=threshold)
+        if verification["matched"]:
+            return owner, verification["score"]
+    return None
@@ -0,0 +1,153 @@
+import os
+import bisect
+import threading
+from utils.fingerprint_utils import extract_fingerprint
+
+# Upper bounds (milliseconds) of the stage duration histogram buckets
+DURATION_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class StageHistogram:
+    """Duration histogram plus image size and minutiae totals for one stage"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(DURATION_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+        self.sized = 0
+        self.total_width = 0
+        self.total_height = 0
+        self.max_pixels = 0
+        self.counted = 0
+        self.total_minutiae = 0
+        self.max_minutiae = 0
+
+    def observe(self, seconds, info):
+        elapsed_ms = seconds * 1000.0
+
+        self.buckets[bisect.bisect_left(DURATION_BUCKETS_MS, elapsed_ms)] += 1
+
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.min_ms = (
+            elapsed_ms if self.min_ms is None else min(self.min_ms, elapsed_ms)
+        )
+        self.max_ms = (
+            elapsed_ms if self.max_ms is None else max(self.max_ms, elapsed_ms)
+        )
+
+        if "width" in info and "height" in info:
+            self.sized += 1
+            self.total_width += info["width"]
+            self.total_height += info["height"]
+            self.max_pixels = max(self.max_pixels, info["width"] * info["height"])
+
+        if "minutiae" in info:
+            self.counted += 1
+            self.total_minutiae += info["minutiae"]
+            self.max_minutiae = max(self.max_minutiae, info["minutiae"])
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        if not self.count:
+            return None
+
+        target = fraction * self.count
+        seen = 0
+        for bound, bucket in zip(DURATION_BUCKETS_MS, self.buckets):
+            seen += bucket
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def snapshot(self):
+        stats = {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "min_ms": self.min_ms,
+            "max_ms": self.max_ms,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": [
+                {"le": bound, "count": bucket}
+                for bound, bucket in zip(DURATION_BUCKETS_MS + ("inf",), self.buckets)
+            ],
+        }
+
+        if self.sized:
+            stats["mean_width"] = self.total_width / self.sized
+            stats["mean_height"] = self.total_height / self.sized
+            stats["max_pixels"] = self.max_pixels
+
+        if self.counted:
+            stats["mean_minutiae"] = self.total_minutiae / self.counted
+            stats["max_minutiae"] = self.max_minutiae
+
+        return stats
+
+
+# In-process registry of stage histograms, keyed by stage name
+stage_histograms = {}
+stage_lock = threading.Lock()
+
+
+def metrics_enabled():
+    return os.environ.get("FINGERPRINT_METRICS_ENABLED", "true").lower() == "true"
+
+
+def record_stage(stage, seconds, info=None):
+    """
+    Record one stage measurement in the registry.
+
+    Args:
+        stage (str): Stage name, e.g. "thinning"
+        seconds (float): Wall time spent in the stage
+        info (dict): Optional width, height and minutiae values
+    """
+    with stage_lock:
+        histogram = stage_histograms.get(stage)
+        if histogram is None:
+            histogram = stage_histograms[stage] = StageHistogram()
+        histogram.observe(seconds, info or {})
+
+
+def record_stage_timings(timings):
+    """Record a list of (stage, seconds, info) tuples and their total"""
+    for stage, seconds, info in timings:
+        record_stage(stage, seconds, info)
+
+    if timings:
+        record_stage("total", sum(seconds for _, seconds, _ in timings))
+
+
+def get_stage_stats():
+    with stage_lock:
+        return {
+            stage: histogram.snapshot() for stage, histogram in stage_histograms.items()
+        }
+
+
+def reset_stage_stats():
+    with stage_lock:
+        stage_histograms.clear()
+
+
+def extract_fingerprint_timed(fingerprint_binary):
+    """
+    Process a fingerprint and return its stage timings alongside the result.
+
+    This runs inside pool workers, so timings are returned to the parent
+    process rather than recorded here.
+
+    Returns:
+        tuple: (extract_fingerprint result, list of (stage, seconds, info))
+    """
+    timings = []
+    features = extract_fingerprint(
+        fingerprint_binary,
+        stage_hook=lambda stage, seconds, info: timings.append((stage, seconds, info)),
+    )
+    return features, timings
@@ -0,0 +1,315 @@
+import os
+import time
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from utils.fingerprint_utils import extract_fingerprint
+from utils.fingerprint_engines import get_selected_engines, use_engines
+from utils.fingerprint_metrics import (
+    metrics_enabled,
+    extract_fingerprint_timed,
+    record_stage_timings,
+)
+
+# Process pool used to run fingerprint processing off the request thread
+executor = None
+executor_lock = threading.Lock()
+
+
+class FingerprintTimeoutError(Exception):
+    """Raised when a fingerprint job does not finish within its timeout"""
+
+
+def get_pool_workers():
+    """Number of worker processes, 0 runs fingerprint jobs inline"""
+    workers = os.environ.get("FINGERPRINT_POOL_WORKERS")
+    if workers is None:
+        return os.cpu_count() or 1
+    return max(0, int(workers))
+
+
+def get_job_timeout():
+    """Seconds a request waits for a fingerprint job before giving up"""
+    return float(os.environ.get("FINGERPRINT_JOB_TIMEOUT", 30))
+
+
+def init_fingerprint_pool():
+    """
+    Create the fingerprint process pool if it does not exist yet.
+
+    Workers are started with the "spawn" method by default so they do not
+    inherit the parent's MongoDB client or Flask threads; set
+    FINGERPRINT_POOL_START_METHOD to override it. Stage engines are
+    selected once here and handed to the workers, so they do not each
+    repeat the startup benchmark.
+
+    Returns:
+        ProcessPoolExecutor or None: The pool, or None when running inline
+    """
+    global executor
+
+    with executor_lock:
+        if executor is None and get_pool_workers() > 0:
+            context = multiprocessing.get_context(
+                os.environ.get("FINGERPRINT_POOL_START_METHOD", "spawn")
+            )
+            executor = ProcessPoolExecutor(
+                max_workers=get_pool_workers(),
+                mp_context=context,
+                initializer=use_engines,
+                initargs=(get_selected_engines(),),
+            )
+        return executor
+
+
+def get_fingerprint_pool():
+    if executor is None:
+        return init_fingerprint_pool()
+    return executor
+
+
+def shutdown_fingerprint_pool(wait=True):
+    """Stop accepting jobs and wait for running ones to finish"""
+    global executor
+
+    with executor_lock:
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            executor = None
+
+
+def discard_broken_pool(broken):
+    """
+    Drop a pool whose worker died, so the next job starts a fresh one.
+
+    Several requests can notice the same broken pool; only the first
+    shuts it down, and a pool another request already started in its
+    place is left alone.
+    """
+    global executor
+
+    with executor_lock:
+        if executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            executor = None
+
+
+def _terminate_workers(pool):
+    """Stop a retired pool, killing workers still stuck on a job"""
+    # ProcessPoolExecutor has no public way to stop a running job, and
+    # forgets its processes on shutdown
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def retire_timed_out_pool(pool, future):
+    """
+    Replace a pool after one of its jobs timed out.
+
+    A job that is still queued is just cancelled. A running one cannot be,
+    and would keep its worker busy for as long as it runs, so a few slow
+    or hostile images could take the whole pool. The pool is then swapped
+    for a fresh one right away, and its workers are terminated once the
+    other jobs running on it had FINGERPRINT_JOB_TIMEOUT to finish.
+    """
+    global executor
+
+    if future.cancel():
+        return
+
+    with executor_lock:
+        if executor is not pool:
+            return
+        executor = None
+
+    timer = threading.Timer(get_job_timeout(), _terminate_workers, (pool,))
+    timer.daemon = True
+    timer.start()
+
+
+def _submit(fn, *args):
+    """
+    Submit a function to the fingerprint pool.
+
+    Returns:
+        tuple: (pool, future) the job was submitted to, both None when
+        the pool is disabled
+    """
+    pool = get_fingerprint_pool()
+    if pool is None:
+        return None, None
+
+    try:
+        return pool, pool.submit(fn, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM killed); start a fresh pool and retry once
+        discard_broken_pool(pool)
+        pool = get_fingerprint_pool()
+        return pool, pool.submit(fn, *args)
+
+
+def submit_fingerprint_job(fn, *args):
+    """
+    Submit a picklable function to the fingerprint pool.
+
+    Returns:
+        concurrent.futures.Future or None: None when the pool is disabled
+    """
+    return _submit(fn, *args)[1]
+
+
+def run_fingerprint_job(fn, *args, timeout=None):
+    """
+    Run a function on the fingerprint pool and wait for its result.
+
+    The calling thread blocks without holding the GIL, so other requests
+    served by the same worker keep running while the job is processed.
+
+    Args:
+        fn (callable): Module-level function to run in a worker process
+        *args: Arguments passed to fn
+        timeout (float): Seconds to wait, defaults to FINGERPRINT_JOB_TIMEOUT
+
+    Returns:
+        The value returned by fn
+
+    Raises:
+        FingerprintTimeoutError: If the job does not finish in time
+    """
+    pool, future = _submit(fn, *args)
+    if future is None:
+        return fn(*args)
+
+    if timeout is None:
+        timeout = get_job_timeout()
+
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        retire_timed_out_pool(pool, future)
+        raise FingerprintTimeoutError(
+            f"Fingerprint processing timed out after {timeout} seconds"
+        )
+    except BrokenProcessPool:
+        discard_broken_pool(pool)
+        raise
+
+
+def extract_fingerprint_pooled(fingerprint_binary, timeout=None):
+    """
+    Run the fingerprint pipeline on the worker pool.
+
+    Args:
+        fingerprint_binary (bytes): Binary data of the fingerprint image
+        timeout (float): Seconds to wait, defaults to FINGERPRINT_JOB_TIMEOUT
+
+    Returns:
+        dict: "hash" and "minutiae", as returned by extract_fingerprint
+    """
+    if not metrics_enabled():
+        return run_fingerprint_job(
+            extract_fingerprint, fingerprint_binary, timeout=timeout
+        )
+
+    # Stage timings are measured in the worker and recorded in this process
+    features, timings = run_fingerprint_job(
+        extract_fingerprint_timed, fingerprint_binary, timeout=timeout
+    )
+    record_stage_timings(timings)
+    return features
+
+
+def extract_fingerprints_pooled(fingerprint_binaries, timeout=None):
+    """
+    Run the fingerprint pipeline on several captures in parallel.
+
+    All captures are submitted to the worker pool at once and share one
+    deadline, so a batch takes about as long as its slowest capture when
+    there are enough workers.
+
+    Args:
+        fingerprint_binaries (list): Binary data of each fingerprint image
+        timeout (float): Seconds to wait for the whole batch, defaults to
+            FINGERPRINT_JOB_TIMEOUT
+
+    Returns:
+        list: One (features, timings) tuple per capture, in input order;
+        features is the extract_fingerprint result, or the exception the
+        capture failed with and timings is then empty
+    """
+    if timeout is None:
+        timeout = get_job_timeout()
+
+    submitted = [
+        _submit(extract_fingerprint_timed, fingerprint_binary)
+        for fingerprint_binary in fingerprint_binaries
+    ]
+    deadline = time.monotonic() + timeout
+    results = []
+
+    for fingerprint_binary, (pool, future) in zip(fingerprint_binaries, submitted):
+        try:
+            if future is None:
+                features, timings = extract_fingerprint_timed(fingerprint_binary)
+            else:
+                features, timings = future.result(
+                    timeout=max(0.0, deadline - time.monotonic())
+                )
+        except TimeoutError:
+            retire_timed_out_pool(pool, future)
+            results.append(
+                (
+                    FingerprintTimeoutError(
+                        f"Fingerprint processing timed out after {timeout} seconds"
+                    ),
+                    [],
+                )
+            )
+            continue
+        except BrokenProcessPool as e:
+            discard_broken_pool(pool)
+            results.append((e, []))
+            continue
+        except Exception as e:
+            results.append((e, []))
+            continue
+
+        if metrics_enabled():
+            record_stage_timings(timings)
+        results.append((features, timings))
+
+    return results
+
+
+def process_fingerprint_pooled(fingerprint_binary, timeout=None):
+    """
+    Process a fingerprint image on the worker pool.
+
+    Args:
+        fingerprint_binary (bytes): Binary data of the fingerprint image
+        timeout (float): Seconds to wait, defaults to FINGERPRINT_JOB_TIMEOUT
+
+    Returns:
+        str: Hash of the fingerprint minutiae
+    """
+    return extract_fingerprint_pooled(fingerprint_binary, timeout)["hash"]
+
+
+def _forget_inherited_pool():
+    """
+    Drop a pool inherited through fork, e.g. by Gunicorn workers of a
+    preloaded app: its management thread does not exist in the child,
+    which starts a pool of its own on first use instead.
+    """
+    global executor, executor_lock
+    executor = None
+    executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_inherited_pool)
+atexit.register(shutdown_fingerprint_pool)
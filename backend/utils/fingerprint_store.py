@@ -0,0 +1,380 @@
+"""
+Shared on-disk store of enrolled fingerprint templates.
+
+Every API worker maps the same file read-only, so templates live once in
+the page cache however many Gunicorn workers run, and a worker starting
+cold reads the file instead of querying MongoDB.
+
+The file is append-only: enrolments append a template entry and user
+deletion appends a removal entry. Superseded entries are dropped by
+compaction, from the backend directory:
+
+    python -m utils.fingerprint_store compact
+    python -m utils.fingerprint_store rebuild
+    python -m utils.fingerprint_store stats
+"""
+
+import os
+import sys
+import mmap
+import fcntl
+import struct
+import threading
+from contextlib import contextmanager
+from database import get_db
+from utils.fingerprint_template import (
+    unpack_template,
+    pack_template,
+    template_minutiae,
+)
+
+STORE_MAGIC = b"FPTS"
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct(">4sB3x")  # magic, version, padding
+
+# Entry header: kind, owner length, template ID length, template length
+ENTRY_HEADER = struct.Struct(">BHHI")
+ENTRY_TEMPLATE = 1
+ENTRY_REMOVE_OWNER = 2
+
+
+class TemplateStore:
+    """
+    Append-only template file mapped read-only with mmap.
+
+    The in-memory index only holds offsets, keyed by user ID; template
+    records are read straight from the mapping without copying. Writers
+    from any process serialise on a lock file and append whole entries,
+    so readers only ever parse entries that are complete.
+    """
+
+    def __init__(self, path, seed=None):
+        """
+        Args:
+            path (str): Store file
+            seed (callable): Returns the (owner, template_id, data) tuples
+                a missing file is created with before anything is
+                appended, e.g. the templates already in MongoDB
+        """
+        self.path = path
+        self.seed = seed
+        self.lock = threading.RLock()
+        self.map = None
+        self.inode = None
+        self.size = 0
+        self.generation = 0
+        self.owners = {}
+
+    @contextmanager
+    def file_lock(self):
+        """Exclusive lock shared by every process writing the store"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _encode_entry(kind, owner, template_id="", data=b""):
+        owner = owner.encode("utf-8")
+        template_id = template_id.encode("utf-8")
+        return (
+            ENTRY_HEADER.pack(kind, len(owner), len(template_id), len(data))
+            + owner
+            + template_id
+            + bytes(data)
+        )
+
+    def _append(self, entry):
+        with self.file_lock():
+            # An entry appended to a fresh file would hide every template
+            # the file should have been created with
+            if self.seed is not None and not os.path.exists(self.path):
+                self._replace(self.seed())
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size == 0:
+                    entry = STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION) + entry
+                os.write(fd, entry)
+            finally:
+                os.close(fd)
+        self.refresh()
+
+    def append(self, owner, template_id, data):
+        """
+        Add a serialised template (see utils.fingerprint_template).
+
+        A later entry with the same owner and template ID replaces it.
+        """
+        self.append_many([(owner, template_id, data)])
+
+    def append_many(self, templates):
+        """
+        Add several templates in one write, e.g. a batch enrolment.
+
+        Args:
+            templates (list): (owner, template_id, data) tuples
+        """
+        self._append(
+            b"".join(
+                self._encode_entry(ENTRY_TEMPLATE, owner, template_id, data)
+                for owner, template_id, data in templates
+            )
+        )
+
+    def remove_owner(self, owner):
+        """Drop every template of a user"""
+        self._append(self._encode_entry(ENTRY_REMOVE_OWNER, owner))
+
+    def entries(self, start, end=None):
+        """
+        Parse complete entries of the mapped file.
+
+        Args:
+            start (int): Offset to start from, 0 for the beginning
+            end (int): Stop at this offset, defaults to the mapped size
+
+        Yields:
+            tuple: (kind, owner, template_id, data offset, data length,
+            offset of the next entry)
+        """
+        mapped = self.map
+        end = self.size if end is None else end
+        position = max(start, STORE_HEADER.size)
+
+        while position + ENTRY_HEADER.size <= end:
+            kind, owner_length, id_length, data_length = ENTRY_HEADER.unpack_from(
+                mapped, position
+            )
+            owner_start = position + ENTRY_HEADER.size
+            data_start = owner_start + owner_length + id_length
+            following = data_start + data_length
+            if following > end:
+                break
+
+            owner = mapped[owner_start : owner_start + owner_length].decode("utf-8")
+            template_id = mapped[owner_start + owner_length : data_start].decode(
+                "utf-8"
+            )
+            yield kind, owner, template_id, data_start, data_length, following
+            position = following
+
+    def refresh(self):
+        """
+        Map entries appended by other processes since the last refresh.
+
+        A compacted file has a new inode; it is then mapped and indexed
+        from scratch and the generation is incremented.
+        """
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+
+            if stat.st_ino != self.inode:
+                self.map = None
+                self.inode = stat.st_ino
+                self.size = 0
+                self.owners = {}
+                self.generation += 1
+
+            if stat.st_size <= max(self.size, STORE_HEADER.size):
+                return
+
+            # Earlier mappings stay alive while templates read from them
+            # are in use, so a new mapping is created rather than resized
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, version = STORE_HEADER.unpack_from(mapped)
+            if magic != STORE_MAGIC or version != STORE_VERSION:
+                raise ValueError(f"Not a version {STORE_VERSION} template store")
+
+            self.map = mapped
+            scanned = max(self.size, STORE_HEADER.size)
+
+            for kind, owner, template_id, offset, length, following in self.entries(
+                scanned, len(mapped)
+            ):
+                if kind == ENTRY_TEMPLATE:
+                    self.owners.setdefault(owner, {})[template_id] = (offset, length)
+                elif kind == ENTRY_REMOVE_OWNER:
+                    self.owners.pop(owner, None)
+                scanned = following
+
+            # Stop after the last complete entry so a partial one is re-read
+            self.size = scanned
+
+    def read(self, offset, length):
+        """Template records at an offset, backed by the mapping"""
+        return unpack_template(memoryview(self.map)[offset : offset + length])
+
+    def templates(self, owner):
+        """
+        Templates of a user.
+
+        Returns:
+            list: (template_id, record array) tuples
+        """
+        with self.lock:
+            return [
+                (template_id, self.read(offset, length))
+                for template_id, (offset, length) in self.owners.get(owner, {}).items()
+            ]
+
+    def items(self):
+        """All live templates as (owner, template_id, record array) tuples"""
+        with self.lock:
+            return [
+                (owner, template_id, self.read(offset, length))
+                for owner, templates in self.owners.items()
+                for template_id, (offset, length) in templates.items()
+            ]
+
+    def _replace(self, templates):
+        """Write templates to a new file and swap it in; caller holds the lock"""
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION))
+            for owner, template_id, data in templates:
+                f.write(self._encode_entry(ENTRY_TEMPLATE, owner, template_id, data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.refresh()
+
+    def rewrite(self, templates):
+        """
+        Atomically replace the file with the given templates.
+
+        Args:
+            templates (iterable): (owner, template_id, data) tuples
+        """
+        with self.file_lock():
+            self._replace(templates)
+
+    def initialize(self, templates):
+        """
+        Create the file from the given templates unless it already exists.
+
+        Processes starting together all call this; only the first one to
+        take the lock writes the file.
+        """
+        with self.file_lock():
+            if not os.path.exists(self.path):
+                self._replace(templates)
+        self.refresh()
+
+    def compact(self):
+        """
+        Rewrite the file with only the live templates.
+
+        Returns:
+            tuple: (file size before, file size after) in bytes
+        """
+        with self.file_lock():
+            self.refresh()
+            before = self.size
+            live = [
+                (owner, template_id, bytes(self.map[offset : offset + length]))
+                for owner, templates in self.owners.items()
+                for template_id, (offset, length) in templates.items()
+            ]
+            self._replace(live)
+        return before, self.size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "path": self.path,
+                "size_bytes": self.size,
+                "owners": len(self.owners),
+                "templates": sum(len(t) for t in self.owners.values()),
+            }
+
+
+# Store of this process, opened on first use
+template_store = None
+template_store_lock = threading.Lock()
+
+
+def get_template_store():
+    """
+    Get the template store, at FINGERPRINT_TEMPLATE_STORE (default
+    data/fingerprint_templates.bin under the working directory).
+    """
+    global template_store
+
+    with template_store_lock:
+        if template_store is None:
+            template_store = TemplateStore(
+                os.environ.get(
+                    "FINGERPRINT_TEMPLATE_STORE",
+                    os.path.join(os.getcwd(), "data", "fingerprint_templates.bin"),
+                ),
+                seed=stored_templates,
+            )
+            template_store.refresh()
+        return template_store
+
+
+def stored_templates():
+    """(owner, hash, serialised template) of every template in db.users"""
+    users = get_db().users.find(
+        {"fingerprint_templates.0": {"$exists": True}}, {"fingerprint_templates": 1}
+    )
+    for user in users:
+        for template in user["fingerprint_templates"]:
+            yield str(user["_id"]), template["hash"], pack_template(
+                template_minutiae(template)
+            )
+
+
+def rebuild_template_store(store=None):
+    """Replace the template store with the templates held in MongoDB"""
+    (store or get_template_store()).rewrite(stored_templates())
+
+
+def ensure_template_store():
+    """
+    Get the template store, creating it from db.users if no process has
+    done so yet; templates appended to a fresh file would otherwise hide
+    the ones already in MongoDB.
+    """
+    store = get_template_store()
+    if store.inode is None or not os.path.exists(store.path):
+        store.initialize(stored_templates())
+    return store
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Manage the fingerprint template store"
+    )
+    parser.add_argument(
+        "command",
+        choices=("compact", "rebuild", "stats"),
+        help="compact: drop removed and replaced templates; "
+        "rebuild: reload every template from MongoDB; stats: print counts",
+    )
+    args = parser.parse_args(argv)
+
+    store = get_template_store()
+
+    if args.command == "compact":
+        before, after = store.compact()
+        print(f"Compacted {store.path}: {before} -> {after} bytes")
+    elif args.command == "rebuild":
+        rebuild_template_store(store)
+
+    print(store.stats())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import struct
+import numpy as np
+
+# Serialised template: fixed header followed by contiguous minutia records
+TEMPLATE_MAGIC = b"FPT"
+TEMPLATE_VERSION = 1
+TEMPLATE_HEADER = struct.Struct(">3sBI")  # magic, version, minutiae count
+
+# One minutia per record, 6 bytes, big endian like the hashed representation
+MINUTIAE_DTYPE = np.dtype(
+    [("x", ">u2"), ("y", ">u2"), ("type", "u1"), ("orientation", "u1")]
+)
+
+# Largest accepted image side in pixels, so that every coordinate in the
+# original image fits the 2-byte x and y of a record
+MAX_IMAGE_SIDE = 0xFFFF
+
+# Layout hashed by process_fingerprint: 4-byte x, 4-byte y, 1-byte type
+HASH_DTYPE = np.dtype([("x", ">u4"), ("y", ">u4"), ("type", "u1")])
+
+
+def minutiae_records(points):
+    """
+    Convert (x, y, type, orientation) tuples to a minutiae record array.
+
+    Args:
+        points (list): Minutiae tuples in original image coordinates
+
+    Returns:
+        numpy.ndarray: Structured array with MINUTIAE_DTYPE
+
+    Raises:
+        ValueError: If a value does not fit its field
+    """
+    values = np.asarray(points, dtype=np.int64).reshape(-1, 4)
+    if values.size and (
+        values.min() < 0 or values[:, :2].max() > 0xFFFF or values[:, 2:].max() > 0xFF
+    ):
+        raise ValueError("Minutia outside the range of the template format")
+
+    records = np.empty(len(values), dtype=MINUTIAE_DTYPE)
+    for i, field in enumerate(MINUTIAE_DTYPE.names):
+        records[field] = values[:, i]
+    return records
+
+
+def hash_bytes(records):
+    """Bytes of the minutiae as hashed by process_fingerprint"""
+    data = np.empty(len(records), dtype=HASH_DTYPE)
+    for field in HASH_DTYPE.names:
+        data[field] = records[field]
+    return data.tobytes()
+
+
+def pack_template(records):
+    """
+    Serialise minutiae records to the versioned template format.
+
+    Returns:
+        bytes: Header followed by the records, 6 bytes per minutia
+    """
+    records = np.ascontiguousarray(records, dtype=MINUTIAE_DTYPE)
+    return (
+        TEMPLATE_HEADER.pack(TEMPLATE_MAGIC, TEMPLATE_VERSION, len(records))
+        + records.tobytes()
+    )
+
+
+def unpack_template(data):
+    """
+    Load a serialised template without copying its records.
+
+    Args:
+        data (bytes): Output of pack_template, e.g. a BSON Binary
+
+    Returns:
+        numpy.ndarray: Read-only record array backed by `data`
+
+    Raises:
+        ValueError: If the header is invalid or the data is truncated
+    """
+    if len(data) < TEMPLATE_HEADER.size:
+        raise ValueError("Template is too short")
+
+    magic, version, count = TEMPLATE_HEADER.unpack_from(data)
+    if magic != TEMPLATE_MAGIC:
+        raise ValueError("Not a fingerprint template")
+    if version != TEMPLATE_VERSION:
+        raise ValueError(f"Unsupported template version: {version}")
+    if len(data) != TEMPLATE_HEADER.size + count * MINUTIAE_DTYPE.itemsize:
+        raise ValueError("Template size does not match its header")
+
+    return np.frombuffer(
+        data, dtype=MINUTIAE_DTYPE, count=count, offset=TEMPLATE_HEADER.size
+    )
+
+
+def template_minutiae(template):
+    """
+    Minutiae records of a stored template document.
+
+    Templates enrolled before the binary format keep their minutiae as
+    lists of [x, y, type, orientation]; both forms are accepted.
+
+    Returns:
+        numpy.ndarray: Record array, empty if the template has no minutiae
+    """
+    if template.get("template") is not None:
+        return unpack_template(template["template"])
+    return minutiae_records(template.get("minutiae") or [])
+
+
+def minutiae_points(minutiae):
+    """
+    (n, 4) float array of x, y, type and orientation for matching.
+
+    Args:
+        minutiae: Record array or sequence of (x, y, type, orientation)
+    """
+    if isinstance(minutiae, np.ndarray) and minutiae.dtype.names:
+        return np.stack(
+            [minutiae[field].astype(np.float64) for field in MINUTIAE_DTYPE.names],
+            axis=1,
+        ).reshape(-1, 4)
+    return np.asarray(minutiae, dtype=np.float64).reshape(-1, 4)
@@ -0,0 +1,130 @@
+import os
+from flask import request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Bytes read from the request stream at a time
+CHUNK_SIZE = 64 * 1024
+
+# Allowance for the boundaries and text fields of a multipart body
+FORM_OVERHEAD = 64 * 1024
+
+# Fields a raw body may carry in the query string. Only ones identifying
+# the user: URLs are kept in access and proxy logs, so secrets never are
+QUERY_FIELDS = ("email",)
+
+
+class FingerprintUploadError(ValueError):
+    """Raised when a fingerprint upload is missing or too large"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def max_upload_bytes():
+    """Largest fingerprint image accepted, FINGERPRINT_UPLOAD_MAX_BYTES"""
+    return int(os.environ.get("FINGERPRINT_UPLOAD_MAX_BYTES", 5 * 1024 * 1024))
+
+
+def is_raw_upload():
+    """True if the request body is a multipart form or the image itself"""
+    mimetype = request.mimetype
+    return mimetype in (
+        "multipart/form-data",
+        "application/octet-stream",
+    ) or mimetype.startswith("image/")
+
+
+def read_limited(stream, limit):
+    """
+    Read a stream to the end, failing as soon as it exceeds a limit.
+
+    At most limit + 1 bytes are read, so an oversized or endless body is
+    rejected without being buffered.
+
+    Raises:
+        FingerprintUploadError: With status 413 if the stream is too long
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(min(CHUNK_SIZE, limit + 1 - size))
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > limit:
+            raise FingerprintUploadError(
+                f"Fingerprint image is larger than {limit} bytes", 413
+            )
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def read_fingerprint_request():
+    """
+    Read the fields and fingerprint image of a fingerprint request.
+
+    Besides JSON with a base64 "fingerprint", the image may be sent as
+    the "fingerprint" part of a multipart/form-data body, with the other
+    fields as form fields, or as the whole body (application/octet-stream
+    or image/*), with only the QUERY_FIELDS taken from the query string.
+    Raw images are read from the request stream in chunks and rejected
+    once they exceed FINGERPRINT_UPLOAD_MAX_BYTES.
+
+    Returns:
+        tuple: (fields, fingerprint binary); the binary is None for JSON
+        bodies, whose base64 image stays in fields["fingerprint"]
+
+    Raises:
+        FingerprintUploadError: If the image is too large, a raw body is
+            empty, or a password is sent in the query string
+    """
+    if not is_raw_upload():
+        return request.get_json(silent=True) or {}, None
+
+    limit = max_upload_bytes()
+    multipart = request.mimetype == "multipart/form-data"
+    body_limit = limit + FORM_OVERHEAD if multipart else limit
+
+    # Declared sizes are rejected before anything is read
+    if request.content_length is not None and request.content_length > body_limit:
+        raise FingerprintUploadError(
+            f"Fingerprint image is larger than {limit} bytes", 413
+        )
+
+    if not multipart:
+        if "password" in request.args:
+            raise FingerprintUploadError(
+                "Passwords must not be sent in the query string"
+            )
+        fingerprint_binary = read_limited(request.stream, limit)
+        if not fingerprint_binary:
+            raise FingerprintUploadError("Fingerprint data is required")
+        fields = {
+            field: request.args[field]
+            for field in QUERY_FIELDS
+            if field in request.args
+        }
+        return fields, fingerprint_binary
+
+    try:
+        # Bounds chunked bodies while the form is parsed (Flask 3.1+;
+        # older versions only apply the app-wide MAX_CONTENT_LENGTH)
+        request.max_content_length = body_limit
+    except AttributeError:
+        pass
+
+    try:
+        fields = request.form.to_dict()
+        upload = request.files.get("fingerprint")
+    except RequestEntityTooLarge:
+        raise FingerprintUploadError(
+            f"Fingerprint image is larger than {limit} bytes", 413
+        )
+
+    if upload is None:
+        return fields, None
+    fingerprint_binary = read_limited(upload.stream, limit)
+    if not fingerprint_binary:
+        raise FingerprintUploadError("Fingerprint data is required")
+    return fields, fingerprint_binary
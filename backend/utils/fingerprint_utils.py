@@ -1,46 +1,117 @@
+import os
 import hashlib
+import time
 import numpy as np
 from PIL import Image
 import io
 import cv2
+from utils.fingerprint_template import minutiae_records, hash_bytes, MAX_IMAGE_SIDE
+from utils.fingerprint_engines import register_engine, get_engine
+from utils.fingerprint_workspace import get_workspace
 
+# Minimum capture quality accepted by the early quality gate
+QUALITY_THRESHOLDS = {
+    "min_contrast": 20.0,
+    "min_foreground_ratio": 0.02,
+    "max_foreground_ratio": 0.95,
+    "min_coherence": 0.3,
+}
 
-def process_fingerprint(fingerprint_binary):
+
+class FingerprintQualityError(ValueError):
+    """Raised when a capture is too poor to be worth processing"""
+
+    def __init__(self, message, scores=None):
+        super().__init__(message)
+        self.scores = scores or {}
+
+    def __reduce__(self):
+        # Keep the scores when the error is sent back from a pool worker
+        return (self.__class__, (self.args[0], self.scores))
+
+
+def process_fingerprint(fingerprint_binary, stage_hook=None):
     """
     Process a fingerprint image to extract minutiae and generate a hash.
 
     Args:
         fingerprint_binary (bytes): Binary data of the fingerprint image
+        stage_hook (callable): Optional hook called as
+            stage_hook(stage, seconds, info) after each pipeline stage
 
     Returns:
         str: Hash of the fingerprint minutiae
     """
+    return extract_fingerprint(fingerprint_binary, stage_hook)["hash"]
+
+
+def extract_fingerprint(fingerprint_binary, stage_hook=None):
+    """
+    Run the fingerprint pipeline and return both the hash and the minutiae.
+
+    Args:
+        fingerprint_binary (bytes): Binary data of the fingerprint image
+        stage_hook (callable): Optional hook called as
+            stage_hook(stage, seconds, info) after each pipeline stage
+
+    Returns:
+        dict: "hash" (hex SHA-256 of the minutiae) and "minutiae", the sorted
+        minutiae as a record array of x, y, type and orientation (see
+        utils.fingerprint_template); the hash covers x, y and type,
+        orientation is the ridge direction in degrees (0-179). "quality"
+        holds the quality gate scores, or None when the gate is disabled
+
+    Raises:
+        FingerprintQualityError: If the capture fails the quality gate
+        ValueError: If the image cannot be processed
+    """
     try:
-        # Convert binary to image
-        image = Image.open(io.BytesIO(fingerprint_binary))
+        stage_start = time.perf_counter()
 
-        # Convert to numpy array for OpenCV processing
-        img_array = np.array(image)
+        # Decode the binary straight to a single-channel image
+        gray = decode_grayscale(fingerprint_binary)
 
-        # Convert to grayscale if it's a color image
-        if len(img_array.shape) > 2 and img_array.shape[2] > 1:
-            gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = img_array
+        stage_start = _report_stage(
+            stage_hook, "decode", stage_start, width=gray.shape[1], height=gray.shape[0]
+        )
+
+        # STEP 0: QUALITY GATE
+        # Reject blank, saturated or structureless captures before the
+        # expensive enhancement and thinning steps
+        quality = None
+        if quality_gate_enabled():
+            quality = check_quality(gray)
+
+        stage_start = _report_stage(stage_hook, "quality", stage_start)
+
+        # Intermediate images are written into buffers reused by the next
+        # call on this thread, so fixed-size captures allocate nothing here
+        workspace = get_workspace()
 
         # STEP 1: FINGERPRINT REGION DETECTION
         # 1.1 Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        blurred = cv2.GaussianBlur(
+            gray, (5, 5), 0, dst=workspace.buffer("blurred", gray.shape)
+        )
 
         # 1.2 Apply Otsu's thresholding to get a binary image
         _, binary = cv2.threshold(
-            blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
+            blurred,
+            0,
+            255,
+            cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
+            dst=workspace.buffer("region_binary", gray.shape),
         )
 
         # 1.3 Apply morphological operations to clean the binary image
-        kernel = np.ones((5, 5), np.uint8)
-        cleaned = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-        cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, kernel)
+        kernel = workspace.kernel(5)
+        closed = cv2.morphologyEx(
+            binary,
+            cv2.MORPH_CLOSE,
+            kernel,
+            dst=workspace.buffer("region_closed", gray.shape),
+        )
+        cleaned = cv2.morphologyEx(closed, cv2.MORPH_OPEN, kernel, dst=binary)
 
         # 1.4 Find contours to identify the fingerprint region
         contours, _ = cv2.findContours(
@@ -52,7 +123,8 @@ def process_fingerprint(fingerprint_binary):
             largest_contour = max(contours, key=cv2.contourArea)
 
             # 1.6 Create a mask for the fingerprint region
-            mask = np.zeros_like(gray)
+            mask = workspace.buffer("mask", gray.shape)
+            mask.fill(0)
             cv2.drawContours(mask, [largest_contour], 0, 255, -1)
 
             # 1.7 Get bounding rectangle of the fingerprint
@@ -68,9 +140,15 @@ def process_fingerprint(fingerprint_binary):
             # 1.9 Crop the fingerprint region
             fingerprint_region = gray[y : y + h, x : x + w]
 
-            # 1.10 Apply the mask to isolate the fingerprint
+            # 1.10 Apply the mask to isolate the fingerprint; pixels outside
+            # the mask are left untouched, so the reused buffer is cleared
+            masked = workspace.buffer("masked", fingerprint_region.shape)
+            masked.fill(0)
             fingerprint_masked = cv2.bitwise_and(
-                fingerprint_region, fingerprint_region, mask=mask[y : y + h, x : x + w]
+                fingerprint_region,
+                fingerprint_region,
+                mask=mask[y : y + h, x : x + w],
+                dst=masked,
             )
 
             # Use the masked fingerprint region for further processing
@@ -80,161 +158,114 @@ def process_fingerprint(fingerprint_binary):
             processed_image = gray
             x, y = 0, 0  # No cropping
 
+        stage_start = _report_stage(
+            stage_hook,
+            "region_detection",
+            stage_start,
+            width=processed_image.shape[1],
+            height=processed_image.shape[0],
+        )
+
+        # 1.11 Optionally resample the region to a common resolution
+        processed_image, scale = normalize_resolution(
+            processed_image, fingerprint_binary
+        )
+
+        stage_start = _report_stage(
+            stage_hook,
+            "normalization",
+            stage_start,
+            width=processed_image.shape[1],
+            height=processed_image.shape[0],
+        )
+
         # STEP 2: FINGERPRINT ENHANCEMENT
         # 2.1 Normalize image
-        normalized = cv2.normalize(processed_image, None, 0, 255, cv2.NORM_MINMAX)
+        shape = processed_image.shape
+        normalized = cv2.normalize(
+            processed_image,
+            workspace.buffer("normalized", shape),
+            0,
+            255,
+            cv2.NORM_MINMAX,
+        )
 
         # 2.2 Apply CLAHE for better contrast
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(normalized)
+        enhanced = workspace.clahe(2.0, (8, 8)).apply(
+            normalized, dst=workspace.buffer("enhanced", shape)
+        )
 
         # 2.3 Apply adaptive thresholding for better ridge/valley separation
         binary = cv2.adaptiveThreshold(
-            enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2
+            enhanced,
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV,
+            11,
+            2,
+            dst=workspace.buffer("ridges", shape),
         )
 
         # 2.4 Clean up the binary image
-        kernel = np.ones((3, 3), np.uint8)
-        cleaned = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-        cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, kernel)
+        kernel = workspace.kernel(3)
+        closed = cv2.morphologyEx(
+            binary,
+            cv2.MORPH_CLOSE,
+            kernel,
+            dst=workspace.buffer("ridges_closed", shape),
+        )
+        cleaned = cv2.morphologyEx(closed, cv2.MORPH_OPEN, kernel, dst=binary)
+
+        stage_start = _report_stage(
+            stage_hook,
+            "enhancement",
+            stage_start,
+            width=cleaned.shape[1],
+            height=cleaned.shape[0],
+        )
 
         # STEP 3: RIDGE THINNING (SKELETONIZATION)
-        # Zhang-Suen thinning algorithm implementation
-        def zhang_suen_thinning(image):
-            skeleton = image.copy()
-            changing = True
-            while changing:
-                changing = False
-                # First sub-iteration
-                rows, cols = skeleton.shape
-                for i in range(1, rows - 1):
-                    for j in range(1, cols - 1):
-                        if skeleton[i, j] == 255:  # Only process white pixels
-                            # Get 8-neighborhood
-                            p2 = 1 if skeleton[i - 1, j] == 255 else 0
-                            p3 = 1 if skeleton[i - 1, j + 1] == 255 else 0
-                            p4 = 1 if skeleton[i, j + 1] == 255 else 0
-                            p5 = 1 if skeleton[i + 1, j + 1] == 255 else 0
-                            p6 = 1 if skeleton[i + 1, j] == 255 else 0
-                            p7 = 1 if skeleton[i + 1, j - 1] == 255 else 0
-                            p8 = 1 if skeleton[i, j - 1] == 255 else 0
-                            p9 = 1 if skeleton[i - 1, j - 1] == 255 else 0
-
-                            # Count white neighbors
-                            white_neighbors = p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9
-
-                            if (
-                                2 <= white_neighbors <= 6
-                                and transitions([p2, p3, p4, p5, p6, p7, p8, p9, p2])
-                                == 1
-                                and p2 * p4 * p6 == 0
-                                and p4 * p6 * p8 == 0
-                            ):
-                                skeleton[i, j] = 0
-                                changing = True
-
-                # Second sub-iteration
-                for i in range(1, rows - 1):
-                    for j in range(1, cols - 1):
-                        if skeleton[i, j] == 255:  # Only process white pixels
-                            # Get 8-neighborhood
-                            p2 = 1 if skeleton[i - 1, j] == 255 else 0
-                            p3 = 1 if skeleton[i - 1, j + 1] == 255 else 0
-                            p4 = 1 if skeleton[i, j + 1] == 255 else 0
-                            p5 = 1 if skeleton[i + 1, j + 1] == 255 else 0
-                            p6 = 1 if skeleton[i + 1, j] == 255 else 0
-                            p7 = 1 if skeleton[i + 1, j - 1] == 255 else 0
-                            p8 = 1 if skeleton[i, j - 1] == 255 else 0
-                            p9 = 1 if skeleton[i - 1, j - 1] == 255 else 0
-
-                            # Count white neighbors
-                            white_neighbors = p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9
-
-                            if (
-                                2 <= white_neighbors <= 6
-                                and transitions([p2, p3, p4, p5, p6, p7, p8, p9, p2])
-                                == 1
-                                and p2 * p4 * p8 == 0
-                                and p2 * p6 * p8 == 0
-                            ):
-                                skeleton[i, j] = 0
-                                changing = True
-
-            return skeleton
-
-        def transitions(pixels):
-            # Count transitions from 0 to 1 in the ordered sequence
-            n = 0
-            for i in range(len(pixels) - 1):
-                if pixels[i] == 0 and pixels[i + 1] == 1:
-                    n += 1
-            return n
-
-        # Apply thinning
-        skeleton = zhang_suen_thinning(cleaned)
+        skeleton = get_engine("thinning")(cleaned)
+
+        stage_start = _report_stage(
+            stage_hook,
+            "thinning",
+            stage_start,
+            width=skeleton.shape[1],
+            height=skeleton.shape[0],
+        )
 
         # STEP 4: MINUTIAE EXTRACTION
-        minutiae_points = []
-        rows, cols = skeleton.shape
-
-        # Crossing Number method for minutiae extraction
-        for i in range(1, rows - 1):
-            for j in range(1, cols - 1):
-                if skeleton[i, j] == 255:  # Ridge pixel
-                    # Get 8-neighborhood
-                    p = [
-                        1 if skeleton[i - 1, j] == 255 else 0,
-                        1 if skeleton[i - 1, j + 1] == 255 else 0,
-                        1 if skeleton[i, j + 1] == 255 else 0,
-                        1 if skeleton[i + 1, j + 1] == 255 else 0,
-                        1 if skeleton[i + 1, j] == 255 else 0,
-                        1 if skeleton[i + 1, j - 1] == 255 else 0,
-                        1 if skeleton[i, j - 1] == 255 else 0,
-                        1 if skeleton[i - 1, j - 1] == 255 else 0,
-                    ]
-
-                    # Calculate crossing number
-                    cn = 0
-                    for k in range(len(p)):
-                        cn += abs(p[k] - p[(k + 1) % len(p)])
-
-                    cn = cn // 2
-
-                    # cn=1 : Ridge ending, cn=3 : Ridge bifurcation
-                    if cn == 1 or cn == 3:
-                        # Adjust coordinates to original image if cropped
-                        orig_x = j + x
-                        orig_y = i + y
-
-                        minutiae_points.append((orig_x, orig_y, cn))  # x, y, type
+        # Crossing Number method, in the coordinates of the processed region
+        minutiae_points = get_engine("minutiae_extraction")(skeleton)
+
+        stage_start = _report_stage(
+            stage_hook,
+            "minutiae_extraction",
+            stage_start,
+            minutiae=len(minutiae_points),
+        )
 
         # STEP 5: FILTER MINUTIAE
-        def filter_minutiae(points, min_distance=10):
-            filtered = []
-            for i, p1 in enumerate(points):
-                keep = True
-                for j, p2 in enumerate(filtered):
-                    # Calculate Euclidean distance
-                    dist = np.sqrt((p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2)
-                    if dist < min_distance:
-                        keep = False
-                        break
-                if keep:
-                    filtered.append(p1)
-            return filtered
-
-        minutiae_points = filter_minutiae(minutiae_points)
+        minutiae_points = get_engine("filtering")(minutiae_points)
+
+        # Local ridge direction of every kept minutia, used for matching
+        minutiae_points = add_orientations(minutiae_points, enhanced)
+
+        # Adjust coordinates to original image if cropped or resampled
+        minutiae_points = map_to_original_frame(minutiae_points, x, y, scale)
 
         # Sort minutiae points for consistent results
         minutiae_points.sort(key=lambda x: (x[0], x[1]))
 
+        stage_start = _report_stage(
+            stage_hook, "filtering", stage_start, minutiae=len(minutiae_points)
+        )
+
         # STEP 6: CREATE MINUTIAE REPRESENTATION
-        minutiae_data = b""
-        for x, y, minutiae_type in minutiae_points:
-            # Add coordinates and type to minutiae data
-            minutiae_data += int(x).to_bytes(4, byteorder="big")
-            minutiae_data += int(y).to_bytes(4, byteorder="big")
-            minutiae_data += int(minutiae_type).to_bytes(1, byteorder="big")
+        # Packed records; the hash covers 4-byte x, 4-byte y and 1-byte type
+        minutiae = minutiae_records(minutiae_points)
+        minutiae_data = hash_bytes(minutiae)
 
         # Generate hash from minutiae data
         if minutiae_data:
@@ -243,8 +274,574 @@ def process_fingerprint(fingerprint_binary):
             # Fallback to original image if no minutiae found
             fingerprint_hash = hashlib.sha256(fingerprint_binary).hexdigest()
 
-        return fingerprint_hash
+        _report_stage(stage_hook, "hashing", stage_start, minutiae=len(minutiae_points))
+
+        return {"hash": fingerprint_hash, "minutiae": minutiae, "quality": quality}
+
+    except FingerprintQualityError:
+        raise
 
     except Exception as e:
         # Re-raise the exception to be handled by the caller
         raise ValueError(f"Error processing fingerprint: {str(e)}")
+
+
+def quality_gate_enabled():
+    return os.environ.get("FINGERPRINT_QUALITY_GATE", "true").lower() == "true"
+
+
+def assess_quality(gray, block=32):
+    """
+    Score a grayscale capture with cheap global and block-wise measures.
+
+    Args:
+        gray (numpy.ndarray): Decoded grayscale image
+        block (int): Block size in pixels for the coherence measure
+
+    Returns:
+        dict: contrast (5-95 percentile spread in gray levels),
+        foreground_ratio (share of pixels darker than the Otsu threshold)
+        and coherence (mean gradient coherence of textured blocks, 0..1)
+    """
+    gray = np.ascontiguousarray(gray, dtype=np.uint8)
+
+    # Contrast and foreground share both come from one 256-bin histogram
+    histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    cumulative = np.cumsum(histogram) / gray.size
+    low, high = np.searchsorted(cumulative, (0.05, 0.95))
+
+    # Otsu threshold: level maximising the between-class variance
+    levels = np.arange(256)
+    weight = np.cumsum(histogram)
+    mean = np.cumsum(histogram * levels)
+    background = gray.size - weight
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (mean[-1] * weight - mean * gray.size) ** 2 / (weight * background)
+    variance[~np.isfinite(variance)] = 0
+    foreground_ratio = cumulative[int(np.argmax(variance))]
+
+    # Large captures are scored at half resolution, ridges stay resolved
+    while min(gray.shape) > 1024:
+        gray = cv2.pyrDown(gray)
+        block //= 2
+
+    # Structure tensor averaged per block: ridges give one dominant gradient
+    # orientation (coherence near 1), noise and smudges do not
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=5)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=5)
+
+    rows = max(1, gray.shape[0] // block)
+    cols = max(1, gray.shape[1] // block)
+    size = (rows, min(block, gray.shape[0]), cols, min(block, gray.shape[1]))
+    crop = (slice(0, size[0] * size[1]), slice(0, size[2] * size[3]))
+
+    def block_sum(values):
+        return values[crop].reshape(size).sum(axis=(1, 3))
+
+    gxx = block_sum(gx * gx)
+    gyy = block_sum(gy * gy)
+    gxy = block_sum(gx * gy)
+
+    energy = gxx + gyy
+    coherence = 0.0
+    if energy.max() > 0:
+        textured = energy > 0.1 * np.percentile(energy, 95)
+        block_coherence = np.sqrt((gxx - gyy) ** 2 + 4 * gxy**2) / np.maximum(
+            energy, 1e-6
+        )
+        coherence = float(block_coherence[textured].mean())
+
+    return {
+        "contrast": float(high - low),
+        "foreground_ratio": float(foreground_ratio),
+        "coherence": coherence,
+    }
+
+
+def check_quality(gray):
+    """
+    Run the quality gate on a decoded capture.
+
+    Returns:
+        dict: The quality scores from assess_quality
+
+    Raises:
+        FingerprintQualityError: If any score is outside QUALITY_THRESHOLDS
+    """
+    scores = assess_quality(gray)
+    reasons = []
+
+    if scores["contrast"] < QUALITY_THRESHOLDS["min_contrast"]:
+        reasons.append("low contrast")
+    if scores["foreground_ratio"] < QUALITY_THRESHOLDS["min_foreground_ratio"]:
+        reasons.append("no fingerprint area")
+    elif scores["foreground_ratio"] > QUALITY_THRESHOLDS["max_foreground_ratio"]:
+        reasons.append("saturated capture")
+    if scores["coherence"] < QUALITY_THRESHOLDS["min_coherence"]:
+        reasons.append("no ridge structure")
+
+    if reasons:
+        raise FingerprintQualityError(
+            f"Fingerprint image quality too low: {', '.join(reasons)}", scores
+        )
+
+    return scores
+
+
+# PIL modes that OpenCV decodes to the same 8-bit pixels, with the number of
+# channels imdecode returns for them
+_CV2_DECODABLE_MODES = {"L": 1, "RGB": 3, "RGBA": 4}
+
+# 16-bit gray modes, scaled to 8 bits
+_SIXTEEN_BIT_MODES = ("I;16", "I;16L", "I;16B", "I")
+
+
+def decode_grayscale(fingerprint_binary):
+    """
+    Decode an uploaded fingerprint image into a 2D uint8 array.
+
+    8-bit gray, RGB and RGBA images are decoded by OpenCV directly from the
+    byte buffer, without going through a PIL image and an extra array copy.
+    The gray values match what the pipeline has always used, so stored
+    hashes keep matching:
+
+    - colour images are converted with the channel weights the original
+      BGR2GRAY-on-RGB conversion applied (0.299 blue, 0.114 red)
+    - palette images use their palette indices as gray levels
+    - bilevel images become 0 / 255, gray with alpha keeps its gray
+      channel and 16-bit gray keeps its high byte; the original path
+      failed on these modes
+    - any other mode (CMYK, ...) goes through the original PIL path
+
+    Args:
+        fingerprint_binary (bytes): Binary data of the fingerprint image
+
+    Returns:
+        numpy.ndarray: Grayscale image
+
+    Raises:
+        FingerprintQualityError: If a side is longer than MAX_IMAGE_SIDE,
+            whose coordinates templates cannot store
+    """
+    # Image.open only parses the header here, pixel data is not decoded
+    image = Image.open(io.BytesIO(fingerprint_binary))
+
+    if max(image.size) > MAX_IMAGE_SIDE:
+        raise FingerprintQualityError(
+            f"Fingerprint image too large: {image.width}x{image.height} pixels, "
+            f"at most {MAX_IMAGE_SIDE} per side",
+            {"width": image.width, "height": image.height},
+        )
+    channels = _CV2_DECODABLE_MODES.get(image.mode)
+
+    if channels is not None:
+        # IMREAD_UNCHANGED keeps alpha and ignores EXIF orientation, like PIL
+        decoded = cv2.imdecode(
+            np.frombuffer(fingerprint_binary, dtype=np.uint8), cv2.IMREAD_UNCHANGED
+        )
+        if (
+            decoded is not None
+            and decoded.dtype == np.uint8
+            and decoded.shape[:2] == (image.height, image.width)
+            and (decoded.shape[2] if decoded.ndim == 3 else 1) == channels
+        ):
+            if channels == 1:
+                return decoded
+            # OpenCV returns BGR(A); RGB2GRAY applies the legacy weights to it
+            return cv2.cvtColor(decoded, cv2.COLOR_RGB2GRAY)
+
+    if image.mode == "1":
+        return np.array(image, dtype=np.uint8) * np.uint8(255)
+    if image.mode == "LA":
+        return np.array(image.getchannel("L"))
+    if image.mode in _SIXTEEN_BIT_MODES:
+        return (np.clip(np.array(image), 0, 65535) >> 8).astype(np.uint8)
+
+    # Fallback for formats and modes OpenCV does not decode identically
+    img_array = np.array(image)
+    if len(img_array.shape) > 2 and img_array.shape[2] > 1:
+        return cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
+    return img_array
+
+
+def read_image_dpi(fingerprint_binary):
+    """Horizontal DPI stored in the image metadata, or None if there is none"""
+    dpi = Image.open(io.BytesIO(fingerprint_binary)).info.get("dpi")
+    if not dpi or not dpi[0]:
+        return None
+    return float(dpi[0])
+
+
+def estimate_ridge_pitch(image, min_pitch=3, max_pitch=30):
+    """
+    Estimate the ridge-to-ridge distance of a fingerprint in pixels.
+
+    Uses the dominant spatial frequency of a windowed block at the centre
+    of the image, which is cheap compared to the rest of the pipeline.
+
+    Args:
+        image (numpy.ndarray): Grayscale fingerprint region
+        min_pitch (int): Smallest ridge pitch considered, in pixels
+        max_pitch (int): Largest ridge pitch considered, in pixels
+
+    Returns:
+        float or None: Ridge pitch in pixels, None if it cannot be estimated
+    """
+    size = min(256, image.shape[0], image.shape[1])
+    if size < 2 * max_pitch:
+        return None
+
+    top = (image.shape[0] - size) // 2
+    left = (image.shape[1] - size) // 2
+    block = image[top : top + size, left : left + size].astype(np.float32)
+    block -= block.mean()
+    block *= np.outer(np.hanning(size), np.hanning(size)).astype(np.float32)
+
+    power = np.abs(np.fft.rfft2(block)) ** 2
+    frequency = np.hypot(np.fft.fftfreq(size)[:, None], np.fft.rfftfreq(size)[None, :])
+    band = (frequency >= 1.0 / max_pitch) & (frequency <= 1.0 / min_pitch)
+    if not power[band].any():
+        return None
+
+    histogram, edges = np.histogram(frequency[band], bins=64, weights=power[band])
+    peak = np.argmax(histogram)
+    return float(2.0 / (edges[peak] + edges[peak + 1]))
+
+
+def normalize_resolution(image, fingerprint_binary):
+    """
+    Resample a fingerprint region to the configured resolution.
+
+    FINGERPRINT_NORMALIZATION selects the mode:
+
+    - "off" (default): the image is returned unchanged, hashes are the same
+      as they have always been
+    - "dpi": scale from the image DPI metadata (or FINGERPRINT_SOURCE_DPI)
+      to FINGERPRINT_TARGET_DPI
+    - "pitch": scale the estimated ridge pitch to
+      FINGERPRINT_TARGET_RIDGE_PITCH pixels, independent of metadata
+
+    The scale is clamped to FINGERPRINT_MIN_SCALE..FINGERPRINT_MAX_SCALE.
+
+    Args:
+        image (numpy.ndarray): Cropped grayscale fingerprint region
+        fingerprint_binary (bytes): Original upload, for its metadata
+
+    Returns:
+        tuple: (resampled image, scale factor applied)
+    """
+    mode = os.environ.get("FINGERPRINT_NORMALIZATION", "off").lower()
+    scale = 1.0
+
+    if mode == "dpi":
+        dpi = read_image_dpi(fingerprint_binary) or float(
+            os.environ.get("FINGERPRINT_SOURCE_DPI", 0)
+        )
+        if dpi:
+            scale = float(os.environ.get("FINGERPRINT_TARGET_DPI", 500)) / dpi
+    elif mode == "pitch":
+        pitch = estimate_ridge_pitch(image)
+        if pitch:
+            scale = float(os.environ.get("FINGERPRINT_TARGET_RIDGE_PITCH", 9)) / pitch
+    elif mode != "off":
+        raise ValueError(f"Unknown fingerprint normalization mode: {mode}")
+
+    scale = min(
+        max(scale, float(os.environ.get("FINGERPRINT_MIN_SCALE", 0.25))),
+        float(os.environ.get("FINGERPRINT_MAX_SCALE", 2.0)),
+    )
+
+    # Resampling for a few percent is not worth the blur it introduces
+    if abs(scale - 1.0) < 0.05:
+        return image, 1.0
+
+    width = max(1, int(round(image.shape[1] * scale)))
+    height = max(1, int(round(image.shape[0] * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+    resized = cv2.resize(image, (width, height), interpolation=interpolation)
+
+    return resized, scale
+
+
+def map_to_original_frame(points, offset_x=0, offset_y=0, scale=1.0):
+    """
+    Map minutiae from the processed region back to the uploaded image.
+
+    Args:
+        points (list): (x, y, ...) tuples in processed region coordinates
+        offset_x (int): Column of the region in the original image
+        offset_y (int): Row of the region in the original image
+        scale (float): Resampling factor applied to the region
+
+    Returns:
+        list: The same tuples with x and y in original image coordinates
+    """
+    if scale == 1.0:
+        return [(px + offset_x, py + offset_y, *rest) for px, py, *rest in points]
+
+    return [
+        (int(round(px / scale)) + offset_x, int(round(py / scale)) + offset_y, *rest)
+        for px, py, *rest in points
+    ]
+
+
+def add_orientations(points, image, sigma=7.0):
+    """
+    Append the local ridge orientation to each minutia.
+
+    The orientation comes from the smoothed gradient structure tensor of
+    the enhanced image, so it is stable between captures of the same
+    finger and independent of the skeleton's pixel noise.
+
+    Args:
+        points (list): (x, y, type) tuples in the image's coordinates
+        image (numpy.ndarray): Enhanced grayscale image
+        sigma (float): Smoothing of the structure tensor, in pixels
+
+    Returns:
+        list: (x, y, type, orientation) tuples, orientation in whole degrees
+        in 0..179
+    """
+    if not points:
+        return []
+
+    source = image.astype(np.float32)
+    gx = cv2.Sobel(source, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(source, cv2.CV_32F, 0, 1, ksize=3)
+
+    xs = np.array([p[0] for p in points])
+    ys = np.array([p[1] for p in points])
+
+    # Only the tensor values at the minutiae are needed
+    gxx = cv2.GaussianBlur(gx * gx, (0, 0), sigma)[ys, xs]
+    gyy = cv2.GaussianBlur(gy * gy, (0, 0), sigma)[ys, xs]
+    gxy = cv2.GaussianBlur(gx * gy, (0, 0), sigma)[ys, xs]
+
+    # Ridges run perpendicular to the dominant gradient direction
+    angles = np.degrees(0.5 * np.arctan2(2 * gxy, gxx - gyy)) + 90.0
+    degrees = np.round(angles).astype(int) % 180
+
+    return [(*point, angle) for point, angle in zip(points, degrees.tolist())]
+
+
+def _report_stage(stage_hook, stage, started, **info):
+    """Pass the time spent in a stage to the hook and return the new start"""
+    now = time.perf_counter()
+    if stage_hook is not None:
+        stage_hook(stage, now - started, info)
+    return now
+
+
+def _build_thinning_lut(step):
+    """
+    Build the 256-entry deletion table for one Zhang-Suen sub-iteration.
+
+    The neighbourhood code packs p2..p9 (clockwise from the pixel above) into
+    bits 0..7, so bit 6 is p8, the left neighbour.
+    """
+    lut = np.zeros(256, dtype=bool)
+    for code in range(256):
+        p2, p3, p4, p5, p6, p7, p8, p9 = [(code >> k) & 1 for k in range(8)]
+        sequence = [p2, p3, p4, p5, p6, p7, p8, p9, p2]
+        transitions = sum(
+            1
+            for k in range(len(sequence) - 1)
+            if sequence[k] == 0 and sequence[k + 1] == 1
+        )
+        if step == 1:
+            corners = p2 * p4 * p6 == 0 and p4 * p6 * p8 == 0
+        else:
+            corners = p2 * p4 * p8 == 0 and p2 * p6 * p8 == 0
+        lut[code] = 2 <= sum(sequence[:8]) <= 6 and transitions == 1 and corners
+    return lut
+
+
+_THINNING_LUTS = (_build_thinning_lut(1), _build_thinning_lut(2))
+
+
+def _thinning_pass(white, lut):
+    """
+    Run one sub-iteration over the boolean ridge mask in place.
+
+    Pixels are deleted in raster order as soon as they are visited, so each
+    pixel sees the already-updated row above and left neighbour. Rows are
+    processed one at a time; inside a row the only sequential dependency is
+    the left neighbour, which is resolved with a prefix parity scan.
+
+    Returns:
+        bool: True if at least one pixel was deleted
+    """
+    rows, cols = white.shape
+    n = cols - 2
+
+    # Neighbours below and to the right are not touched before the pixel
+    # itself is visited, so their contribution can be computed up front.
+    static = (
+        (white[1:-1, 2:].astype(np.uint8) << 2)
+        | (white[2:, 2:].astype(np.uint8) << 3)
+        | (white[2:, 1:-1].astype(np.uint8) << 4)
+        | (white[2:, :-2].astype(np.uint8) << 5)
+    )
+
+    index = np.arange(n + 1)
+    changed = False
+
+    for i in range(1, rows - 1):
+        centre = white[i, 1:-1]
+        if not centre.any():
+            continue
+
+        above = white[i - 1]
+        code = (
+            static[i - 1]
+            | above[1:-1].astype(np.uint8)
+            | (above[2:].astype(np.uint8) << 1)
+            | (above[:-2].astype(np.uint8) << 7)
+        )
+
+        # Outcome when the left neighbour survives / was just deleted
+        keep_left = centre & lut[code | (white[i, :-2].astype(np.uint8) << 6)]
+        drop_left = centre & lut[code]
+
+        if not (keep_left.any() or drop_left.any()):
+            continue
+
+        # Where both outcomes agree the decision is fixed; in between, each
+        # pixel either copies or inverts the decision of its left neighbour.
+        fixed = np.concatenate(([True], keep_left == drop_left))
+        value = np.concatenate(([False], keep_left))
+        flips = np.concatenate(([0], keep_left & ~drop_left)).cumsum()
+        anchor = np.maximum.accumulate(np.where(fixed, index, 0))
+        deleted = (value[anchor] ^ ((flips - flips[anchor]) & 1).astype(bool))[1:]
+
+        if deleted.any():
+            centre &= ~deleted
+            changed = True
+
+    return changed
+
+
+@register_engine("thinning", "numpy")
+def zhang_suen_thinning(image):
+    """
+    Thin a binary ridge image to a one-pixel-wide skeleton.
+
+    This is the sequential Zhang-Suen variant used by the pipeline since the
+    start: both sub-iterations sweep the image in raster order and update it
+    in place. The output is bit-identical to the original per-pixel loop.
+
+    Args:
+        image (numpy.ndarray): 2D uint8 image where ridge pixels are 255
+
+    Returns:
+        numpy.ndarray: Thinned copy of the image
+    """
+    skeleton = image.copy()
+    if skeleton.shape[0] < 3 or skeleton.shape[1] < 3:
+        return skeleton
+
+    white = skeleton == 255
+    original = white.copy()
+
+    changing = True
+    while changing:
+        changing = _thinning_pass(white, _THINNING_LUTS[0])
+        changing = _thinning_pass(white, _THINNING_LUTS[1]) or changing
+
+    skeleton[original & ~white] = 0
+    return skeleton
+
+
+# Weights that pack the 8-neighbourhood into the same p2..p9 bit order used
+# by the thinning tables (p2 = bit 0, clockwise from the pixel above).
+_NEIGHBOUR_WEIGHTS = np.array(
+    [[128, 1, 2], [64, 0, 4], [32, 16, 8]],
+    dtype=np.float32,
+)
+
+
+def _build_crossing_number_lut():
+    """Build the 256-entry crossing number table for packed neighbourhoods."""
+    lut = np.zeros(256, dtype=np.uint8)
+    for code in range(256):
+        p = [(code >> k) & 1 for k in range(8)]
+        lut[code] = sum(abs(p[k] - p[(k + 1) % 8]) for k in range(8)) // 2
+    return lut
+
+
+_CROSSING_NUMBER_LUT = _build_crossing_number_lut()
+
+
+@register_engine("minutiae_extraction", "numpy")
+def extract_minutiae(skeleton, offset_x=0, offset_y=0):
+    """
+    Find ridge endings and bifurcations on a skeleton with the crossing number.
+
+    Args:
+        skeleton (numpy.ndarray): Thinned uint8 image where ridge pixels are 255
+        offset_x (int): Column offset of the skeleton in the original image
+        offset_y (int): Row offset of the skeleton in the original image
+
+    Returns:
+        list: (x, y, cn) tuples in raster order, cn=1 for a ridge ending and
+        cn=3 for a bifurcation
+    """
+    if skeleton.shape[0] < 3 or skeleton.shape[1] < 3:
+        return []
+
+    white = (skeleton == 255).astype(np.uint8)
+    codes = cv2.filter2D(white, -1, _NEIGHBOUR_WEIGHTS, borderType=cv2.BORDER_CONSTANT)
+    crossing = _CROSSING_NUMBER_LUT[codes[1:-1, 1:-1]]
+
+    rows, cols = np.nonzero(
+        white[1:-1, 1:-1].astype(bool) & ((crossing == 1) | (crossing == 3))
+    )
+    return list(
+        zip(
+            (cols + 1 + offset_x).tolist(),
+            (rows + 1 + offset_y).tolist(),
+            crossing[rows, cols].tolist(),
+        )
+    )
+
+
+@register_engine("filtering", "grid")
+def filter_minutiae(points, min_distance=10):
+    """
+    Drop minutiae that lie closer than min_distance to an already kept one.
+
+    Points are visited in order and the first one in a cluster wins. Kept
+    points are bucketed on a grid with cells of min_distance, so each
+    candidate is only compared with the 3x3 block of cells around it.
+
+    Args:
+        points (list): (x, y, type) tuples in extraction order
+        min_distance (int): Minimum distance between two kept minutiae
+
+    Returns:
+        list: The kept points, in their original order
+    """
+    filtered = []
+    grid = {}
+    limit = min_distance * min_distance
+
+    for point in points:
+        cell_x = int(point[0] // min_distance)
+        cell_y = int(point[1] // min_distance)
+
+        neighbours = (
+            other
+            for dx in (-1, 0, 1)
+            for dy in (-1, 0, 1)
+            for other in grid.get((cell_x + dx, cell_y + dy), ())
+        )
+        if any(
+            (point[0] - other[0]) ** 2 + (point[1] - other[1]) ** 2 < limit
+            for other in neighbours
+        ):
+            continue
+
+        filtered.append(point)
+        grid.setdefault((cell_x, cell_y), []).append(point)
+
+    return filtered
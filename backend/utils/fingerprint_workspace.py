@@ -0,0 +1,64 @@
+import threading
+import numpy as np
+import cv2
+
+
+class FingerprintWorkspace:
+    """
+    Scratch state reused by successive pipeline runs on one thread.
+
+    Holds the morphology kernels, the CLAHE instance and one output buffer
+    per pipeline step. Buffers are reallocated only when the image size
+    changes, so a scanner that always sends the same size processes every
+    capture without allocating intermediate images. Nothing in here may
+    be returned to the caller of the pipeline, as the next run on the
+    thread overwrites it.
+    """
+
+    def __init__(self):
+        self.kernels = {}
+        self.clahe_instances = {}
+        self.buffers = {}
+
+    def kernel(self, size):
+        """Square structuring element of ones"""
+        kernel = self.kernels.get(size)
+        if kernel is None:
+            kernel = self.kernels[size] = np.ones((size, size), np.uint8)
+        return kernel
+
+    def clahe(self, clip_limit=2.0, tile_grid_size=(8, 8)):
+        """CLAHE instance; they keep internal state, so one per thread"""
+        key = (clip_limit, tile_grid_size)
+        clahe = self.clahe_instances.get(key)
+        if clahe is None:
+            clahe = self.clahe_instances[key] = cv2.createCLAHE(
+                clipLimit=clip_limit, tileGridSize=tile_grid_size
+            )
+        return clahe
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        """
+        Output buffer for one pipeline step.
+
+        Only the latest size of each buffer is kept, so memory stays
+        bounded when captures of different sizes are mixed.
+        """
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self.buffers[name] = np.empty(shape, dtype)
+        return buffer
+
+    def size_bytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+
+_local = threading.local()
+
+
+def get_workspace():
+    """Workspace of the calling thread"""
+    workspace = getattr(_local, "workspace", None)
+    if workspace is None:
+        workspace = _local.workspace = FingerprintWorkspace()
+    return workspace
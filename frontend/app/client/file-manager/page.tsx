@@ -399,9 +399,9 @@ export default function ClientFileManagerPage() {
   const processUpload = (file: File) => {
     setIsUploading(true)
 
-    // Create form data
+    // Create form data; the fields go before the file, as the server picks
+    // how to store the file from "encrypt" before it receives the first byte
     const formData = new FormData()
-    formData.append("file", file)
     formData.append("partition_id", selectedPartition)
     formData.append("encrypt", "true") // Always encrypt if fingerprint is available
 
@@ -409,6 +409,7 @@ export default function ClientFileManagerPage() {
     if (selectedFile) {
       formData.append("fingerprint", "mock-fingerprint-data")
     }
+    formData.append("file", file)
 
     // Upload file
     FileService.uploadFile(formData)
@@ -730,33 +731,26 @@ export default function ClientFileManagerPage() {
     // Get the token from localStorage
     const token = localStorage.getItem("access_token") || ""
 
-    // Prepare request parameters
-    const params: any = {}
+    // Prepare request parameters; the binary format streams the file
+    // itself instead of base64 JSON
+    const params: any = { format: "binary" }
     if (fingerprintData) {
       params.fingerprint = fingerprintData
     }
 
+    const file_name = file.file_name || "download"
+
     // Use axios to download the file
     axios
       .get(`http://localhost:5000/api/files/${fileId}/download`, {
         headers: {
           Authorization: `Bearer ${token}`,
-          "Content-Type": "application/json",
         },
         params,
+        responseType: "blob",
       })
       .then((response) => {
-        // Extract file data from response
-        const { file_data, file_name, mime_type } = response.data
-
-        // Convert base64 to blob
-        const byteCharacters = atob(file_data)
-        const byteNumbers = new Array(byteCharacters.length)
-        for (let i = 0; i < byteCharacters.length; i++) {
-          byteNumbers[i] = byteCharacters.charCodeAt(i)
-        }
-        const byteArray = new Uint8Array(byteNumbers)
-        const blob = new Blob([byteArray], { type: mime_type || "application/octet-stream" })
+        const blob: Blob = response.data
 
         // Create download link
         const url = URL.createObjectURL(blob)
@@ -775,13 +769,24 @@ export default function ClientFileManagerPage() {
           description: `File ${file_name} has been downloaded`,
         })
       })
-      .catch((error) => {
+      .catch(async (error) => {
         console.error("Download failed:", error)
         let errorMessage = "Failed to download file. Please try again."
 
-        // Extract more specific error message if available
-        if (error.response && error.response.data && error.response.data.error) {
-          errorMessage = error.response.data.error
+        // Extract more specific error message if available; error bodies
+        // are JSON, delivered as a Blob like the file would have been
+        const data = error.response && error.response.data
+        if (data instanceof Blob) {
+          try {
+            const body = JSON.parse(await data.text())
+            if (body.error) {
+              errorMessage = body.error
+            }
+          } catch {
+            // Not JSON, keep the generic message
+          }
+        } else if (data && data.error) {
+          errorMessage = data.error
         }
 
         toast({
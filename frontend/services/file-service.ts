@@ -42,13 +42,14 @@ const FileService = {
 
   downloadFile: async (fileId: string, fingerprint?: string) => {
     try {
-      const params = fingerprint ? { fingerprint } : {}
+      const params = fingerprint ? { fingerprint, format: "binary" } : { format: "binary" }
       const response = await api.get(`/api/files/${fileId}/download`, {
         params,
+        responseType: "blob",
       })
 
       // Create download link
-      const url = window.URL.createObjectURL(new Blob([response.data]))
+      const url = window.URL.createObjectURL(response.data)
       const link = document.createElement("a")
       link.href = url
 